@@ -1,7 +1,6 @@
 import logbook
 import signal
 import sys
-import dessert
 from contextlib import contextmanager, ExitStack
 
 from . import hooks as trigger_hook
@@ -17,6 +16,7 @@ from .exception_handling import handling_exceptions, inhibit_unhandled_exception
 from .loader import Loader
 from .log import ConsoleHandler
 from .utils import cli_utils
+from .utils.assertion_rewriting import rewrite_assertions_context
 from .utils.debug import debug_if_needed
 from .utils.warning_capture import warning_callback_context
 from .warnings import RecordedWarning, capture_all_warnings
@@ -106,7 +106,7 @@ class Application(object):
             self._exit_stack.enter_context(self._prelude_logging_context())
             self._exit_stack.enter_context(self._prelude_warning_context())
             self._exit_stack.enter_context(self._sigterm_context())
-            with dessert.rewrite_assertions_context():
+            with rewrite_assertions_context():
                 site.load(working_directory=self._working_directory)
 
             cli_utils.configure_arg_parser_by_plugins(self.arg_parser)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import logbook
+from sentinels import NOTHING
+
+from .__version__ import __version__
+from .conf import config
+from .core.tagging import Tags
+from .utils.path import ensure_directory
+
+_CACHE_FORMAT_VERSION = 1
+_CACHE_FILE_NAME = 'collection_cache_v{}.json'.format(_CACHE_FORMAT_VERSION)
+
+_logger = logbook.Logger(__name__)
+
+
+class CachedTestInfo(object):
+    """Lightweight description of a collected test, which can be filtered and listed without importing
+    the file it was loaded from
+    """
+
+    def __init__(self, file_path, address_in_file, factory_name, module_name=None, class_name=None,
+                 variation_id=None, variation_repr='', tags=(), requirements=()):
+        super(CachedTestInfo, self).__init__()
+        self.file_path = file_path
+        self.address_in_file = address_in_file
+        self.factory_name = factory_name
+        self.module_name = module_name
+        self.class_name = class_name
+        self.variation_id = variation_id or {}
+        self.variation_repr = variation_repr
+        self.requirements = list(requirements)
+        self._raw_tags = [list(tag) for tag in tags]
+        self.tags = Tags({name: value if has_value else NOTHING for name, value, has_value in self._raw_tags})
+
+    @classmethod
+    def from_test(cls, test):
+        metadata = test.__slash__
+        variation = metadata.variation
+        return cls(
+            file_path=metadata.file_path,
+            address_in_file=metadata.address_in_file,
+            factory_name=metadata.factory_name,
+            module_name=metadata.module_name,
+            class_name=metadata.class_name,
+            variation_id=json.loads(variation.dump_variation_dict()) if variation else None,
+            variation_repr=variation.safe_repr if variation else '',
+            tags=[(name, None if metadata.tags.get(name) is NOTHING else str(metadata.tags.get(name)),
+                   metadata.tags.get(name) is not NOTHING)
+                  for name in metadata.tags],
+            requirements=[str(req) for req in test.get_requirements()],
+        )
+
+    @property
+    def address(self):
+        returned = '{}:{}'.format(self.file_path, self.address_in_file)
+        if self.variation_repr:
+            returned += '({})'.format(self.variation_repr)
+        return returned
+
+    def get_tags(self):
+        return self.tags
+
+    def to_dict(self):
+        return {
+            'address_in_file': self.address_in_file,
+            'factory_name': self.factory_name,
+            'module_name': self.module_name,
+            'class_name': self.class_name,
+            'variation_id': self.variation_id,
+            'variation_repr': self.variation_repr,
+            'tags': self._raw_tags,
+            'requirements': self.requirements,
+        }
+
+    @classmethod
+    def from_dict(cls, file_path, d):
+        return cls(file_path=file_path, **d)
+
+    def __repr__(self):
+        return '<CachedTestInfo {}>'.format(self.address)
+
+
+class CollectionCache(object):
+    """Persistent index of the tests collected from each file, keyed by the file's stat information, content hash
+    and the chain of slashconf files affecting it
+    """
+
+    def __init__(self, cache_dir=None):
+        super(CollectionCache, self).__init__()
+        if cache_dir is None:
+            cache_dir = config.root.run.collection_cache.path
+        self._path = os.path.join(os.path.expanduser(cache_dir), _CACHE_FILE_NAME)
+        self._entries = None
+        self._dirty = False
+
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self._path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                _logger.debug('Could not read collection cache from {}', self._path)
+            else:
+                if data.get('slash_version') == __version__ and data.get('python_version') == sys.version:
+                    self._entries = data.get('files', {})
+        return self._entries
+
+    def get_test_infos(self, file_path, slashconf_paths):
+        """Returns the list of :class:`CachedTestInfo` recorded for ``file_path``, or None if there is no up-to-date entry
+        """
+        file_path = os.path.abspath(file_path)
+        entry = self._get_entries().get(file_path)
+        if entry is None:
+            return None
+        if not _same_content(entry['slashconf'], _get_fingerprints(slashconf_paths, entry['slashconf'])):
+            return None
+        current = _get_fingerprint(file_path, entry['file'])
+        if current is None or current['hash'] != entry['file']['hash']:
+            return None
+        if current != entry['file']:
+            entry['file'] = current
+            self._dirty = True
+        return [CachedTestInfo.from_dict(entry['file_path'], d) for d in entry['tests']]
+
+    def record(self, file_path, slashconf_paths, test_infos):
+        entries = self._get_entries()
+        abs_path = os.path.abspath(file_path)
+        previous = entries.get(abs_path)
+        fingerprint = _get_fingerprint(abs_path, previous['file'] if previous else None)
+        slashconf_fingerprints = _get_fingerprints(slashconf_paths, previous['slashconf'] if previous else None)
+        if fingerprint is None or None in slashconf_fingerprints:
+            return
+        entry = {
+            'file_path': file_path,
+            'file': fingerprint,
+            'slashconf': slashconf_fingerprints,
+            'tests': [info.to_dict() for info in test_infos],
+        }
+        if entry != previous:
+            entries[abs_path] = entry
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        cache_dir = os.path.dirname(self._path)
+        try:
+            ensure_directory(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.collection_cache')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'slash_version': __version__, 'python_version': sys.version, 'files': self._entries}, f)
+            os.replace(tmp_path, self._path)
+        except OSError:
+            _logger.warning('Could not write collection cache to {}', self._path, exc_info=True)
+        else:
+            self._dirty = False
+
+
+def _same_content(fingerprints, other_fingerprints):
+    if None in other_fingerprints:
+        return False
+    return [(f['path'], f['hash']) for f in fingerprints] == [(f['path'], f['hash']) for f in other_fingerprints]
+
+
+def _get_fingerprints(paths, previous=None):
+    previous = {p['path']: p for p in previous or ()}
+    return [_get_fingerprint(path, previous.get(path)) for path in paths]
+
+
+def _get_fingerprint(path, previous=None):
+    """Returns a dictionary describing the current state of ``path``. The content hash is recomputed only if
+    the stat information differs from ``previous``
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    returned = {'path': path, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+    if previous is not None and previous['mtime'] == returned['mtime'] and previous['size'] == returned['size']:
+        returned['hash'] = previous['hash']
+        return returned
+    with open(path, 'rb') as f:
+        returned['hash'] = hashlib.sha1(f.read()).hexdigest()
+    return returned
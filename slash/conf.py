@@ -96,6 +96,21 @@ config = Config({
         "user_customization_file_path": "~/.slash/slashrc",
         "resume_state_path": "~/.slash/session_states" // Doc("Path to store or load session's resume data"),
         "message_assertion_introspection": True // Doc("When False, failing assertions which have messages attached will not emit introspection info"),
+        "collection_cache": {
+            "enabled": False // Doc("Keep an on-disk index of collected tests, so that files not matching the given filters are not imported") // Cmdline(on='--collection-cache'),
+            "path": "~/.slash/collection_cache" // Doc("Directory in which the collection cache is stored"),
+        },
+        "predictive_order": False // Doc("Run the files whose tests failed in previous sessions, or which changed since their tests last ran, before all other files, so that failures are found early") // Cmdline(on='--predictive-order'),
+        "sharding": {
+            "count": 1 // Doc("Number of shards to split the collected tests into, for running them on several machines. Only the tests of the shard selected by ``run.sharding.index`` are run") // Cmdline(arg='--shard-count', metavar='NUM_SHARDS'),
+            "index": 0 // Doc("Index of the shard to run, out of ``run.sharding.count`` shards") // Cmdline(arg='--shard-index', metavar='SHARD_INDEX'),
+            "durations_file": None // Doc("Path of a test durations file (written by ``slash list --save-shard-durations``) by which shards are balanced, rather than by their number of tests. Every machine running shards of a suite must be given the same file for their shards to match") // Cmdline(arg='--shard-durations-file', metavar='PATH'),
+        },
+        "prefetch_workers": 1 // Doc("Number of processes used to prefetch test metadata, letting sessions skip importing files with no test matching the filters, and letting ``slash list --only-tests`` list tests without importing them. Sessions still import their tests sequentially, and do not use these processes when no filters are given") // Cmdline(arg='--prefetch-workers', metavar='NUM_WORKERS'),
+        "assertion_rewrite_cache": {
+            "enabled": False // Doc("Store assertion-rewritten bytecode of test and slashconf modules, keyed by their content, for reuse across sessions and parallel workers"),
+            "path": "~/.slash/assertion_rewrite_cache" // Doc("Directory in which assertion-rewritten bytecode is stored"),
+        },
         "capture": {
             "error_logs_as_errors": False // Doc("Add errors for error level logs"),
         },
@@ -111,12 +126,43 @@ config = Config({
         "server_addr": "localhost" // Doc("Server address") // Cmdline(arg='--parallel-addr', metavar="PARALLEL_SERVER_ADDRESS"),
         "server_port": 0 // Doc("Server port") // Cmdline(arg='--parallel-port', metavar="PARALLEL_SERVER_PORT"),
         "keepalive_port": 0 // Doc("Keepalive port") // Cmdline(arg='--keepalive-port', metavar="KEEPALIVE_SERVER_PORT"),
+        "transport": "xmlrpc" // Doc("Transport used between the parent and its workers: xmlrpc, or unix for pickled messages over unix domain sockets") // Cmdline(arg='--parallel-transport', metavar="TRANSPORT"),
+        "server_path": None // Doc("Server unix socket path, when using the unix transport") // Cmdline(arg='--parallel-server-path', metavar="PARALLEL_SERVER_PATH"),
+        "keepalive_path": None // Doc("Keepalive unix socket path, when using the unix transport") // Cmdline(arg='--keepalive-path', metavar="KEEPALIVE_SERVER_PATH"),
         "parent_session_id": None // Doc("parent session id") // Cmdline(arg='--parallel-parent-session-id', metavar="MASTER_SESSION_ID"),
-        "communication_timeout_secs": 60 // Doc("timeout of worker in seconds"),
+        "communication_timeout_secs": 60 // Doc("timeout of worker in seconds. Connected workers which send no request to the parent for this long are considered hung"),
+        "watch_worker_exits": True // Doc("Detect workers exiting through process exit notifications, instead of having them send heartbeats every second. Heartbeats are still used when the exit of some workers cannot be watched, e.g. when running in tmux"),
         "worker_connect_timeout": 10 // Doc("timeout for each worker to connect"),
         "no_request_timeout": 20 // Doc("timeout for server not getting requests"),
+        "schedule_by_duration": False // Doc("Hand out files with the longest expected durations first, according to test durations recorded in previous sessions, and keep workers on the same file when possible") // Cmdline(on='--parallel-schedule-by-duration'),
+        "fixture_affinity": False // Doc("Hand out tests sharing a module and the parameters of their module- and session-scoped fixtures to the same worker, so that these fixtures are set up as few times as possible. Idle workers take over tests from the end of the largest remaining group") // Cmdline(on='--parallel-fixture-affinity'),
+        "max_batch_size": 1 // Doc("Maximal number of tests handed to a worker at once. Batches are sized according to the average test duration, and their results are reported together") // Cmdline(arg='--parallel-batch-size', metavar="MAX_BATCH_SIZE"),
+        "batch_target_duration": 1.0 // Doc("Approximate duration, in seconds, of each batch of tests handed to a worker, when parallel.max_batch_size is greater than 1"),
+        "fork_server": False // Doc("Fork workers from a template process which has already imported slash, instead of starting a new interpreter for each worker") // Cmdline(on='--parallel-fork-server'),
+        "fork_server_preload": [] // Doc("Additional modules imported by the template process workers are forked from, when parallel.fork_server is set"),
+        "elastic": {
+            "enabled": False // Doc("Start additional workers while many tests remain unstarted and the machine is not loaded, and retire them when it becomes overloaded") // Cmdline(on='--parallel-elastic'),
+            "max_workers": None // Doc("Maximal number of workers running at once in elastic mode. Defaults to the number of CPUs") // Cmdline(arg='--parallel-max-workers', metavar="MAX_WORKERS"),
+            "min_unstarted_tests_per_worker": 10 // Doc("Start an additional worker only if at least this many unstarted tests remain for each running worker"),
+            "max_load_per_cpu": 0.8 // Doc("Start additional workers only while the 1-minute load average per CPU is below this value"),
+            "retire_load_per_cpu": 1.2 // Doc("Retire additional workers when the 1-minute load average per CPU is above this value. Must not be lower than parallel.elastic.max_load_per_cpu, so that workers are not retired right after being started"),
+            "scaling_interval": 10 // Doc("Minimal number of seconds between starting or retiring two workers"),
+        },
         "worker_error_file": "errors-worker" // Doc("worker error filename template"),
+        "result_traceback_variables": True // Doc("Include the variables and code of traceback frames in the results workers send to the parent. Disabling this makes the results of failing tests much smaller, but the parent's logs and reports no longer show these variables"),
+        "lazy_worker_collection": False // Doc("Make workers skip collecting the entire suite, and only load the files of tests assigned to them") // Cmdline(on='--parallel-lazy-collection'),
         "workers_error_dir": None // Doc("workers error directory") // Cmdline(arg='--workers-error-dir', metavar="WORKERS_ERROR_DIR"),
+        "agents": {
+            "num_workers": 0 // Doc("Number of the parallel workers started by ``slash agent`` processes connecting to the server, possibly from other hosts, rather than by the parent process") // Cmdline(arg='--parallel-agent-workers', metavar="NUM_AGENT_WORKERS"),
+            "tree_patterns": ['*.py', '.slashrc'] // Doc("File name patterns of the files under the parent's working directory which are copied to the working directories of agents"),
+        },
+        "project_root": None // Doc("Working directory of the parent process, when the worker runs in a copy of its project tree made by ``slash agent``") // Cmdline(arg='--parallel-project-root', metavar="PROJECT_ROOT"),
+    },
+    "daemon": {
+        "socket_path": "~/.slash/daemon.sock" // Doc("Unix socket on which ``slash daemon`` listens, and to which ``slash --daemon`` sends commands"),
+        "preload_modules": [] // Doc("Modules imported by ``slash daemon`` when it starts"),
+        "learn_imports": True // Doc("Make ``slash daemon`` import the modules imported by each session it runs, so that later sessions do not have to. Learned modules outside the standard library and installed packages are imported again when any of their files change"),
+        "learn_imports_from": None // Doc("Directories from which modules imported by sessions are learned by ``slash daemon``. Defaults to the directories of the standard library and of installed packages, since importing project modules (which may start threads or have other side effects) into the daemon can make forking it unsafe"),
     },
     "resume": {
         "failed_first": False // Doc("Run failed tests of previous session before all others") // Cmdline(on='--failed-first', metavar="FAILED_FIRST"),
@@ -124,7 +170,9 @@ config = Config({
         "failed_only": False // Doc("Run only failed tests of previous session") // Cmdline(on='--failed-only', metavar="FAILED_ONLY"),
         "unstarted_only": False // Doc("Run only unstarted tests of previous session") // Cmdline(on='--unstarted-only', metavar="UNSTARTED_ONLY"),
         "no_skipped": False // Doc("Run tests of previous session without skipped tests") // Cmdline(on='--no-skipped', metavar="NO_SKIPPED"),
-        "state_retention_days": 10 // Doc("Number of days to keep session entries for resuming session")
+        "state_retention_days": 10 // Doc("Number of days to keep session entries for resuming session"),
+        "history_retention_days": 30 // Doc("Number of days to keep the durations and statuses of tests run in previous sessions"),
+        "state_cleanup_interval_hours": 6 // Doc("Minimal number of hours between cleanups of session entries older than ``resume.state_retention_days``"),
     },
     "tmux": {
         "enabled": False // Doc("Run inside tmux") // Cmdline(on="--tmux"),
@@ -1,6 +1,6 @@
 import os
-import dessert
 from emport import import_file
+from ..utils.assertion_rewriting import rewrite_assertions_context
 from ..utils.python import check_duplicate_functions
 
 class LocalConfig(object):
@@ -35,6 +35,13 @@ class LocalConfig(object):
                     if file_name.endswith(".py"):
                         yield os.path.join(root, file_name)
 
+    def get_slashconf_paths(self, path):
+        """Returns the paths of all slashconf files affecting ``path``, from the innermost directory upwards
+        """
+        return [slashconf_path
+                for dir_path in self._traverse_upwards(path)
+                for slashconf_path in sorted(self._iter_slashconf_paths(dir_path))]
+
     def _build_config(self, path):
         confstack = []
         for dir_path in self._traverse_upwards(path):
@@ -43,7 +50,7 @@ class LocalConfig(object):
                 slashconf_vars = {}
                 for slashconf_path in self._iter_slashconf_paths(dir_path):
                     self.duplicate_funcs |= check_duplicate_functions(slashconf_path)
-                    with dessert.rewrite_assertions_context():
+                    with rewrite_assertions_context():
                         slashconf_vars.update(vars(import_file(slashconf_path)))
 
             if slashconf_vars:
@@ -1,7 +1,6 @@
 import functools
 import itertools
 import os
-import pickle
 import sys
 from numbers import Number
 import gossip
@@ -11,13 +10,15 @@ from vintage import deprecated
 
 from .. import hooks
 from ..ctx import context
-from ..exception_handling import capture_sentry_exception, handling_exceptions
+from ..exception_handling import handling_exceptions
 from .. import exceptions
 from ..utils.exception_mark import ExceptionMarker
 from ..utils.interactive import notify_if_slow_context
 from ..utils.python import unpickle
+from ..conf import config
 from .details import Details
 from .error import Error
+from .result_serialization import deserialize_result, is_serialized_result, serialize_result
 
 _logger = logbook.Logger(__name__)
 
@@ -27,7 +28,7 @@ _ADDED_TO_RESULT = ExceptionMarker('added_to_result')
 class Result(object):
     """Represents a single result for a test which was run
     """
-    pickle_key_blacklist = {'test_metadata', 'facts'}
+    pickle_key_blacklist = {'test_metadata', 'facts', '_index', '_position', '_indexed_state'}
 
     def __init__(self, test_metadata=None):
         super(Result, self).__init__()
@@ -47,6 +48,14 @@ class Result(object):
         self._interrupted = False
         self._log_path = None
         self._extra_logs = []
+        #: the :class:`_ResultsIndex` of the session results this result belongs to, kept up to date on state changes
+        self._index = None
+        self._position = None
+        self._indexed_state = None
+
+    def _update_index(self):
+        if self._index is not None:
+            self._index.update(self)
 
     def _fact_set_callback(self, fact_name, fact_value):
         gossip.trigger('slash.fact_set', name=fact_name, value=fact_value)
@@ -55,29 +64,32 @@ class Result(object):
         return False
 
     def serialize(self):
-        serialized_object = {}
-        for key, value in vars(self).items():
-            if key not in Result.pickle_key_blacklist:
-                try:
-                    serialized_object[key] = pickle.dumps(value)
-                except (pickle.PicklingError, TypeError):
-                    _logger.debug('Failed serializing result, skipping this value. key = {}', key)
-                    capture_sentry_exception()
-        return serialized_object
+        """Returns a dictionary describing this result, used by parallel workers to send it to the parent (see
+        :mod:`slash.core.result_serialization`)
+        """
+        return serialize_result(self, traceback_variables=config.root.parallel.result_traceback_variables)
 
     def deserialize(self, result_dict):
-        for key, value in result_dict.items():
-            try:
-                self.__dict__[key] = unpickle(value)
-            except TypeError:
-                _logger.error('Error when deserialize reult, skipping this value. key = {}', key,
-                              extra={'capture': False})
+        if is_serialized_result(result_dict):
+            deserialize_result(self, result_dict)
+        else:
+            self._deserialize_pickled_attributes(result_dict)
         for failure in self._failures:
             self.add_failure(failure, append=False)
         for error in self._errors:
             self.add_error(error, append=False)
         for skip in self._skips:
             self.add_skip(skip, append=False)
+        self._update_index()
+
+    def _deserialize_pickled_attributes(self, result_dict):
+        # the format used by workers of earlier versions
+        for key, value in result_dict.items():
+            try:
+                self.__dict__[key] = unpickle(value)
+            except TypeError:
+                _logger.error('Error when deserialize reult, skipping this value. key = {}', key,
+                              extra={'capture': False})
 
     def add_exception(self, exc_info=None):
         """Adds the currently active exception, assuming it wasn't already added to a result
@@ -158,6 +170,7 @@ class Result(object):
     def mark_started(self):
         self._start_time = datetime.now()
         self._started = True
+        self._update_index()
 
     def is_error(self):
         return bool(self._errors)
@@ -195,9 +208,11 @@ class Result(object):
     def mark_finished(self):
         self._end_time = datetime.now()
         self._finished = True
+        self._update_index()
 
     def mark_interrupted(self):
         self._interrupted = True
+        self._update_index()
 
     def is_interrupted(self):
         return self._interrupted
@@ -235,6 +250,7 @@ class Result(object):
             error.log_added()
             if append:
                 error_list.append(error)
+                self._update_index()
             #report children errors or parent session errors only
             if not context.session or not context.session.has_children() or self.is_global_result():
                 hooks.error_added(result=self, error=error)  # pylint: disable=no-member
@@ -247,6 +263,7 @@ class Result(object):
     def add_skip(self, reason, append=True):
         if append:
             self._skips.append(reason)
+            self._update_index()
         context.reporter.report_test_skip_added(context.test, reason)
 
     def get_duration(self):
@@ -315,15 +332,123 @@ class GlobalResult(Result):
             return True
         if self._session_results.session.has_children() and self._session_results.session.parallel_manager.server.worker_error_reported:
             return False
-        return all(result.is_success(allow_skips=allow_skips) for result in self._session_results.iter_test_results())
+        index = self._session_results._get_index()  # pylint: disable=protected-access
+        num_successful = index.get_count('success_with_skips' if allow_skips else 'success')
+        return self._session_results.get_num_results() == num_successful
+
+
+class _ResultsIndex(object):
+    """Indexes the test results of a session by position, address, file and state. Results update the index whenever
+    their state changes, so that counting them or finding those in uncommon states (e.g. failed tests) does not
+    iterate over all results
+    """
+
+    _STATES = ('started', 'success', 'success_with_skips', 'success_finished', 'error', 'just_failure', 'skip',
+               'run_and_skip', 'not_run', 'interrupted')
+    # states whose results are kept in buckets as well as counted, mapping positions to results. Most results are
+    # successful, so successful results are only counted
+    _BUCKETED_STATES = ('error', 'just_failure', 'skip', 'not_run', 'interrupted')
+
+    def __init__(self):
+        super(_ResultsIndex, self).__init__()
+        self.results = []
+        # addresses are unique unless tests are repeated, so results are only put in lists when they share an address
+        self._by_address = {}
+        self._by_file = {}
+        self._counts = [0] * len(self._STATES)
+        self._state_indices = {name: index for index, name in enumerate(self._STATES)}
+        self._buckets = {self._state_indices[name]: {} for name in self._BUCKETED_STATES}
+
+    def add(self, result):
+        # pylint: disable=protected-access
+        result._index = self
+        result._position = len(self.results)
+        result._indexed_state = (False,) * len(self._STATES)
+        self.results.append(result)
+        if result.test_metadata is not None:
+            address = result.test_metadata.address
+            existing = self._by_address.setdefault(address, result)
+            if existing is not result:
+                if not isinstance(existing, list):
+                    existing = self._by_address[address] = [existing]
+                existing.append(result)
+            self._by_file.setdefault(result.test_metadata.file_path, []).append(result)
+        self.update(result)
+
+    @staticmethod
+    def _get_state(result):
+        # pylint: disable=protected-access
+        # equivalent to calling the predicates of Result named by _STATES, which is too slow on every state change
+        started = result._started
+        error = bool(result._errors)
+        failure = bool(result._failures)
+        skip = bool(result._skips)
+        unsuccessful = error or failure or result._interrupted
+        success = not unsuccessful and not skip and started
+        return (started, success, not unsuccessful and (skip or started), success and result._finished, error,
+                failure and not error, skip, started and skip, not started and not (error or failure),
+                result._interrupted)
+
+    def update(self, result):
+        # pylint: disable=protected-access
+        state = self._get_state(result)
+        prev_state = result._indexed_state
+        if prev_state == state:
+            return
+        for index, (prev_value, value) in enumerate(zip(prev_state, state)):
+            if prev_value == value:
+                continue
+            self._counts[index] += value - prev_value
+            bucket = self._buckets.get(index)
+            if bucket is None:
+                continue
+            if value:
+                bucket[result._position] = result
+            else:
+                bucket.pop(result._position, None)
+        result._indexed_state = state
+
+    def get_by_address(self, address):
+        returned = self._by_address.get(address, ())
+        return list(returned) if isinstance(returned, (list, tuple)) else [returned]
+
+    def get_by_file(self, file_path):
+        return list(self._by_file.get(file_path, ()))
+
+    def get_count(self, state):
+        return self._counts[self._state_indices[state]]
+
+    def iter_results(self, states):
+        """Iterates over the results in any of the given states, in the order of their tests
+        """
+        state_indices = [self._state_indices[state] for state in states]
+        if all(index in self._buckets for index in state_indices):
+            positions = set()
+            for index in state_indices:
+                positions.update(self._buckets[index])
+            return (self.results[position] for position in sorted(positions))
+        return (result for result in self.results
+                if any(result._indexed_state[index] for index in state_indices))  # pylint: disable=protected-access
 
 
 class SessionResults(object):
 
+    #: statuses which can be passed to :meth:`iter_test_results`, mapped to the states of :class:`_ResultsIndex`
+    _STATUSES = {
+        'started': 'started',
+        'success': 'success_finished',
+        'error': 'error',
+        'failure': 'just_failure',
+        'skip': 'skip',
+        'not_run': 'not_run',
+        'interrupted': 'interrupted',
+    }
+
     def __init__(self, session):
         super(SessionResults, self).__init__()
         self.session = session
         self.global_result = GlobalResult(self)
+        self._index = _ResultsIndex()
         self._results_dict = {}
         self._iterator = functools.partial(iter, self._results_dict.values())
 
@@ -347,7 +472,7 @@ class SessionResults(object):
 
         yields tuples of the form (result, failure_list)
         """
-        for result in self.iter_all_results():
+        for result in itertools.chain(self.iter_test_results('error', 'failure'), [self.global_result]):
             if result.get_failures():
                 yield result, result.get_failures()
 
@@ -356,7 +481,7 @@ class SessionResults(object):
 
         yields tuples of the form (result, errors_list)
         """
-        for result in self.iter_all_results():
+        for result in itertools.chain(self.iter_test_results('error'), [self.global_result]):
             if result.get_errors():
                 yield result, result.get_errors()
 
@@ -381,30 +506,38 @@ class SessionResults(object):
     def is_interrupted(self):
         """Indicates if this session was interrupted
         """
-        return any(result.is_interrupted() for result in self._iterator())
+        return self._get_index().get_count('interrupted') > 0
 
     def get_num_results(self):
         return len(self._results_dict)
 
+    def _get_index(self):
+        if len(self._index.results) != len(self._results_dict):
+            # results placed in the dictionary directly are indexed once the index is used
+            self._index = _ResultsIndex()
+            for result in self._results_dict.values():
+                self._index.add(result)
+        return self._index
+
     def get_num_started(self):
-        return self._count(Result.is_started, include_global=False)
+        return self._get_index().get_count('started')
 
     def get_num_successful(self):
-        return self._count(Result.is_success_finished, include_global=False)
+        return self._get_index().get_count('success_finished')
 
     def get_num_errors(self):
-        return self._count(Result.is_error)
+        return self._get_index().get_count('error') + int(self.global_result.is_error())
 
     def get_num_failures(self):
-        return self._count(Result.is_just_failure)
+        return self._get_index().get_count('just_failure') + int(self.global_result.is_just_failure())
 
     def get_num_skipped(self, include_not_run=True):
         if include_not_run:
-            return self._count(Result.is_skip)
-        return self._count(Result.is_run_and_skip)
+            return self._get_index().get_count('skip') + int(self.global_result.is_skip())
+        return self._get_index().get_count('run_and_skip') + int(self.global_result.is_run_and_skip())
 
     def get_num_not_run(self):
-        return self._count(Result.is_not_run, include_global=False)
+        return self._get_index().get_count('not_run')
 
     def has_fatal_errors(self):
         """Indicates whether any result has an error marked as fatal (causing the session to terminate)
@@ -420,10 +553,40 @@ class SessionResults(object):
                 returned += 1
         return returned
 
-    def iter_test_results(self):
-        """Iterates over results belonging to tests
+    def iter_test_results(self, *statuses):
+        """Iterates over results belonging to tests, in the order of their tests
+
+        :param statuses: if given, only results in any of these statuses are returned. Statuses can be ``'started'``,
+          ``'success'``, ``'error'``, ``'failure'`` (failures without errors), ``'skip'``, ``'not_run'`` and
+          ``'interrupted'``. Results with errors, failures, skips, not run or interrupted are looked up without iterating
+          over all results
         """
-        return iter(self)
+        if not statuses:
+            return iter(self)
+        try:
+            states = [self._STATUSES[status] for status in statuses]
+        except KeyError as e:
+            raise ValueError('Unknown result status {}'.format(e))
+        return self._get_index().iter_results(states)
+
+    def get_results_by_address(self, address):
+        """Returns the list of results of tests with the given address (more than one when tests are repeated)
+        """
+        return self._get_index().get_by_address(address)
+
+    def get_results_by_file(self, file_path):
+        """Returns the list of results of tests in the given file, as found in their :attr:`test_metadata.file_path`
+        """
+        return self._get_index().get_by_file(file_path)
+
+    def index(self, result):
+        """Returns the position of a test result among the results of the session
+        """
+        index = self._get_index()
+        position = result._position  # pylint: disable=protected-access
+        if result._index is not index:  # pylint: disable=protected-access
+            raise ValueError('{!r} is not a result of this session'.format(result))
+        return position
 
     def iter_all_results(self):
         """Iterates over all results, ending with the global result object
@@ -436,6 +599,7 @@ class SessionResults(object):
 
         returned = Result(test.__slash__)
         self._results_dict[test.__slash__.id] = returned
+        self._index.add(returned)
         return returned
 
     def get_result(self, test):
@@ -451,9 +615,6 @@ class SessionResults(object):
         return self._results_dict.get(test.__slash__.id)
 
     def __getitem__(self, test):
-        if isinstance(test, Number):
-            try:
-                return next(itertools.islice(self._results_dict.values(), test, test + 1))
-            except StopIteration:
-                raise IndexError()
+        if isinstance(test, (Number, slice)):
+            return self._get_index().results[test]
         return self.get_result(test)
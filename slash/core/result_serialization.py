@@ -0,0 +1,301 @@
+"""Compact, versioned encoding of test results, used by parallel workers to send results to the parent.
+
+A result is encoded as nested tuples of builtin values with :mod:`marshal`. The strings of traceback frames (file
+names, code lines, variable names and values), which make up most of the results of failing tests, are stored once
+per result in a string table and referred to by index. User data (``result.data`` and ``result.details``) and
+attributes outside the schema are pickled, as before.
+"""
+import importlib
+import marshal
+import pickle
+from datetime import datetime
+
+import arrow
+import logbook
+
+from ..exception_handling import capture_sentry_exception
+from ..utils.python import unpickle
+from ..utils.traceback_utils import DistilledFrame, DistilledTraceback
+from .error import Error
+
+_logger = logbook.Logger(__name__)
+
+FORMAT_VERSION = 1
+FORMAT_VERSION_KEY = 'format_version'
+PAYLOAD_KEY = 'payload'
+
+# format 4 is the same for all supported Python versions
+_MARSHAL_VERSION = 4
+
+_RESULT_FIELDS = ('strings', 'started', 'finished', 'interrupted', 'start_time', 'end_time', 'log_path', 'extra_logs',
+                  'errors', 'failures', 'skips', 'details', 'data', 'extra')
+_ERROR_FIELDS = ('message', 'exception_type', 'exception_str', 'arg', 'time', 'fatal', 'failure', 'custom_message',
+                 'exception_attributes', 'frames', 'extra')
+# frames are tuples of ('filename', 'lineno', 'func_name', 'code_line', 'code_string', 'is_in_test_code', 'globals',
+# 'locals'), with strings (including variable names and values) replaced by their indices in the string table
+
+# attributes encoded explicitly, or not sent at all
+_RESULT_SCHEMA_ATTRIBUTES = frozenset([
+    'test_metadata', 'facts', 'data', 'details', '_start_time', '_end_time', '_errors', '_failures', '_skips',
+    '_started', '_finished', '_interrupted', '_log_path', '_extra_logs'])
+_ERROR_SCHEMA_ATTRIBUTES = frozenset([
+    'message', 'exception_type', 'exception_str', 'arg', 'time', '_fatal', '_is_failure', '_has_custom_message',
+    '_exception_attributes', 'traceback', 'exc_info', '_cached_detailed_traceback_str'])
+
+
+def serialize_result(result, traceback_variables=True):
+    """Returns a dictionary describing ``result``, which can be sent by any parallel transport. When
+    ``traceback_variables`` is False, the variables and code of traceback frames are omitted
+    """
+    encoder = _Encoder(traceback_variables)
+    errors = [encoder.encode_error(error) for error in result._errors]  # pylint: disable=protected-access
+    failures = [encoder.encode_error(error) for error in result._failures]  # pylint: disable=protected-access
+    payload = (
+        encoder.get_strings(),
+        result._started,  # pylint: disable=protected-access
+        result._finished,  # pylint: disable=protected-access
+        result._interrupted,  # pylint: disable=protected-access
+        _encode_datetime(result._start_time),  # pylint: disable=protected-access
+        _encode_datetime(result._end_time),  # pylint: disable=protected-access
+        result._log_path,  # pylint: disable=protected-access
+        list(result._extra_logs),  # pylint: disable=protected-access
+        errors,
+        failures,
+        [_pickle('skip', skip) if not isinstance(skip, (str, type(None))) else skip
+         for skip in result._skips],  # pylint: disable=protected-access
+        _pickle('details', result.details) if result.details else None,
+        _pickle('data', result.data) if result.data else None,
+        _pickle_extra_attributes(result, _RESULT_SCHEMA_ATTRIBUTES | result.pickle_key_blacklist),
+    )
+    return {FORMAT_VERSION_KEY: FORMAT_VERSION, PAYLOAD_KEY: marshal.dumps(payload, _MARSHAL_VERSION)}
+
+
+def is_serialized_result(result_dict):
+    return FORMAT_VERSION_KEY in result_dict
+
+
+def deserialize_result(result, result_dict):
+    """Sets the attributes of ``result`` according to a dictionary returned by :func:`serialize_result`
+    """
+    fields = _load_fields(result_dict)
+    decoder = _Decoder(fields['strings'])
+    result._started = fields['started']  # pylint: disable=protected-access
+    result._finished = fields['finished']  # pylint: disable=protected-access
+    result._interrupted = fields['interrupted']  # pylint: disable=protected-access
+    result._start_time = _decode_datetime(fields['start_time'])  # pylint: disable=protected-access
+    result._end_time = _decode_datetime(fields['end_time'])  # pylint: disable=protected-access
+    result._log_path = fields['log_path']  # pylint: disable=protected-access
+    result._extra_logs = fields['extra_logs']  # pylint: disable=protected-access
+    result._errors = [decoder.decode_error(error) for error in fields['errors']]  # pylint: disable=protected-access
+    result._failures = [decoder.decode_error(error) for error in fields['failures']]  # pylint: disable=protected-access
+    result._skips = [unpickle(skip) if isinstance(skip, bytes) else skip  # pylint: disable=protected-access
+                     for skip in fields['skips']]
+    if fields['details'] is not None:
+        result.details = unpickle(fields['details'])
+    if fields['data'] is not None:
+        result.data = unpickle(fields['data'])
+    _unpickle_extra_attributes(result, fields['extra'])
+
+
+def get_serialized_outcome(result_dict):
+    """Returns whether a serialized result is successful (allowing skips) and whether it has fatal errors, without
+    creating its error objects
+    """
+    if not is_serialized_result(result_dict):
+        return _get_legacy_outcome(result_dict)
+    fields = _load_fields(result_dict)
+    exceptions = fields['errors'] + fields['failures']
+    has_fatal_errors = any(dict(zip(_ERROR_FIELDS, error))['fatal'] for error in exceptions)
+    if exceptions or fields['interrupted']:
+        return False, has_fatal_errors
+    return bool(fields['skips']) or fields['started'], has_fatal_errors
+
+
+def _get_legacy_outcome(result_dict):
+    # results sent by workers of earlier versions pickle each attribute separately
+    def _get(key, default):
+        value = result_dict.get(key)
+        return default if value is None else unpickle(value)
+    exceptions = _get('_errors', []) + _get('_failures', [])
+    has_fatal_errors = any(e.is_fatal() for e in exceptions)
+    if exceptions or _get('_interrupted', False):
+        return False, has_fatal_errors
+    return bool(_get('_skips', [])) or _get('_started', False), has_fatal_errors
+
+
+def _load_fields(result_dict):
+    version = result_dict[FORMAT_VERSION_KEY]
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported result format version {} (supported version: {})'.format(version, FORMAT_VERSION))
+    # XML-RPC wraps binary data in Binary objects, while other transports pass bytes as they are
+    payload = result_dict[PAYLOAD_KEY]
+    return dict(zip(_RESULT_FIELDS, marshal.loads(getattr(payload, 'data', payload))))
+
+
+class _Encoder(object):
+
+    def __init__(self, traceback_variables):
+        super(_Encoder, self).__init__()
+        # strings are numbered in insertion order, so the keys of this dictionary form the string table
+        self._string_indices = {}
+        self._traceback_variables = traceback_variables
+
+    def get_strings(self):
+        return list(self._string_indices)
+
+    def intern(self, string):
+        return self._string_indices.setdefault(string, len(self._string_indices))
+
+    def encode_error(self, error):
+        frames = None
+        if error.traceback is not None:
+            frames = [self._encode_frame(frame) for frame in error.traceback.frames]
+        exception_type = None
+        if error.exception_type is not None:
+            exception_type = (error.exception_type.__module__, error.exception_type.__qualname__)
+        return (
+            error.message,
+            exception_type,
+            error.exception_str,
+            _pickle('error argument', error.arg) if error.arg is not None else None,
+            _encode_datetime(error.time.to('UTC').datetime.replace(tzinfo=None)),
+            error.is_fatal(),
+            error.is_failure(),
+            error.has_custom_message(),
+            _marshal_or_pickle(error._exception_attributes),  # pylint: disable=protected-access
+            frames,
+            _pickle_extra_attributes(error, _ERROR_SCHEMA_ATTRIBUTES),
+        )
+
+    def _encode_frame(self, frame):
+        frame_dict = frame.to_dict()
+        if self._traceback_variables:
+            global_variables = self._encode_variables(frame_dict['globals'])
+            local_variables = self._encode_variables(frame_dict['locals'])
+            code_string = frame_dict['code_string']
+        else:
+            global_variables = local_variables = ()
+            code_string = None
+        intern = self.intern
+        return (intern(frame_dict['filename']), frame_dict['lineno'], intern(frame_dict['func_name']),
+                intern(frame_dict['code_line']), intern(code_string), frame_dict['is_in_test_code'],
+                global_variables, local_variables)
+
+    def _encode_variables(self, variables):
+        """Returns the names and values of ``variables`` as a flat tuple of string indices
+        """
+        indices = self._string_indices
+        return tuple(indices.setdefault(string, len(indices))
+                     for name, value in variables.items() for string in (name, value['value']))
+
+
+class _Decoder(object):
+
+    def __init__(self, strings):
+        super(_Decoder, self).__init__()
+        self._strings = strings
+
+    def decode_error(self, encoded):
+        fields = dict(zip(_ERROR_FIELDS, encoded))
+        returned = Error.__new__(Error)
+        returned.message = fields['message']
+        returned.exception_type = _import_type(fields['exception_type'])
+        returned.exception_str = fields['exception_str']
+        returned.arg = unpickle(fields['arg']) if fields['arg'] is not None else None
+        returned.time = arrow.Arrow.fromdatetime(_decode_datetime(fields['time']))
+        returned._fatal = fields['fatal']  # pylint: disable=protected-access
+        returned._is_failure = fields['failure']  # pylint: disable=protected-access
+        returned._has_custom_message = fields['custom_message']  # pylint: disable=protected-access
+        returned._exception_attributes = _unmarshal_or_unpickle(  # pylint: disable=protected-access
+            fields['exception_attributes'])
+        returned.exc_info = None
+        if fields['frames'] is None:
+            returned.traceback = None
+        else:
+            returned.traceback = DistilledTraceback()
+            returned.traceback.frames = [self._decode_frame(frame) for frame in fields['frames']]
+        _unpickle_extra_attributes(returned, fields['extra'])
+        return returned
+
+    def _decode_frame(self, encoded):
+        strings = self._strings
+        filename, lineno, func_name, code_line, code_string, is_in_test_code, global_variables, local_variables = encoded
+        return DistilledFrame.from_dict({
+            'filename': strings[filename], 'lineno': lineno, 'func_name': strings[func_name],
+            'code_line': strings[code_line], 'code_string': strings[code_string], 'is_in_test_code': is_in_test_code,
+            'globals': self._decode_variables(global_variables), 'locals': self._decode_variables(local_variables)})
+
+    def _decode_variables(self, encoded):
+        strings = self._strings
+        indices = iter(encoded)
+        return {strings[name]: {'value': strings[value]} for name, value in zip(indices, indices)}
+
+
+def _encode_datetime(value):
+    if value is None:
+        return None
+    return (value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond)
+
+
+def _decode_datetime(value):
+    if value is None:
+        return None
+    return datetime(*value)
+
+
+def _import_type(type_name):
+    """Returns the class named by ``(module name, qualified name)``, or None if it cannot be imported in this process,
+    e.g. exception classes defined in test files loaded only by the worker
+    """
+    if type_name is None:
+        return None
+    module_name, qualname = type_name
+    try:
+        returned = importlib.import_module(module_name)
+        for attr in qualname.split('.'):
+            returned = getattr(returned, attr)
+    except Exception:  # pylint: disable=broad-except
+        _logger.debug('Cannot import {}.{}', module_name, qualname)
+        return None
+    return returned
+
+
+def _pickle(name, value):
+    try:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        _logger.debug('Failed serializing result, skipping this value. key = {}', name)
+        capture_sentry_exception()
+        return None
+
+
+def _marshal_or_pickle(value):
+    try:
+        return (True, marshal.dumps(value, _MARSHAL_VERSION))
+    except ValueError:
+        return (False, _pickle('exception attributes', value))
+
+
+def _unmarshal_or_unpickle(value):
+    is_marshalled, data = value
+    if data is None:
+        return None
+    return marshal.loads(data) if is_marshalled else unpickle(data)
+
+
+def _pickle_extra_attributes(obj, schema_attributes):
+    returned = {}
+    for key, value in vars(obj).items():
+        if key not in schema_attributes:
+            pickled = _pickle(key, value)
+            if pickled is not None:
+                returned[key] = pickled
+    return returned or None
+
+
+def _unpickle_extra_attributes(obj, extra):
+    for key, value in (extra or {}).items():
+        try:
+            obj.__dict__[key] = unpickle(value)
+        except Exception:  # pylint: disable=broad-except
+            _logger.error('Error when deserializing result attribute {}, skipping it', key, extra={'capture': False})
@@ -38,6 +38,8 @@ class Session(Activatable):
         self._active = False
         self._active_context = None
         self.parallel_manager = None
+        #: :class:`slash.resuming.ResumeStateWriter` recording the resume state of the session while it runs, if any
+        self.resume_state_writer = None
         self.fixture_store = FixtureStore()
         self.warnings = SessionWarnings()
         self.logging = log.SessionLogging(self, console_stream=console_stream)
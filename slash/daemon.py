@@ -0,0 +1,272 @@
+"""A long-lived process keeping slash and the modules used by previous sessions imported, and forking a new process
+for every command sent to it over a unix domain socket, so that repeated runs skip interpreter startup and imports.
+"""
+import array
+import importlib
+import os
+import pickle
+import re
+import selectors
+import signal
+import socket
+import sys
+import sysconfig
+import traceback
+
+import logbook
+
+from .conf import config
+from .parallel.transport import receive_message, send_message
+from .utils.path import ensure_directory
+
+_logger = logbook.Logger(__name__)
+
+_PRELOAD_MODULES = ['slash.frontend.main', 'slash.frontend.slash_run', 'slash.frontend.slash_list',
+                    'slash.parallel.worker']
+_STANDARD_FDS = (0, 1, 2)
+_FDS_MARKER = b'\0'
+_REAP_INTERVAL = 1
+# packages created by emport when importing test files and slashconf files by path
+_EMPORT_PACKAGE_NAME = re.compile(r'^_\d+$')
+
+
+def get_socket_path(socket_path=None):
+    return os.path.expanduser(socket_path or config.root.daemon.socket_path)
+
+
+class Daemon(object):
+
+    def __init__(self, socket_path=None, preload_modules=None, learn_imports_from=None):
+        super(Daemon, self).__init__()
+        self.socket_path = get_socket_path(socket_path)
+        self._preload_modules = _PRELOAD_MODULES + list(config.root.daemon.preload_modules if preload_modules is None
+                                                        else preload_modules)
+        if learn_imports_from is None:
+            learn_imports_from = config.root.daemon.learn_imports_from
+        if learn_imports_from is None:
+            learn_imports_from = _get_installation_paths()
+        self._learn_imports_from = [os.path.abspath(os.path.expanduser(path)) for path in learn_imports_from]
+        self._baseline_modules = set()
+        self._learned_module_mtimes = {}
+        self._children = set()
+
+    def serve(self, stop_event=None):
+        for module_name in self._preload_modules:
+            importlib.import_module(module_name)
+        self._baseline_modules = set(sys.modules)
+        listening_socket = self._listen()
+        selector = selectors.DefaultSelector()
+        selector.register(listening_socket, selectors.EVENT_READ)
+        _logger.notice('Slash daemon listening on {}', self.socket_path)
+        try:
+            while stop_event is None or not stop_event.is_set():
+                # imports of finished sessions are learned before forking for new ones
+                for key, _ in sorted(selector.select(_REAP_INTERVAL), key=lambda event: event[0].fileobj is listening_socket):
+                    if key.fileobj is listening_socket:
+                        connection, _ = listening_socket.accept()
+                        self._handle_connection(connection, listening_socket, selector)
+                    else:
+                        selector.unregister(key.fileobj)
+                        self._learn_imports(key.fileobj)
+                self._reap_children()
+        finally:
+            selector.close()
+            listening_socket.close()
+            os.unlink(self.socket_path)
+
+    def _listen(self):
+        ensure_directory(os.path.dirname(self.socket_path))
+        if os.path.exists(self.socket_path):
+            # a previous daemon which is still running would accept this connection
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError('A slash daemon is already listening on {}'.format(self.socket_path))
+            finally:
+                probe.close()
+        returned = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            returned.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        returned.listen(16)
+        return returned
+
+    def _handle_connection(self, connection, listening_socket, selector):
+        try:
+            fds, request = _receive_request(connection)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            _logger.error('Could not receive request from client: {}', e)
+            connection.close()
+            return
+        self._invalidate_changed_modules()
+        learned_read_fd, learned_write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.close(learned_read_fd)
+                selector.close()
+                listening_socket.close()
+                exit_code = _run_request(connection, fds, request, self._baseline_modules, learned_write_fd)
+            except BaseException:  # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                os._exit(exit_code)  # pylint: disable=protected-access
+        os.close(learned_write_fd)
+        for fd in fds:
+            os.close(fd)
+        connection.close()
+        self._children.add(pid)
+        selector.register(os.fdopen(learned_read_fd, 'rb'), selectors.EVENT_READ)
+
+    def _reap_children(self):
+        for pid in list(self._children):
+            finished_pid, _ = os.waitpid(pid, os.WNOHANG)
+            if finished_pid:
+                self._children.discard(pid)
+
+    def _learn_imports(self, learned_file):
+        with learned_file:
+            data = learned_file.read()
+        if not data or not config.root.daemon.learn_imports:
+            return
+        for module_name, path in pickle.loads(data):
+            if module_name in sys.modules:
+                continue
+            # modules are imported into the daemon itself, so only the allowed ones are, and not every module a
+            # session happened to import
+            if not any(path.startswith(directory + os.sep) for directory in self._learn_imports_from):
+                continue
+            try:
+                module = importlib.import_module(module_name)
+            except Exception as e:  # pylint: disable=broad-except
+                _logger.debug('Could not import {}: {}', module_name, e)
+                continue
+            path = _get_project_module_path(module)
+            if path is not None:
+                self._learned_module_mtimes[module_name] = (path, _get_mtime(path))
+
+    def _invalidate_changed_modules(self):
+        if not any(_get_mtime(path) != mtime for path, mtime in self._learned_module_mtimes.values()):
+            return
+        # modules of the project may refer to each other, so they are all imported again by the next session
+        _logger.notice('Project files changed, forgetting {} imported modules', len(self._learned_module_mtimes))
+        for module_name in self._learned_module_mtimes:
+            sys.modules.pop(module_name, None)
+        self._learned_module_mtimes.clear()
+
+
+def run_in_daemon(argv, socket_path=None):
+    """Runs a slash command (e.g. ``['run', 'tests/']``) in a process forked by the daemon, using the standard streams,
+    working directory and environment of the current process. Returns the command's exit code
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(get_socket_path(socket_path))
+    with connection:
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        request = pickle.dumps({'argv': list(argv), 'cwd': os.getcwd(), 'environ': dict(os.environ)},
+                               pickle.HIGHEST_PROTOCOL)
+        connection.sendmsg([_FDS_MARKER], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', _STANDARD_FDS))])
+        connection.sendall(request)
+        connection.shutdown(socket.SHUT_WR)
+        pid = None
+        while True:
+            try:
+                message = receive_message(connection)
+            except KeyboardInterrupt:
+                # the forked process is not in the terminal's foreground process group
+                if pid is not None:
+                    os.kill(pid, signal.SIGINT)
+                continue
+            if message is None:
+                return -1
+            if 'pid' in message:
+                pid = message['pid']
+            else:
+                return message['exit_code']
+
+
+def _receive_request(connection):
+    fds = array.array('i')
+    chunks = []
+    while True:
+        data, ancdata, _, _ = connection.recvmsg(65536, socket.CMSG_SPACE(len(_STANDARD_FDS) * fds.itemsize))
+        for level, kind, fds_data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(fds_data[:len(fds_data) - (len(fds_data) % fds.itemsize)])
+        if not data:
+            break
+        chunks.append(data)
+    if len(fds) != len(_STANDARD_FDS):
+        for fd in fds:
+            os.close(fd)
+        raise EOFError('Expected {} file descriptors, got {}'.format(len(_STANDARD_FDS), len(fds)))
+    return list(fds), pickle.loads(b''.join(chunks)[len(_FDS_MARKER):])
+
+
+def _run_request(connection, fds, request, baseline_modules, learned_write_fd):
+    for target_fd, fd in zip(_STANDARD_FDS, fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['environ'])
+    send_message(connection, {'pid': os.getpid()})
+    sys.argv = ['slash'] + request['argv']
+    from .frontend.main import main
+    try:
+        exit_code = main()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    for stream in (sys.stdout, sys.stderr):
+        stream.flush()
+    # written before replying, so that the daemon knows these modules by the time the client sends its next command
+    with os.fdopen(learned_write_fd, 'wb') as learned_file:
+        learned_file.write(pickle.dumps(list(_iter_learnable_modules(baseline_modules))))
+    send_message(connection, {'exit_code': exit_code})
+    return exit_code
+
+
+def _iter_learnable_modules(baseline_modules):
+    """Yields the name and file of each module imported by the session which the daemon may import in advance
+    """
+    for module_name, module in list(sys.modules.items()):
+        if module_name in baseline_modules or module_name == '__main__':
+            continue
+        if _EMPORT_PACKAGE_NAME.match(module_name.split('.')[0]):
+            continue
+        spec = getattr(module, '__spec__', None)
+        if spec is None or not spec.has_location or not spec.origin:
+            continue
+        yield module_name, os.path.abspath(spec.origin)
+
+
+def _get_project_module_path(module):
+    """Returns the file of a module which is not part of the standard library or of an installed package
+    """
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    path = os.path.abspath(path)
+    for installation_path in _get_installation_paths():
+        if path.startswith(installation_path + os.sep):
+            return None
+    return path
+
+
+def _get_installation_paths():
+    return sorted({os.path.abspath(sysconfig.get_paths()[name])
+                   for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
@@ -24,6 +24,10 @@ class ParallelTimeout(SlashException):
     pass
 
 
+class ParallelRemoteCallError(SlashException):
+    pass
+
+
 class InteractiveParallelNotAllowed(SlashException):
     pass
 
@@ -18,6 +18,8 @@ _COMMANDS = {
     "list": "slash.frontend.slash_list:slash_list",
     "list-config": "slash.frontend.list_config:list_config",
     "list-plugins": "slash.frontend.slash_list_plugins:slash_list_plugins",
+    "daemon": "slash.frontend.slash_daemon:slash_daemon",
+    "agent": "slash.frontend.slash_agent:slash_agent",
 }
 
 
@@ -30,6 +32,10 @@ def _get_parser():
 
     parser.add_argument("-v", action="append_const", const=1, dest="verbosity", default=[],
                         help="Be more verbose. Can be specified multiple times to increase verbosity further")
+    parser.add_argument("--daemon", action="store_true", default=False,
+                        help="Run the command in a process forked by a running `slash daemon`")
+    parser.add_argument("--daemon-socket", default=None, metavar="PATH",
+                        help="Unix socket of the daemon to use with --daemon")
     parser.add_argument("cmd")
     parser.add_argument("argv", nargs=argparse.REMAINDER)
     return parser
@@ -37,6 +43,9 @@ def _get_parser():
 def main():
     parser = _get_parser()
     args = parser.parse_args()
+    if args.daemon:
+        from ..daemon import run_in_daemon
+        return run_in_daemon(['-v'] * len(args.verbosity) + [args.cmd] + args.argv, socket_path=args.daemon_socket)
     with _setup_logging_context(args):
         module_name = _COMMANDS.get(args.cmd)
         if not module_name:
@@ -0,0 +1,34 @@
+import argparse
+import sys
+
+from ..parallel.agent import Agent
+
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog='slash agent')
+    parser.add_argument('--server', required=True, metavar='HOST:PORT',
+                        help='Address of the parallel server of the session, as logged by the parent process')
+    parser.add_argument('--workers', type=int, default=1, metavar='NUM_WORKERS',
+                        help='Maximal number of workers to start on this host')
+    parser.add_argument('--workdir', default=None, metavar='DIR',
+                        help='Directory to mirror the project tree into, kept between runs to fetch only changed '
+                        'files (defaults to a temporary directory)')
+    parser.add_argument('--connect-timeout', type=float, default=60, metavar='SECONDS',
+                        help='How long to wait for the session to accept agents')
+    returned = parser.parse_args(args)
+    host, _, port = returned.server.rpartition(':')
+    if not host or not port.isdigit():
+        parser.error('--server should be of the form HOST:PORT')
+    returned.server_addr, returned.server_port = host, int(port)
+    return returned
+
+
+def slash_agent(args, report_stream=sys.stdout):
+    args = _parse_args(args.argv)
+    agent = Agent(args.server_addr, args.server_port, num_workers=args.workers, working_directory=args.workdir)
+    print('Running workers of the session at {} in {}'.format(args.server, agent.working_directory), file=report_stream)
+    report_stream.flush()
+    try:
+        return agent.run(connect_timeout=args.connect_timeout)
+    except KeyboardInterrupt:
+        return 1
@@ -0,0 +1,28 @@
+import argparse
+import sys
+
+from ..daemon import Daemon
+
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog='slash daemon')
+    parser.add_argument('--socket-path', default=None, help='Unix socket to listen on')
+    parser.add_argument('--preload', dest='preload_modules', action='append', default=None, metavar='MODULE',
+                        help='Module to import when starting (can be specified multiple times)')
+    parser.add_argument('--learn-imports-from', dest='learn_imports_from', action='append', default=None,
+                        metavar='PATH', help='Directory from which modules imported by sessions are learned, instead '
+                        'of those of the standard library and installed packages (can be specified multiple times)')
+    return parser.parse_args(args)
+
+
+def slash_daemon(args, report_stream=sys.stdout):
+    args = _parse_args(args.argv)
+    daemon = Daemon(socket_path=args.socket_path, preload_modules=args.preload_modules,
+                    learn_imports_from=args.learn_imports_from)
+    print('Listening on {}'.format(daemon.socket_path), file=report_stream)
+    report_stream.flush()
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    return 0
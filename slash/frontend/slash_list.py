@@ -12,7 +12,8 @@ import slash
 import slash.site
 import slash.loader
 from slash import config
-from slash.exceptions import CannotLoadTests
+from slash.exceptions import CannotLoadTests, InvalidConfiguraion
+from slash.sharding import ShardPlan, load_durations_file, save_durations_file
 from slash.utils.cli_utils import UNDERLINED, make_styler, Printer
 from slash.utils.python import get_underlying_func
 from slash.utils.suite_files import iter_suite_file_paths
@@ -40,6 +41,12 @@ def _get_parser():
     parser.add_argument('--force-color', dest='force_color', action='store_true', default=False)
     parser.add_argument('--no-color', dest='enable_color', action='store_false', default=True)
     parser.add_argument('--show-duplicates', dest='show_duplicates', action='store_true', default=False)
+    parser.add_argument('--collection-cache', dest='collection_cache', action='store_true', default=False)
+    parser.add_argument('--prefetch-workers', dest='prefetch_workers', type=int, default=None, metavar='NUM_WORKERS')
+    parser.add_argument('--shard-count', dest='shard_count', type=int, default=None, metavar='NUM_SHARDS')
+    parser.add_argument('--shard-index', dest='shard_index', type=int, default=None, metavar='SHARD_INDEX')
+    parser.add_argument('--shard-durations-file', dest='shard_durations_file', default=None, metavar='PATH')
+    parser.add_argument('--save-shard-durations', dest='save_shard_durations', default=None, metavar='PATH')
 
     parser.add_argument('paths', nargs='*', default=[], metavar='PATH')
     return parser
@@ -53,6 +60,17 @@ def slash_list(args, report_stream=sys.stdout, error_stream=sys.stderr):
 
     if parsed_args.filter_strings:
         config.root.run.filter_strings.extend(parsed_args.filter_strings)
+    if parsed_args.collection_cache:
+        config.root.run.collection_cache.enabled = True
+    if parsed_args.prefetch_workers is not None:
+        config.root.run.prefetch_workers = parsed_args.prefetch_workers
+    if parsed_args.shard_durations_file is not None:
+        config.root.run.sharding.durations_file = parsed_args.shard_durations_file
+    if parsed_args.shard_index is not None:
+        config.root.run.sharding.count = parsed_args.shard_count or 1
+        config.root.run.sharding.index = parsed_args.shard_index
+    # without a shard index, all tests are listed along with a preview of the shards they would be split into
+    preview_shards = parsed_args.shard_index is None and (parsed_args.shard_count or 1) > 1
 
     _print = Printer(report_stream, enable_output=parsed_args.show_output, force_color=parsed_args.force_color,
                      enable_color=parsed_args.enable_color, error_stream=error_stream)
@@ -67,37 +85,55 @@ def slash_list(args, report_stream=sys.stdout, error_stream=sys.stderr):
                 parser.error('Neither test paths nor suite files were specified')
 
             loader = slash.loader.Loader()
-            runnables = loader.get_runnables(itertools.chain(parsed_args.paths, iter_suite_file_paths(parsed_args.suite_files)))
-            used_fixtures = set()
-            for test in runnables:
-                used_fixtures.update(test.get_required_fixture_objects())
-
-            if parsed_args.only in (None, 'fixtures'):
-                _report_fixtures(parsed_args, session, _print, used_fixtures)
+            paths = itertools.chain(parsed_args.paths, iter_suite_file_paths(parsed_args.suite_files))
+            if parsed_args.only == 'tests' and not preview_shards and not parsed_args.save_shard_durations and \
+               config.root.run.sharding.count == 1 and \
+               (config.root.run.collection_cache.enabled or config.root.run.prefetch_workers > 1):
+                # fixtures are not needed, so tests can be listed from metadata collected by worker processes
+                # or straight from the cache for files which did not change
+                runnables = list(loader.iter_test_infos(paths))
+                listed = [(info.address, info.tags) for info in runnables]
+            else:
+                runnables = loader.get_runnables(paths)
+                listed = [(test.__slash__.address, test.get_tags()) for test in runnables]
+                used_fixtures = set()
+                for test in runnables:
+                    used_fixtures.update(test.get_required_fixture_objects())
+
+                if parsed_args.only in (None, 'fixtures'):
+                    _report_fixtures(parsed_args, session, _print, used_fixtures)
 
             if parsed_args.only in (None, 'tests'):
-                _report_tests(parsed_args, runnables, _print)
+                _report_tests(parsed_args, listed, _print)
+
+            if preview_shards:
+                durations_file = config.root.run.sharding.durations_file
+                _report_shards(ShardPlan(runnables, parsed_args.shard_count,
+                                         durations=load_durations_file(durations_file) if durations_file else None),
+                               _print)
+
+            if parsed_args.save_shard_durations:
+                save_durations_file(parsed_args.save_shard_durations, runnables)
 
         if bool(session.warnings.warnings) and parsed_args.warnings_as_errors:
             return -1
         if len(runnables):  # pylint: disable=len-as-condition
             return 0
-    except CannotLoadTests as e:
+    except (CannotLoadTests, InvalidConfiguraion) as e:
         _print(_error_style('Could not load tests ({})'.format(e)), error=True)
         return -1
     print('No tests were found!', file=sys.stderr)
     return int(not parsed_args.allow_empty)
 
 
-def _report_tests(args, runnables, printer):
+def _report_tests(args, listed, printer):
     if not args.only:
         printer(_heading_style('Tests'))
 
     visited = set()
 
-    for runnable in runnables:
-        extra = "" if not args.show_tags else "  Tags: {}".format(list(runnable.get_tags()))
-        address = runnable.__slash__.address
+    for address, tags in listed:
+        extra = "" if not args.show_tags else "  Tags: {}".format(list(tags))
         if not args.show_params:
             address = address.split('(')[0]
         if args.relative_paths:
@@ -108,6 +144,14 @@ def _report_tests(args, runnables, printer):
         printer("{}{}".format(_title_style(address), extra))
 
 
+def _report_shards(plan, printer):
+    printer(_heading_style('Shards (balanced by {})'.format('durations' if plan.by_durations else 'test counts')))
+    for shard_index in range(plan.num_shards):
+        load = ', expected duration: {:.1f}s'.format(plan.loads[shard_index]) if plan.by_durations else ''
+        printer('{}: {} tests in {} files{}'.format(_title_style('Shard {}'.format(shard_index)),
+                                                    len(plan.get_shard(shard_index)), plan.num_files[shard_index], load))
+
+
 def _convert_address_to_relpath(address):
     filename, remainder = address.rsplit(':', 1)
     if os.path.isabs(filename):
@@ -5,7 +5,8 @@ from ..app import Application
 from ..conf import config
 from ..exception_handling import handling_exceptions
 from ..exceptions import CannotLoadTests, InteractiveParallelNotAllowed
-from ..resuming import (get_last_resumeable_session_id, get_tests_from_previous_session, save_resume_state, clean_old_entries)
+from ..resuming import (get_last_resumeable_session_id, get_tests_from_previous_session, save_resume_state,
+                         clean_old_entries, ResumeStateWriter)
 from ..runner import run_tests
 from ..utils.suite_files import iter_suite_file_paths
 from ..utils.tmux_utils import run_slash_in_tmux
@@ -30,6 +31,7 @@ def slash_run(args, report_stream=None, resume=False, rerun=False, app_callback=
     app.set_report_stream(report_stream)
     app.enable_interactive()
     collected = []
+    resume_state_writer = None
     try:
         with app:
             if app_callback is not None:
@@ -46,7 +48,10 @@ def slash_run(args, report_stream=None, resume=False, rerun=False, app_callback=
                     elif is_child():
                         worker = Worker(config.root.parallel.worker_id, app.session.id)
                         worker.connect_to_server()
-                    if resume or rerun:
+                    if is_child() and config.root.parallel.lazy_worker_collection:
+                        # tests are loaded by the worker as they are assigned to it
+                        collected = []
+                    elif resume or rerun:
                         session_ids = app.positional_args
                         if not session_ids:
                             session_ids = [get_last_resumeable_session_id()]
@@ -61,6 +66,9 @@ def slash_run(args, report_stream=None, resume=False, rerun=False, app_callback=
                 if is_child():
                     worker.start_execution(app, collected)
                 else:
+                    resume_state_writer = ResumeStateWriter(app.session.id)
+                    resume_state_writer.start(collected)
+                    app.session.resume_state_writer = resume_state_writer
                     with app.session.get_started_context():
                         report_tests_to_backslash(collected)
                         if is_parent():
@@ -71,7 +79,7 @@ def slash_run(args, report_stream=None, resume=False, rerun=False, app_callback=
 
             finally:
                 if not is_child():
-                    save_resume_state(app.session.results, collected)
+                    save_resume_state(app.session.results, collected, writer=resume_state_writer)
                     clean_old_entries()
             if app.exit_code == 0 and not app.session.results.is_success(allow_skips=True):
                 app.set_exit_code(1)
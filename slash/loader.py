@@ -1,7 +1,9 @@
 import itertools
+import multiprocessing
 import traceback
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from types import FunctionType, GeneratorType
 from contextlib import contextmanager
 
@@ -11,6 +13,7 @@ from logbook import Logger
 from sentinels import NOTHING
 
 
+from .collection_cache import CachedTestInfo, CollectionCache
 from .conf import config
 from .ctx import context
 from .core.local_config import LocalConfig
@@ -22,9 +25,12 @@ from .core.function_test import FunctionTestFactory
 from .exception_handling import handling_exceptions, mark_exception_handled, get_exception_frame_correction
 from .exceptions import CannotLoadTests, SlashInternalError
 from .core.runnable_test_factory import RunnableTestFactory
+from .utils.assertion_rewriting import rewrite_assertions_context
 from .utils.pattern_matching import Matcher
 from .utils.python import check_duplicate_functions
 from .resuming import ResumedTestData
+from .sharding import get_configured_shard
+from .ordering import get_predictive_order
 from .utils.interactive import generate_interactive_test
 
 _logger = Logger(__name__)
@@ -40,6 +46,8 @@ class Loader(object):
         super(Loader, self).__init__()
         self._local_config = LocalConfig()
         self._duplicate_funcs = set()
+        self._collection_cache = None
+        self._prefetched_test_infos = {}
 
     _cached_matchers = NOTHING
 
@@ -51,11 +59,18 @@ class Loader(object):
                 self._cached_matchers = None
         return self._cached_matchers
 
+    def _get_collection_cache(self):
+        if self._collection_cache is None and config.root.run.collection_cache.enabled:
+            self._collection_cache = CollectionCache()
+        return self._collection_cache
 
     def get_runnables(self, paths, prepend_interactive=False):
         assert context.session is not None
         sources = self._generate_repeats(self._generate_test_sources(paths))
+        if config.root.run.sharding.count > 1:
+            sources = get_configured_shard(sources)
         returned = self._collect(sources)
+        self._save_collection_cache()
         self._duplicate_funcs |= self._local_config.duplicate_funcs
         for (path, name, line) in sorted(self._duplicate_funcs):
             _logger.warning('Duplicate function definition, File: {}, Name: {}, Line: {}', path, name, line)
@@ -69,6 +84,8 @@ class Loader(object):
         returned.sort(key=lambda test: (
             test.__slash__.repeat_all_index, test.__slash__.get_sort_key()
         ))
+        if config.root.run.predictive_order:
+            returned = get_predictive_order(returned)
         for test in returned:
             if test.__slash__.id is not None:
                 raise SlashInternalError('Slash ID of {!r} should be None, but is {}'.format(test, test.__slash__.id))
@@ -76,6 +93,110 @@ class Loader(object):
         return returned
 
 
+    def get_tests_in_file(self, file_path):
+        """Loads all tests defined in ``file_path``, regardless of the filters in use. Used by parallel workers
+        loading only the tests assigned to them (see :ref:`conf.parallel.lazy_worker_collection`)
+        """
+        assert context.session is not None
+        returned = list(self._iter_path(file_path))
+        hooks.tests_loaded(tests=returned) # pylint: disable=no-member
+        return returned
+
+    def iter_test_infos(self, paths):
+        """Iterates over :class:`slash.collection_cache.CachedTestInfo` objects describing the tests found in ``paths``.
+        When the collection cache is enabled, only files which changed since they were last collected are imported
+        """
+        assert context.session is not None
+        try:
+            addresses = []
+            for address in paths:
+                path, address_in_file = _split_address(address)
+                file_paths = [file_path for file_path in (_walk(path) if os.path.exists(path) else [path])
+                              if self._is_file_wanted(file_path)]
+                addresses.append((address, address_in_file, file_paths))
+            infos_by_file = self._get_test_infos_by_file(
+                list(_unique(itertools.chain.from_iterable(file_paths for _, _, file_paths in addresses))))
+            for address, address_in_file, file_paths in addresses:
+                matched = False
+                for file_path in file_paths:
+                    for info in infos_by_file[file_path]:
+                        if address_in_file is not None and not self._address_in_file_matches(address_in_file, info):
+                            continue
+                        matched = True
+                        if not self._is_metadata_excluded(info):
+                            yield info
+                if address_in_file is not None and not matched:
+                    raise CannotLoadTests('Cannot find test(s) for {!r}'.format(address))
+        finally:
+            self._save_collection_cache()
+
+    def _get_test_infos_by_file(self, file_paths, prefetching=False):
+        """Returns a dictionary mapping each of ``file_paths`` to the list of test infos collected from it.
+        Files missing from the collection cache are imported in a pool of :ref:`conf.run.prefetch_workers`
+        processes when it is greater than 1.
+
+        When ``prefetching``, the session imports every file containing matching tests again, so the pool only pays
+        off for files whose tests are all filtered out. Collection stops early (leaving the remaining files out of the
+        returned dictionary) once too many of the collected files turn out to contain matching tests
+        """
+        cache = self._get_collection_cache()
+        returned = {}
+        missing = []
+        for file_path in file_paths:
+            infos = self._prefetched_test_infos.get(file_path)
+            if infos is None and cache is not None:
+                infos = cache.get_test_infos(file_path, self._local_config.get_slashconf_paths(file_path))
+            if infos is None:
+                missing.append(file_path)
+            else:
+                returned[file_path] = infos
+
+        num_workers = min(config.root.run.prefetch_workers, len(missing))
+        if num_workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            _logger.debug('Process pool collection requires fork support. Collecting sequentially')
+            num_workers = 1
+        if num_workers > 1:
+            _logger.debug('Collecting {} files using {} processes', len(missing), num_workers)
+            chunksize = max(1, len(missing) // (num_workers * 4))
+            chunks = [missing[index:index + chunksize] for index in range(0, len(missing), chunksize)]
+            num_collected = num_matching = 0
+            with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('fork'),
+                                     initializer=_init_prefetch_process) as executor:
+                futures = [executor.submit(_prefetch_test_infos_in_process, chunk) for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    for file_path, (info_dicts, duplicate_funcs) in zip(chunk, future.result()):
+                        returned[file_path] = [CachedTestInfo.from_dict(file_path, d) for d in info_dicts]
+                        self._duplicate_funcs.update(duplicate_funcs)
+                        if cache is not None:
+                            cache.record(file_path, self._local_config.get_slashconf_paths(file_path),
+                                         returned[file_path])
+                        num_collected += 1
+                        if not all(self._is_metadata_excluded(info) for info in returned[file_path]):
+                            num_matching += 1
+                    # a matching file costs a pooled import on top of the session's own import, while a filtered out
+                    # file saves a whole import, so prefetching is slower once more than 1 - 1/N of the files match
+                    if prefetching and num_collected >= num_workers * chunksize and \
+                       num_matching * num_workers > num_collected * (num_workers - 1):
+                        _logger.debug('{} out of {} collected files contain matching tests. Collecting the rest '
+                                      'sequentially', num_matching, num_collected)
+                        for pending in futures:
+                            pending.cancel()
+                        break
+        else:
+            for file_path in missing:
+                returned[file_path] = [CachedTestInfo.from_test(test) for test in self._iter_path(file_path)]
+        return returned
+
+    def _prefetch_test_infos(self, path):
+        if config.root.run.prefetch_workers <= 1 or self._get_matchers() is None or not os.path.isdir(path):
+            return
+        self._prefetched_test_infos.update(self._get_test_infos_by_file(
+            [file_path for file_path in _walk(path) if self._is_file_wanted(file_path)], prefetching=True))
+
+    def _save_collection_cache(self):
+        if self._collection_cache is not None:
+            self._collection_cache.save()
+
     def _generate_repeats(self, tests):
         returned = []
         repeat_each = config.root.run.repeat_each
@@ -110,40 +231,62 @@ class Loader(object):
             iterator = self._generate_test_sources(thing[0], matcher=thing[1])
 
         elif isinstance(thing, (list, GeneratorType, itertools.chain)):
-            iterator = itertools.chain.from_iterable(self._generate_test_sources(x) for x in thing)
+            iterator = itertools.chain.from_iterable(
+                self._iter_tests_resume(group) if is_resume_group else
+                itertools.chain.from_iterable(self._generate_test_sources(x) for x in group)
+                for is_resume_group, group in itertools.groupby(thing, key=_is_resumed_test_data))
         elif isinstance(thing, str):
             iterator = self._iter_test_address(thing)
         elif isinstance(thing, RunnableTest):
             iterator = [thing]
         elif isinstance(thing, ResumedTestData):
-            iterator = self._iter_test_resume(thing)
+            iterator = self._iter_tests_resume([thing])
         elif not isinstance(thing, RunnableTestFactory):
             thing = self._get_runnable_test_factory(thing)
             iterator = thing.generate_tests(fixture_store=context.session.fixture_store)
 
         return (t for t in iterator if matcher is None or matcher.matches(t.__slash__))
 
-    def _iter_test_resume(self, resume_state):
-        for test in self._iter_path(resume_state.file_name):
-            if self._is_excluded(test):
-                continue
-            if resume_state.address_in_file == test.__slash__.address_in_file:
-                if resume_state.variation:
-                    if not resume_state.variation == test.get_variation().id:
-                        continue
+    def _iter_tests_resume(self, resume_states):
+        """Yields the tests matching each of the given resume states, in order. Each file is loaded once, and the
+        states are matched against an index of its tests by address and variation
+        """
+        tests_by_file = {}
+        tests_by_variation = {}
+        yielded = set()
+        for resume_state in resume_states:
+            tests_by_address = tests_by_file.get(resume_state.file_name)
+            if tests_by_address is None:
+                tests_by_address = tests_by_file[resume_state.file_name] = {}
+                for test in self._iter_path(resume_state.file_name):
+                    if not self._is_excluded(test):
+                        tests_by_address.setdefault(test.__slash__.address_in_file, []).append(test)
+            tests = tests_by_address.get(resume_state.address_in_file, ())
+            if tests and resume_state.variation:
+                variation_key = _get_variation_key(resume_state.variation)
+                if variation_key is None:
+                    tests = [test for test in tests if resume_state.variation == _get_test_variation_id(test)]
+                else:
+                    index_key = (resume_state.file_name, resume_state.address_in_file)
+                    variations = tests_by_variation.get(index_key)
+                    if variations is None:
+                        variations = tests_by_variation[index_key] = {}
+                        for test in tests:
+                            variations.setdefault(_get_variation_key(_get_test_variation_id(test)), []).append(test)
+                    tests = variations.get(variation_key, ())
+            for test in tests:
+                if id(test) in yielded:
+                    test = test.clone()
+                else:
+                    yielded.add(id(test))
                 yield test
 
     def _iter_test_address(self, address):
-        drive, address = os.path.splitdrive(address)
-        if ':' in address:
-            path, address_in_file = address.split(':', 1)
-        else:
-            path = address
-            address_in_file = None
-        path = os.path.join(drive, path)
-
+        path, address_in_file = _split_address(address)
+        if address_in_file is None:
+            self._prefetch_test_infos(path)
 
-        tests = list(self._iter_path(path))
+        tests = list(self._iter_paths([path], skip_unmatched_files=address_in_file is None))
 
         # special case for directories where we couldn't load any tests (without filter)
         if not tests and address_in_file is None:
@@ -153,7 +296,7 @@ class Loader(object):
         for test in tests:
 
             if address_in_file is not None:
-                if not self._address_in_file_matches(address_in_file, test):
+                if not self._address_in_file_matches(address_in_file, test.__slash__):
                     continue
             matched = True
             if self._is_excluded(test):
@@ -162,10 +305,10 @@ class Loader(object):
         if not matched:
             raise CannotLoadTests('Cannot find test(s) for {!r}'.format(address))
 
-    def _address_in_file_matches(self, address_in_file, test):
-        if address_in_file == test.__slash__.factory_name:
+    def _address_in_file_matches(self, address_in_file, metadata):
+        if address_in_file == metadata.factory_name:
             return True
-        test_address_in_file = test.__slash__.address_in_file
+        test_address_in_file = metadata.address_in_file
         if address_in_file == test_address_in_file:
             return True
         if '(' in test_address_in_file:
@@ -176,7 +319,7 @@ class Loader(object):
     def _iter_path(self, path):
         return self._iter_paths([path])
 
-    def _iter_paths(self, paths):
+    def _iter_paths(self, paths, skip_unmatched_files=False):
 
         paths = list(paths)
         for path in paths:
@@ -190,12 +333,15 @@ class Loader(object):
                 if not self._is_file_wanted(file_path):
                     _logger.debug("{0} is not wanted. Skipping...", file_path)
                     continue
+                if skip_unmatched_files and self._is_file_known_to_be_filtered_out(file_path):
+                    _logger.debug("No test in {0} matches the filters according to the collection cache. Skipping...", file_path)
+                    continue
                 module = None
                 try:
                     with handling_exceptions(context="during import"):
                         if not config.root.run.message_assertion_introspection:
                             dessert.disable_message_introspection()
-                        with dessert.rewrite_assertions_context():
+                        with rewrite_assertions_context():
                             module = import_file(file_path)
                 except Exception as e:
 
@@ -206,8 +352,25 @@ class Loader(object):
                 if module is not None:
                     self._duplicate_funcs |= check_duplicate_functions(file_path)
                     with self._adding_local_fixtures(file_path, module):
+                        collected = []
                         for runnable in self._iter_runnable_tests_in_module(file_path, module):
+                            collected.append(runnable)
                             yield runnable
+                        cache = self._get_collection_cache()
+                        if cache is not None:
+                            cache.record(file_path, self._local_config.get_slashconf_paths(file_path),
+                                         [CachedTestInfo.from_test(test) for test in collected])
+
+    def _is_file_known_to_be_filtered_out(self, file_path):
+        if self._get_matchers() is None:
+            return False
+        infos = self._prefetched_test_infos.get(file_path)
+        cache = self._get_collection_cache()
+        if infos is None and cache is not None:
+            infos = cache.get_test_infos(file_path, self._local_config.get_slashconf_paths(file_path))
+        if infos is None:
+            return False
+        return all(self._is_metadata_excluded(info) for info in infos)
 
     @contextmanager
     def _adding_local_fixtures(self, file_path, module):
@@ -226,10 +389,13 @@ class Loader(object):
 
 
     def _is_excluded(self, test):
+        return self._is_metadata_excluded(test.__slash__)
+
+    def _is_metadata_excluded(self, metadata):
         matchers = self._get_matchers()
         if matchers is None:
             return False
-        return not all(m.matches(test.__slash__) for m in matchers)
+        return not all(m.matches(metadata) for m in matchers)
 
     def _is_file_wanted(self, filename):
         return filename.endswith(".py")
@@ -265,6 +431,39 @@ class Loader(object):
         return None
 
 
+def _split_address(address):
+    drive, address = os.path.splitdrive(address)
+    if ':' in address:
+        path, address_in_file = address.split(':', 1)
+    else:
+        path = address
+        address_in_file = None
+    return os.path.join(drive, path), address_in_file
+
+
+def _init_prefetch_process():
+    # each file is collected exactly once, by the process it is handed to
+    config.root.run.collection_cache.enabled = False
+    config.root.run.prefetch_workers = 1
+
+
+def _prefetch_test_infos_in_process(file_paths):
+    returned = []
+    for file_path in file_paths:
+        loader = Loader()
+        info_dicts = [CachedTestInfo.from_test(test).to_dict() for test in loader._iter_path(file_path)]  # pylint: disable=protected-access
+        returned.append((info_dicts, loader._duplicate_funcs))  # pylint: disable=protected-access
+    return returned
+
+
+def _unique(iterable):
+    seen = set()
+    for item in iterable:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
 def _walk(p):
     if os.path.isfile(p):
         yield p
@@ -279,3 +478,23 @@ def _extract_tb():
     _, exc_value, exc_tb = sys.exc_info()
     returned = traceback.extract_tb(exc_tb)
     return returned[-1 - get_exception_frame_correction(exc_value)]
+
+
+def _is_resumed_test_data(thing):
+    return isinstance(thing, ResumedTestData)
+
+
+def _get_test_variation_id(test):
+    variation = test.get_variation()
+    return variation.id if variation is not None else None
+
+
+def _get_variation_key(variation_id):
+    """Returns a hashable key for a variation id (a dict of parameter values), or None if it cannot be hashed
+    """
+    try:
+        returned = tuple(sorted(variation_id.items()))
+        hash(returned)
+    except (AttributeError, TypeError):
+        return None
+    return returned
@@ -0,0 +1,48 @@
+import collections
+import os
+import time
+
+import logbook
+
+from .resuming import ResumeTestStatus, get_test_statistics
+
+_logger = logbook.Logger(__name__)
+
+_CHANGED_FILE_SCORE = 1
+
+
+def get_predictive_order(tests):
+    """Reorders tests so that the files most likely to fail run first. A file is scored by the failure rates of its
+    tests in previous sessions, by whether they failed in their last run, and by whether the file changed (or was never
+    run) since its tests last ran. Tests of the same file stay together and in their original order, files with equal
+    scores keep their original order, and repetitions of the whole suite (``--repeat-all``) are ordered separately
+    """
+    groups = collections.OrderedDict()
+    for test in tests:
+        groups.setdefault((test.__slash__.repeat_all_index, test.__slash__.file_path), []).append(test)
+    file_paths = {file_path for _, file_path in groups}
+    statistics_by_file = collections.defaultdict(list)
+    for (file_path, _), test_statistics in get_test_statistics(file_paths).items():
+        statistics_by_file[file_path].append(test_statistics)
+    scores = {file_path: _get_file_score(file_path, statistics_by_file[file_path]) for file_path in file_paths}
+    ordered_groups = sorted(groups, key=lambda key: (
+        key[0], not any(test.__slash__.is_interactive() for test in groups[key]), -scores[key[1]]))
+    _logger.debug('Ordered {} files by failure likelihood ({} likely to fail)', len(file_paths),
+                  sum(1 for score in scores.values() if score > 0))
+    return [test for key in ordered_groups for test in groups[key]]
+
+
+def _get_file_score(file_path, file_statistics):
+    failure_score = 0
+    last_run_at = None
+    for test_statistics in file_statistics:
+        failure_score = max(failure_score, (test_statistics.failure_rate or 0) +
+                            (1 if test_statistics.last_status == ResumeTestStatus.FAILED else 0))
+        if last_run_at is None or test_statistics.last_run_at > last_run_at:
+            last_run_at = test_statistics.last_run_at
+    try:
+        mtime = os.path.getmtime(file_path)
+    except OSError:
+        mtime = None
+    changed = last_run_at is None or (mtime is not None and mtime > time.mktime(last_run_at.timetuple()))
+    return failure_score + (_CHANGED_FILE_SCORE if changed else 0)
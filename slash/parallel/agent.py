@@ -0,0 +1,314 @@
+"""Agents running parallel workers on other hosts.
+
+``slash agent`` connects to the server of a parallel session, mirrors the project tree of the parent process into a
+working directory of its own, and starts workers there. The workers connect to the parent's server like local workers
+do, while the agent sends their log files back to the parent, so hosts do not need to share a filesystem.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import logbook
+from six.moves import xmlrpc_client
+
+from ..conf import config
+from ..ctx import context
+from ..exceptions import ParallelServerIsDown
+
+_logger = logbook.Logger(__name__)
+
+LOG_FILE = 'log'
+ERROR_FILE = 'error'
+
+_MANIFEST_FILE_NAME = 'manifest.json'
+
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+class AgentsRegistry(object):
+    """Parent side of the agents protocol: hands out the ids of workers expected to be started by agents, serves the
+    files of the project tree, and stores files uploaded by agents
+    """
+
+    def __init__(self, worker_ids, argv, workers_error_directory):
+        super(AgentsRegistry, self).__init__()
+        self._free_worker_ids = list(worker_ids)
+        self._unfinished_worker_ids = set()
+        self._worker_session_ids = set()
+        self._argv = list(argv)
+        self._workers_error_directory = workers_error_directory
+        self.project_root = os.getcwd()
+        self._tree_digest = get_tree_digest(self.project_root)
+        self._keepalive_address = None
+        self._lock = threading.Lock()
+
+    def set_keepalive_address(self, keepalive_address):
+        """Makes the registry accept agents, once the servers of the session are listening
+        """
+        self._keepalive_address = keepalive_address
+
+    def register(self, hostname, num_workers):
+        """Returns the configuration of an agent starting up to ``num_workers`` workers, or None if agents are not
+        accepted yet
+        """
+        if self._keepalive_address is None:
+            return None
+        with self._lock:
+            worker_ids = self._free_worker_ids[:num_workers]
+            del self._free_worker_ids[:num_workers]
+            self._unfinished_worker_ids.update(worker_ids)
+            self._worker_session_ids.update('{}_{}'.format(context.session.id.split('_')[0], worker_id)
+                                            for worker_id in worker_ids)
+        _logger.notice("Agent on {} will start workers {}", hostname, ', '.join(worker_ids) or '(none)')
+        return {
+            'worker_ids': worker_ids,
+            'argv': self._argv,
+            'parent_session_id': context.session.id,
+            'project_root': self.project_root,
+            'tree_digest': self._tree_digest,
+            'keepalive_port': self._keepalive_address,
+            'collect_logs': config.root.log.root is not None,
+        }
+
+    def mark_finished(self, worker_ids):
+        """Called by agents once their workers exited and their files were uploaded
+        """
+        with self._lock:
+            self._unfinished_worker_ids.difference_update(worker_ids)
+
+    def has_unfinished_agents(self):
+        return bool(self._unfinished_worker_ids)
+
+    def get_project_file(self, relative_path):
+        if relative_path not in self._tree_digest:
+            raise ValueError('{!r} is not part of the project tree'.format(relative_path))
+        with open(os.path.join(self.project_root, relative_path), 'rb') as f:
+            return f.read()
+
+    def write_worker_file(self, worker_session_id, kind, relative_path, offset, data):
+        if worker_session_id not in self._worker_session_ids:
+            raise ValueError('{!r} is not the session id of a worker started by an agent'.format(worker_session_id))
+        if kind == LOG_FILE:
+            if config.root.log.root is None:
+                return
+            directory = os.path.join(os.path.abspath(os.path.expanduser(config.root.log.root)), worker_session_id)
+        elif kind == ERROR_FILE:
+            directory = self._workers_error_directory
+        else:
+            raise ValueError('Unknown file kind {!r}'.format(kind))
+        directory = os.path.normpath(directory)
+        path = os.path.normpath(os.path.join(directory, relative_path))
+        if not path.startswith(os.path.join(directory, '')):
+            raise ValueError('{!r} is outside of the worker directory'.format(relative_path))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.write(_get_bytes(data))
+
+
+class Agent(object):
+    """Starts workers for the parallel session served at ``server_addr``:``server_port``, in a mirror of the parent's
+    project tree under ``working_directory``
+    """
+
+    def __init__(self, server_addr, server_port, num_workers=1, working_directory=None):
+        super(Agent, self).__init__()
+        self.server_addr = server_addr
+        self.server_port = server_port
+        self.num_workers = num_workers
+        self._owned_directory = None
+        if working_directory is None:
+            working_directory = self._owned_directory = tempfile.mkdtemp(prefix='slash-agent-')
+        self.working_directory = os.path.abspath(working_directory)
+        self._files_directory = os.path.join(self.working_directory, '.slash-agent')
+        self._processes = {}
+        self._uploaded_sizes = {}
+
+    def run(self, connect_timeout=60, upload_interval=1):
+        """Runs the workers assigned to this agent until they exit, returning the highest exit code among them
+        """
+        try:
+            proxy = xmlrpc_client.ServerProxy('http://{}:{}'.format(self.server_addr, self.server_port), allow_none=True)
+            agent_config = self._get_configuration(proxy, connect_timeout)
+            if not agent_config['worker_ids']:
+                _logger.notice('All workers of the session were already started by other agents')
+                return 0
+            self._sync_project_tree(proxy, agent_config['tree_digest'])
+            for worker_id in agent_config['worker_ids']:
+                self._start_worker(agent_config, worker_id)
+            try:
+                while any(process.poll() is None for process in self._processes.values()):
+                    self._upload_files(proxy, agent_config)
+                    time.sleep(upload_interval)
+            except BaseException:
+                for process in self._processes.values():
+                    if process.poll() is None:
+                        process.terminate()
+                raise
+            try:
+                self._upload_files(proxy, agent_config)
+                proxy.agent_finished(agent_config['worker_ids'])
+            except OSError as e:
+                _logger.warning('Could not send the last worker files to the parallel server: {}', e)
+            return max(process.returncode for process in self._processes.values())
+        finally:
+            if self._owned_directory is not None:
+                shutil.rmtree(self._owned_directory, ignore_errors=True)
+
+    def _get_configuration(self, proxy, connect_timeout):
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                returned = proxy.get_agent_configuration(socket.gethostname(), self.num_workers)
+            except OSError as e:
+                _logger.debug('Cannot connect to parallel server: {}', e)
+                returned = None
+            if returned is not None:
+                return returned
+            if time.time() > deadline:
+                raise ParallelServerIsDown('Cannot connect to parallel server at {}:{}'.format(
+                    self.server_addr, self.server_port))
+            time.sleep(0.5)
+
+    def _sync_project_tree(self, proxy, tree_digest):
+        """Fetches the files of the project tree missing from the working directory, or which differ from the
+        parent's. Files the agent fetched in previous runs which are no longer part of the project tree are deleted,
+        while other files in the working directory are left alone
+        """
+        written = self._read_manifest()
+        local_digest = get_tree_digest(self.working_directory)
+        for relative_path in sorted(written):
+            if relative_path not in tree_digest:
+                if relative_path in local_digest:
+                    os.unlink(os.path.join(self.working_directory, relative_path))
+                written.discard(relative_path)
+        fetched = [relative_path for relative_path, digest in sorted(tree_digest.items())
+                   if local_digest.get(relative_path) != digest]
+        # files are recorded before being written, so that they are deleted later even if fetching them fails
+        written.update(fetched)
+        self._write_manifest(written)
+        for relative_path in fetched:
+            path = os.path.join(self.working_directory, relative_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(_get_bytes(proxy.get_project_file(relative_path)))
+        _logger.notice('Fetched {} of {} files of the project tree', len(fetched), len(tree_digest))
+
+    def _get_manifest_path(self):
+        return os.path.join(self._files_directory, _MANIFEST_FILE_NAME)
+
+    def _read_manifest(self):
+        """Returns the set of files the agent wrote to its working directory in previous runs
+        """
+        try:
+            with open(self._get_manifest_path()) as f:
+                return set(json.load(f))
+        except FileNotFoundError:
+            return set()
+
+    def _write_manifest(self, relative_paths):
+        if not os.path.isdir(self._files_directory):
+            os.makedirs(self._files_directory)
+        with open(self._get_manifest_path(), 'w') as f:
+            json.dump(sorted(relative_paths), f)
+
+    def _start_worker(self, agent_config, worker_id):
+        argv = [sys.executable, '-m', 'slash.frontend.main'] + agent_config['argv'][:1] + \
+               ['--parallel-parent-session-id', agent_config['parent_session_id']] + agent_config['argv'][1:] + \
+               ['--parallel-worker-id', worker_id,
+                '--parallel-addr', self.server_addr,
+                '--parallel-port', str(self.server_port),
+                '--keepalive-port', str(agent_config['keepalive_port']),
+                '--parallel-lazy-collection',
+                '--parallel-project-root', agent_config['project_root'],
+                '--workers-error-dir', self._get_errors_directory(),
+                '-l', self._get_logs_directory()]
+        _logger.notice('Starting worker {}', worker_id)
+        with open(os.devnull, 'w') as devnull:
+            self._processes[worker_id] = subprocess.Popen(argv, cwd=self.working_directory, stdin=devnull,
+                                                          stdout=devnull, stderr=devnull)
+
+    def _get_logs_directory(self):
+        return os.path.join(self._files_directory, 'logs')
+
+    def _get_errors_directory(self):
+        returned = os.path.join(self._files_directory, 'errors')
+        if not os.path.isdir(returned):
+            os.makedirs(returned)
+        return returned
+
+    def _upload_files(self, proxy, agent_config):
+        session_id_prefix = agent_config['parent_session_id'].split('_')[0]
+        for worker_id in self._processes:
+            worker_session_id = '{}_{}'.format(session_id_prefix, worker_id)
+            error_file_name = '{}-{}.log'.format(config.root.parallel.worker_error_file, worker_id)
+            self._upload_file(proxy, worker_session_id, ERROR_FILE, self._get_errors_directory(), error_file_name)
+            if not agent_config['collect_logs']:
+                continue
+            logs_directory = os.path.join(self._get_logs_directory(), worker_session_id)
+            for path, _, file_names in os.walk(logs_directory):
+                for file_name in file_names:
+                    relative_path = os.path.relpath(os.path.join(path, file_name), logs_directory)
+                    self._upload_file(proxy, worker_session_id, LOG_FILE, logs_directory, relative_path)
+
+    def _upload_file(self, proxy, worker_session_id, kind, directory, relative_path):
+        """Sends the part of a file written since it was last uploaded
+        """
+        path = os.path.join(directory, relative_path)
+        if os.path.islink(path) or not os.path.isfile(path):
+            return
+        offset = self._uploaded_sizes.get(path, 0)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                data = f.read(_READ_CHUNK_SIZE)
+                if not data:
+                    break
+                proxy.write_worker_file(worker_session_id, kind, relative_path, offset, xmlrpc_client.Binary(data))
+                offset += len(data)
+        self._uploaded_sizes[path] = offset
+
+
+def get_tree_digest(root):
+    """Returns a dictionary mapping the paths of the project files under ``root`` (matching
+    :ref:`conf.parallel.agents.tree_patterns`) to the SHA-1 digests of their contents
+    """
+    returned = {}
+    patterns = config.root.parallel.agents.tree_patterns
+    for path, dirnames, file_names in os.walk(root):
+        dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith('.') and dirname != '__pycache__']
+        for file_name in file_names:
+            if not any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns):
+                continue
+            file_path = os.path.join(path, file_name)
+            if os.path.islink(file_path):
+                continue
+            with open(file_path, 'rb') as f:
+                returned[os.path.relpath(file_path, root)] = hashlib.sha1(f.read()).hexdigest()
+    return returned
+
+
+def get_local_test_path(file_path):
+    """Translates the path of a test file collected by the parent to the corresponding file in the working directory,
+    for workers running in a mirror of the parent's project tree
+    """
+    project_root = config.root.parallel.project_root
+    if project_root is None:
+        return file_path
+    if os.path.isabs(file_path):
+        file_path = os.path.relpath(file_path, project_root)
+    return os.path.join(os.getcwd(), file_path)
+
+
+def _get_bytes(data):
+    return getattr(data, 'data', data)
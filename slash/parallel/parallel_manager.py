@@ -1,14 +1,17 @@
 import os
+import selectors
 import time
 import logbook
 import threading
 from tempfile import mkdtemp
-from  six.moves import xmlrpc_client
 from .. import log
-from ..exceptions import INTERRUPTION_EXCEPTIONS, ParallelServerIsDown, ParallelTimeout
+from ..exceptions import INTERRUPTION_EXCEPTIONS, InvalidConfiguraion, ParallelServerIsDown, ParallelTimeout
 from ..conf import config
+from .agent import AgentsRegistry
 from .server import Server, ServerStates, KeepaliveServer
-from .worker_configuration import TmuxWorkerConfiguration, ProcessWorkerConfiguration
+from .transport import get_transport
+from .worker_configuration import (TmuxWorkerConfiguration, ProcessWorkerConfiguration, ForkServerWorkerConfiguration,
+                                   RemoteWorkerConfiguration)
 
 _logger = logbook.Logger(__name__)
 log.set_log_color(_logger.name, logbook.NOTICE, 'blue')
@@ -16,8 +19,8 @@ log.set_log_color(_logger.name, logbook.NOTICE, 'blue')
 TIME_BETWEEN_CHECKS = 2
 MAX_CONNECTION_RETRIES = 200
 
-def get_xmlrpc_proxy(address, port):
-    return xmlrpc_client.ServerProxy('http://{}:{}'.format(address, port))
+def get_proxy(address):
+    return get_transport().connect(address)
 
 
 class ParallelManager(object):
@@ -31,29 +34,135 @@ class ParallelManager(object):
         self.server_thread = None
         self.keepalive_server = None
         self.keepalive_server_thread = None
+        self._elastic_worker_ids = []
+        self._last_scaling_time = time.time()
+        self._monitor = None
+        self._unwatched_workers = []
         self._create_workers()
+        # workers send heartbeats only when the exit of some of them cannot be watched
+        self.heartbeats_enabled = not config.root.parallel.watch_worker_exits or \
+            not all(worker.can_watch_exit() for worker in self.workers.values())
+        elastic_config = config.root.parallel.elastic
+        if elastic_config.enabled and elastic_config.retire_load_per_cpu < elastic_config.max_load_per_cpu:
+            raise InvalidConfiguraion("Elastic workers retirement load per CPU ({}) is lower than the load below which "
+                                      "they are started ({})".format(elastic_config.retire_load_per_cpu,
+                                                                     elastic_config.max_load_per_cpu))
 
     def _create_workers(self):
+        num_agent_workers = config.root.parallel.agents.num_workers
+        if num_agent_workers > self.workers_num:
+            raise InvalidConfiguraion("Cannot have {} workers started by agents out of {} workers".format(
+                num_agent_workers, self.workers_num))
+        if num_agent_workers and config.root.parallel.transport != 'xmlrpc':
+            raise InvalidConfiguraion("Workers started by agents require the xmlrpc parallel transport")
         for index in range(1, self.workers_num+1):
             _logger.debug("Creating worker number {}", index)
             index_str = str(index)
-            worker_cls = TmuxWorkerConfiguration if config.root.tmux.enabled else ProcessWorkerConfiguration
+            if index > self.workers_num - num_agent_workers:
+                worker_cls = RemoteWorkerConfiguration
+            else:
+                worker_cls = TmuxWorkerConfiguration if config.root.tmux.enabled else _get_process_worker_class()
             self.workers[index_str] = worker_cls(self.args, index_str)
 
+    def _get_agent_worker_ids(self):
+        return [worker_id for worker_id, worker in self.workers.items() if isinstance(worker, RemoteWorkerConfiguration)]
+
+    def _get_max_workers(self):
+        return config.root.parallel.elastic.max_workers or os.cpu_count() or 1
+
+    def _get_num_running_workers(self):
+        connected_clients = self.server.get_connected_clients()
+        # elastic workers which have not connected yet are still starting up
+        num_starting = sum(1 for worker_id in self._elastic_worker_ids
+                           if worker_id not in self.server.worker_to_pid and self.workers[worker_id].is_active())
+        return len(connected_clients) + num_starting
+
+    def check_elastic_scaling(self):
+        """Starts an additional worker when many tests remain unstarted and the machine is not loaded, and retires
+        an additional worker when the machine is overloaded. Workers are started below
+        ``parallel.elastic.max_load_per_cpu`` and retired above the higher ``parallel.elastic.retire_load_per_cpu``,
+        so that loads between the two do not make workers start and retire over and over
+        """
+        elastic_config = config.root.parallel.elastic
+        if self.server.state != ServerStates.SERVE_TESTS:
+            return
+        if time.time() - self._last_scaling_time < elastic_config.scaling_interval:
+            return
+        load_per_cpu = _get_load_per_cpu()
+        if load_per_cpu is not None and load_per_cpu > elastic_config.retire_load_per_cpu:
+            self._retire_elastic_worker(load_per_cpu)
+            return
+        if load_per_cpu is not None and load_per_cpu > elastic_config.max_load_per_cpu:
+            return
+        num_running = self._get_num_running_workers()
+        if num_running >= self._get_max_workers():
+            return
+        if self.server.get_num_unstarted_tests() < elastic_config.min_unstarted_tests_per_worker * max(num_running, 1):
+            return
+        self._start_elastic_worker()
+
+    def _start_elastic_worker(self):
+        worker_id = str(len(self.workers) + 1)
+        _logger.notice("Starting additional worker {} ({} unstarted tests)", worker_id, self.server.get_num_unstarted_tests())
+        worker = self.workers[worker_id] = _get_process_worker_class()(self.args, worker_id)
+        self._elastic_worker_ids.append(worker_id)
+        self._last_scaling_time = time.time()
+        # the worker may ask for tests as soon as it starts, so the distributer has to know it beforehand
+        self.server.add_worker(worker)
+        worker.start()
+        self._watch_worker_exit(worker)
+
+    def _retire_elastic_worker(self, load_per_cpu):
+        connected_clients = self.server.get_connected_clients()
+        candidates = [worker_id for worker_id in reversed(self._elastic_worker_ids)
+                      if worker_id in connected_clients and not self.server.is_client_retired(worker_id)]
+        if not candidates:
+            return
+        # retired workers only stop after finishing their current batch, so idle workers are retired first, and then
+        # the most recently started ones
+        worker_id = min(candidates, key=self.server.get_num_executing_tests)
+        _logger.notice("Load average per CPU is {:.2f}, retiring additional worker {}", load_per_cpu, worker_id)
+        self.server.retire_client(worker_id)
+        self._last_scaling_time = time.time()
+
     def try_connect(self):
         for _ in range(MAX_CONNECTION_RETRIES):
-            if self.server.state != ServerStates.NOT_INITIALIZED and self.keepalive_server.state != ServerStates.NOT_INITIALIZED:
+            if self.server.state != ServerStates.NOT_INITIALIZED and \
+               (self.keepalive_server is None or self.keepalive_server.state != ServerStates.NOT_INITIALIZED):
                 return
             time.sleep(0.1)
-        raise ParallelServerIsDown("Cannot connect to XML_RPC server")
+        raise ParallelServerIsDown("Cannot connect to parallel server")
 
     def start_server_in_thread(self, collected):
         self.server = Server(collected)
         self.server_thread = threading.Thread(target=self.server.serve, args=(), daemon=True)
         self.server_thread.start()
-        self.keepalive_server = KeepaliveServer()
-        self.keepalive_server_thread = threading.Thread(target=self.keepalive_server.serve, args=(), daemon=True)
-        self.keepalive_server_thread.start()
+        self._monitor = _WorkersMonitor()
+        self.server.wakeup_fd = self._monitor.wakeup_fd
+        agent_worker_ids = self._get_agent_worker_ids()
+        if agent_worker_ids:
+            self.server.agents = AgentsRegistry(agent_worker_ids, [self.args.cmd] + self.args.argv,
+                                                self.workers_error_dircetory)
+        if self.heartbeats_enabled:
+            self.keepalive_server = KeepaliveServer()
+            self.keepalive_server_thread = threading.Thread(target=self.keepalive_server.serve, args=(), daemon=True)
+            self.keepalive_server_thread.start()
+
+    def _watch_worker_exit(self, worker):
+        if self.heartbeats_enabled:
+            return
+        if not self._monitor.watch(worker):
+            self._unwatched_workers.append(worker)
+
+    def _wait_for_agents(self):
+        """Lets agents send the files their workers wrote before disconnecting
+        """
+        deadline = time.time() + config.root.parallel.communication_timeout_secs
+        while self.server.agents.has_unfinished_agents():
+            if time.time() > deadline:
+                _logger.warning("Agents did not finish sending the files of their workers")
+                return
+            self._monitor.wait(TIME_BETWEEN_CHECKS)
 
     def kill_workers(self):
         for worker in list(self.workers.values()):
@@ -75,7 +184,7 @@ class ParallelManager(object):
         _logger.error(failure_message, extra={'capture': False})
         self.kill_workers()
         self.report_worker_error_logs()
-        get_xmlrpc_proxy(config.root.parallel.server_addr, self.server.port).report_session_error(failure_message)
+        get_proxy(self.server.address).report_session_error(failure_message)
         raise ParallelTimeout(failure_message)
 
     def wait_all_workers_to_connect(self):
@@ -83,10 +192,33 @@ class ParallelManager(object):
             if time.time() - self.server.start_time > config.root.parallel.worker_connect_timeout * self.workers_num:
                 self.handle_error("Timeout: Not all clients connected to server, terminating.\n\
                                    Clients connected: {}".format(self.server.connected_clients))
-            time.sleep(TIME_BETWEEN_CHECKS)
+            self.check_worker_exits(self._monitor.wait(TIME_BETWEEN_CHECKS))
+
+    def check_worker_exits(self, exited_workers):
+        """Fails connected workers whose processes exited without disconnecting from the server
+        """
+        exited_workers = list(exited_workers)
+        for worker in list(self._unwatched_workers):
+            if worker.get_pid() is not None and not worker.is_active():
+                self._unwatched_workers.remove(worker)
+                exited_workers.append(worker)
+        connected_clients = self.server.get_connected_clients()
+        for worker in exited_workers:
+            worker_id = worker.get_worker_id()
+            if worker_id not in connected_clients:
+                continue
+            _logger.error("Worker {} exited unexpectedly, terminating session", worker_id, extra={'capture': False})
+            self.report_worker_error_logs()
+            get_proxy(self.server.address).report_client_failure(worker_id)
 
     def check_worker_timed_out(self):
-        workers_last_connection_time = self.keepalive_server.get_workers_last_connection_time()
+        """Fails connected workers which did not send any request for ``parallel.communication_timeout_secs``, such as
+        workers whose processes are still alive but hung
+        """
+        if self.keepalive_server is not None:
+            workers_last_connection_time = self.keepalive_server.get_workers_last_connection_time()
+        else:
+            workers_last_connection_time = self.server.get_clients_last_request_time()
         for worker_id in self.server.get_connected_clients():
             worker_last_connection_time = workers_last_connection_time.get(worker_id, None)
             if worker_last_connection_time is None: #worker keepalive thread didn't started yet
@@ -95,10 +227,14 @@ class ParallelManager(object):
                 _logger.error("Worker {} is down, terminating session", worker_id, extra={'capture': False})
                 self.report_worker_error_logs()
                 self.workers[worker_id].handle_timeout()
-                get_xmlrpc_proxy(config.root.parallel.server_addr, self.server.port).report_client_failure(worker_id)
+                get_proxy(self.server.address).report_client_failure(worker_id)
 
     def check_no_requests_timeout(self):
-        if time.time() - self.keepalive_server.last_request_time > config.root.parallel.no_request_timeout:
+        if self.keepalive_server is not None:
+            last_request_time = self.keepalive_server.last_request_time
+        else:
+            last_request_time = self.server.last_request_time
+        if time.time() - last_request_time > config.root.parallel.no_request_timeout:
             _logger.error("No request sent to server for {} seconds, terminating",
                           config.root.parallel.no_request_timeout, extra={'capture': False})
             if self.server.has_connected_clients():
@@ -108,30 +244,95 @@ class ParallelManager(object):
                 _logger.error("Number of unstarted tests: {}", len(self.server.get_unstarted_tests()),
                               extra={'capture': False})
             if self.server.executing_tests:
-                _logger.error("Currently executed tests indexes: {}", self.server.executing_tests.values(),
+                _logger.error("Currently executed tests indexes: {}", list(self.server.executing_tests.values()),
                               extra={'capture': False})
             self.handle_error("No request sent to server for {} seconds, terminating".format(config.root.parallel.no_request_timeout))
 
     def start(self):
         self.try_connect()
+        if self.server.agents is not None:
+            self.server.agents.set_keepalive_address(self.keepalive_server.address)
+            _logger.notice("Waiting for agents to start {} workers (slash agent --server {}:{})",
+                           len(self._get_agent_worker_ids()), config.root.parallel.server_addr, self.server.address)
         try:
             for worker in list(self.workers.values()):
                 worker.start()
+                self._watch_worker_exit(worker)
             self.wait_all_workers_to_connect()
             while self.server.should_wait_for_request():
                 self.check_worker_timed_out()
                 self.check_no_requests_timeout()
-                time.sleep(TIME_BETWEEN_CHECKS)
+                if config.root.parallel.elastic.enabled:
+                    self.check_elastic_scaling()
+                self.check_worker_exits(self._monitor.wait(TIME_BETWEEN_CHECKS))
+            if self.server.agents is not None:
+                self._wait_for_agents()
         except INTERRUPTION_EXCEPTIONS:
             _logger.error("Server interrupted, stopping workers and terminating", extra={'capture': False})
-            get_xmlrpc_proxy(config.root.parallel.server_addr, self.server.port).session_interrupted()
+            get_proxy(self.server.address).session_interrupted()
             self.kill_workers()
             raise
         finally:
             for worker in list(self.workers.values()):
                 worker.wait_to_finish()
 
-            get_xmlrpc_proxy(config.root.parallel.server_addr, self.server.port).stop_serve()
-            get_xmlrpc_proxy(config.root.parallel.server_addr, self.keepalive_server.port).stop_serve()
+            get_proxy(self.server.address).stop_serve()
             self.server_thread.join()
-            self.keepalive_server_thread.join()
+            if self.keepalive_server is not None:
+                get_proxy(self.keepalive_server.address).stop_serve()
+                self.keepalive_server_thread.join()
+            self.server.wakeup_fd = None
+            self._monitor.close()
+
+
+class _WorkersMonitor(object):
+    """Waits until worker processes exit, or until the server reports a change through :attr:`wakeup_fd`
+    """
+
+    def __init__(self):
+        super(_WorkersMonitor, self).__init__()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_read_fd, self.wakeup_fd = os.pipe()
+        for fd in (self._wakeup_read_fd, self.wakeup_fd):
+            os.set_blocking(fd, False)
+        self._selector.register(self._wakeup_read_fd, selectors.EVENT_READ)
+
+    def watch(self, worker):
+        exit_fd = worker.get_exit_fd()
+        if exit_fd is None:
+            return False
+        self._selector.register(exit_fd, selectors.EVENT_READ, worker)
+        return True
+
+    def wait(self, timeout):
+        """Returns the workers which exited within ``timeout`` seconds, returning early on server changes
+        """
+        returned = []
+        for key, _ in self._selector.select(timeout):
+            if key.data is None:
+                try:
+                    while os.read(self._wakeup_read_fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                self._selector.unregister(key.fileobj)
+                returned.append(key.data)
+        return returned
+
+    def close(self):
+        self._selector.close()
+        os.close(self._wakeup_read_fd)
+        os.close(self.wakeup_fd)
+
+
+def _get_process_worker_class():
+    return ForkServerWorkerConfiguration if config.root.parallel.fork_server else ProcessWorkerConfiguration
+
+
+def _get_load_per_cpu():
+    try:
+        load_average = os.getloadavg()[0]
+    except (AttributeError, OSError):  # not available on all platforms
+        return None
+    return load_average / (os.cpu_count() or 1)
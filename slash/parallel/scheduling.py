@@ -0,0 +1,84 @@
+import collections
+import heapq
+
+import logbook
+
+from ..core.fixtures.utils import get_scope_by_name
+from ..resuming import get_test_statistics
+
+_logger = logbook.Logger(__name__)
+
+
+class DurationAwareSchedule(object):
+    """Orders tests longest-processing-time-first according to their median durations in previous sessions.
+    Tests are grouped by file, so that workers can keep running tests of the same module (and reuse its fixtures),
+    and groups are ordered by their total expected duration
+    """
+
+    def __init__(self, tests, num_workers):
+        super(DurationAwareSchedule, self).__init__()
+        self.file_paths = [test.__slash__.file_path for test in tests]
+        statistics = get_test_statistics(set(self.file_paths))
+        durations = [_get_expected_duration(statistics, test) for test in tests]
+        known = sorted(duration for duration in durations if duration is not None)
+        # tests without history are assumed to take as long as a typical test
+        default_duration = known[len(known) // 2] if known else 0
+        self.durations = [default_duration if duration is None else duration for duration in durations]
+        self.num_known_durations = len(known)
+
+        groups = collections.OrderedDict()
+        for index, file_path in enumerate(self.file_paths):
+            groups.setdefault(file_path, []).append(index)
+        group_durations = {file_path: sum(self.durations[index] for index in indices)
+                           for file_path, indices in groups.items()}
+        ordered_groups = sorted(groups, key=lambda file_path: -group_durations[file_path])
+        self.order = [index for file_path in ordered_groups for index in groups[file_path]]
+        self.predicted_makespan = _get_predicted_makespan([group_durations[file_path] for file_path in ordered_groups],
+                                                          num_workers)
+        _logger.debug('Scheduled {} tests in {} files by duration ({} with known durations), predicted makespan: {:.1f}s',
+                      len(tests), len(groups), self.num_known_durations, self.predicted_makespan)
+
+
+def _get_expected_duration(statistics, test):
+    test_statistics = statistics.get((test.__slash__.file_path, test.__slash__.address_in_file))
+    return test_statistics.p50_duration if test_statistics is not None else None
+
+
+def _get_predicted_makespan(durations, num_workers):
+    """Simulates greedy assignment of the given (sorted) durations to the least loaded worker
+    """
+    loads = [0] * max(num_workers, 1)
+    for duration in durations:
+        heapq.heapreplace(loads, loads[0] + duration)
+    return max(loads)
+
+
+def get_fixture_group_keys(tests, fixture_store):
+    """Returns, for each test, a key grouping it with the tests sharing its module and the parameter values of the
+    module- and session-scoped fixtures it uses. Running a group on a single worker sets up these fixtures once
+    """
+    return [_get_fixture_group_key(test, fixture_store) for test in tests]
+
+
+def _get_fixture_group_key(test, fixture_store):
+    metadata = test.__slash__
+    variation = metadata.variation
+    shared_param_ids = set()
+    if variation:
+        test_scope = get_scope_by_name('test')
+        stack = list(test.get_required_fixture_objects())
+        visited = set()
+        while stack:
+            fixture = stack.pop()
+            if fixture.is_parameter() or fixture.info.id in visited:
+                continue
+            visited.add(fixture.info.id)
+            if fixture.info.scope > test_scope:
+                # parameters of a fixture are also parameters of everything depending on it
+                shared_param_ids.update(fixture_store.get_all_needed_fixture_ids(fixture))
+            else:
+                stack.extend((fixture.keyword_arguments or {}).values())
+    shared_params = tuple(sorted((param_id, value_index)
+                                 for param_id, value_index in variation.param_value_indices.items()
+                                 if param_id in shared_param_ids)) if variation else ()
+    return (metadata.module_name, shared_params)
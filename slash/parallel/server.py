@@ -1,16 +1,20 @@
-import copy
+import functools
 import logbook
+import os
+import queue
 import time
 import threading
 from enum import Enum
-from six.moves import xmlrpc_server
 from ..utils.python import unpickle
 from .. import log
 from ..ctx import context
 from ..runner import _get_test_context
 from .. import hooks
 from ..conf import config
+from ..core.result_serialization import get_serialized_outcome
+from .scheduling import DurationAwareSchedule, get_fixture_group_keys
 from .tests_distributer import TestsDistributer
+from .transport import get_transport, KEEPALIVE, SERVER
 
 _logger = logbook.Logger(__name__)
 log.set_log_color(_logger.name, logbook.NOTICE, 'blue')
@@ -19,6 +23,20 @@ NO_MORE_TESTS = "NO_MORE_TESTS"
 PROTOCOL_ERROR = "PROTOCOL_ERROR"
 WAITING_FOR_CLIENTS = "WAITING_FOR_CLIENTS"
 
+_FINISHED = 'finished'
+_INTERRUPTED = 'interrupted'
+_NOT_RUN = 'not_run'
+_CALL = 'call'
+
+
+def _synchronized(func):
+    @functools.wraps(func)
+    def new_func(self, *args, **kwargs):
+        with self._lock:  # pylint: disable=protected-access
+            return func(self, *args, **kwargs)
+    return new_func
+
+
 class ServerStates(Enum):
     NOT_INITIALIZED = 1
     WAIT_FOR_CLIENTS = 2
@@ -34,6 +52,7 @@ class KeepaliveServer(object):
         self.last_request_time = time.time()
         self.state = ServerStates.NOT_INITIALIZED
         self.port = None
+        self.address = None
         self._lock = threading.Lock()
 
     def keep_alive(self, client_id):
@@ -45,11 +64,10 @@ class KeepaliveServer(object):
         self.state = ServerStates.STOP_SERVE
 
     def serve(self):
-        server = xmlrpc_server.SimpleXMLRPCServer((config.root.parallel.server_addr, 0), allow_none=True, logRequests=False)
+        server, self.address = get_transport().create_server(KEEPALIVE, self)
         try:
-            self.port = server.server_address[1]
+            self.port = self.address
             self.state = ServerStates.WAIT_FOR_CLIENTS
-            server.register_instance(self)
             _logger.debug("Starting Keepalive server")
             while self.state != ServerStates.STOP_SERVE:
                 server.handle_request()
@@ -59,7 +77,7 @@ class KeepaliveServer(object):
 
     def get_workers_last_connection_time(self):
         with self._lock:
-            return copy.deepcopy(self.clients_last_communication_time)
+            return dict(self.clients_last_communication_time)
 
 
 class Server(object):
@@ -67,22 +85,82 @@ class Server(object):
         super(Server, self).__init__()
         self.worker_error_reported = False
         self.interrupted = False
+        self.wakeup_fd = None
         self.state = ServerStates.NOT_INITIALIZED
+        # requests are served concurrently, while results are ingested one at a time by a separate thread, which is
+        # the only one entering test contexts. Hooks fired on behalf of workers run in that thread too, so that they
+        # never see the context of a test being recorded
+        self._lock = threading.RLock()
+        self._results_queue = queue.Queue()
         self.port = None
+        self.address = None
         self.tests = tests
         self.worker_session_ids = []
         self.executing_tests = {}
         self.finished_tests = []
+        self._num_timed_tests = 0
+        self._total_tests_duration = 0
         self.num_collections_validated = 0
         self.start_time = time.time()
         self.worker_to_pid = {}
         self.connected_clients = set()
+        self._retired_clients = set()
+        self._clients_last_request_time = {}
+        self.last_request_time = time.time()
         self.collection = [[test.__slash__.file_path,
                             test.__slash__.function_name,
                             test.__slash__.variation.dump_variation_dict()]
                            for test in self.tests]
         self._sorted_collection = sorted(self.collection)
-        self._tests_distrubuter = TestsDistributer(len(self._sorted_collection))
+        self._schedule = None
+        order = affinity_keys = None
+        if config.root.parallel.schedule_by_duration:
+            self._schedule = DurationAwareSchedule(self.tests, config.root.parallel.num_workers)
+            order = self._schedule.order
+            affinity_keys = self._schedule.file_paths
+        if config.root.parallel.fixture_affinity:
+            fixture_group_keys = get_fixture_group_keys(self.tests, context.session.fixture_store)
+            # fixture groups are split by file, so workers still stick to the files of the duration schedule
+            affinity_keys = fixture_group_keys if affinity_keys is None else list(zip(affinity_keys, fixture_group_keys))
+        self._tests_distrubuter = TestsDistributer(len(self._sorted_collection), order=order, affinity_keys=affinity_keys)
+        self._serve_start_time = self._last_result_time = None
+        #: :class:`.agent.AgentsRegistry` of the session, when some workers are started by ``slash agent``
+        self.agents = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        self._wake_up()
+
+    def _wake_up(self):
+        """Notifies the parallel manager, if it is waiting on :attr:`wakeup_fd`, that the server state or its
+        connected clients changed
+        """
+        if self.wakeup_fd is not None:
+            try:
+                os.write(self.wakeup_fd, b'\0')
+            except (BlockingIOError, OSError):
+                pass  # the manager was already woken up, or stopped waiting
+
+    def keep_alive(self, client_id):
+        self._mark_client_active(client_id)
+
+    def get_activity_report_interval(self):
+        """Returns how often workers tell the server they are responsive when no keepalive server is used, so that
+        they do so several times within both ``parallel.communication_timeout_secs`` and
+        ``parallel.no_request_timeout`` of the parent
+        """
+        return min(config.root.parallel.communication_timeout_secs, config.root.parallel.no_request_timeout) / 4
+
+    def _mark_client_active(self, client_id):
+        self._clients_last_request_time[client_id] = self.last_request_time = time.time()
+
+    def get_clients_last_request_time(self):
+        return dict(self._clients_last_request_time)
 
     def has_connected_clients(self):
         return len(self.connected_clients) > 0
@@ -93,47 +171,122 @@ class Server(object):
     def has_more_tests(self):
         return len(self.finished_tests) < len(self.tests)
 
+    @_synchronized
     def report_client_failure(self, client_id):
         self.connected_clients.remove(client_id)
-        test_index = self.executing_tests.get(client_id, None)
-        if test_index is not None:
+        # results of tests in the current batch were not reported, so any of them might have been running
+        for test_index in self.executing_tests.get(client_id) or []:
             _logger.error("Worker {} interrupted while executing test {}", client_id,
                           self.tests[test_index].__slash__.address, extra={'capture': False})
-            with _get_test_context(self.tests[test_index], logging=False) as (result, _):
-                result.mark_interrupted()
-                self.finished_tests.append(test_index)
+            self._results_queue.put((_INTERRUPTED, test_index, None))
+        self.executing_tests[client_id] = []
         self.state = ServerStates.STOP_TESTS_SERVING
         self._mark_unrun_tests()
         self.worker_error_reported = True
+        self._wake_up()
 
+    @_synchronized
     def get_unstarted_tests(self):
         return self._tests_distrubuter.get_unstarted_tests()
 
+    def get_num_unstarted_tests(self):
+        return self._tests_distrubuter.get_num_unstarted_tests()
+
+    @_synchronized
+    def add_worker(self, worker_config):
+        """Lets a worker started while tests are being served receive tests
+        """
+        self._tests_distrubuter.add_worker(worker_config)
+
+    @_synchronized
+    def retire_client(self, client_id):
+        """Makes the client stop receiving tests once its current batch is over
+        """
+        _logger.notice("Retiring client_id {}", client_id)
+        self._retired_clients.add(client_id)
+
+    def is_client_retired(self, client_id):
+        return client_id in self._retired_clients
+
+    def get_num_executing_tests(self, client_id):
+        return len(self.executing_tests.get(client_id) or [])
+
     def _mark_unrun_tests(self):
         unstarted_tests_indexes = self._tests_distrubuter.get_unstarted_tests()
         for test_index in unstarted_tests_indexes:
-            with _get_test_context(self.tests[test_index], logging=False):
-                pass
-            self.finished_tests.append(test_index)
+            self._results_queue.put((_NOT_RUN, test_index, None))
         self._tests_distrubuter.clear_unstarted_tests()
 
+    def _call_in_ingestion_thread(self, func, *args, **kwargs):
+        self._results_queue.put((_CALL, functools.partial(func, *args, **kwargs), None))
+
+    def _ingest_results(self):
+        """Records finished, interrupted and unrun tests in the session results, in the order they were reported, and
+        makes the calls queued by :meth:`_call_in_ingestion_thread`
+        """
+        while True:
+            item = self._results_queue.get()
+            if item is None:
+                return
+            kind, target, result_dict = item
+            if kind == _CALL:
+                try:
+                    target()
+                except Exception:  # pylint: disable=broad-except
+                    _logger.error("Error while handling a worker request", exc_info=True, extra={'capture': False})
+                continue
+            test_index = target
+            test = self.tests[test_index]
+            duration = None
+            try:
+                with _get_test_context(test, logging=False) as (result, _):
+                    if kind == _FINISHED:
+                        result.deserialize(result_dict)
+                        context.session.reporter.report_test_end(test, result)
+                    elif kind == _INTERRUPTED:
+                        result.mark_interrupted()
+                if kind == _FINISHED:
+                    duration = result.get_duration()
+                # the parent runs no test hooks for tests run by workers, so their results are recorded here
+                if context.session.resume_state_writer is not None:
+                    context.session.resume_state_writer.add_result(result)
+            except Exception:  # pylint: disable=broad-except
+                _logger.error("Error while recording the result of {}", test.__slash__.address, exc_info=True,
+                              extra={'capture': False})
+            with self._lock:
+                if duration is not None:
+                    self._num_timed_tests += 1
+                    self._total_tests_duration += duration.total_seconds()
+                self.finished_tests.append(test_index)
+                if not self.has_more_tests():
+                    self._wake_up()
+
     def _get_worker_session_id(self, client_id):
         return "worker_{}".format(client_id)
 
+    @_synchronized
     def connect(self, client_id, client_pid):
         _logger.notice("Client_id {} connected", client_id)
+        self._mark_client_active(client_id)
         self.connected_clients.add(client_id)
         client_session_id = '{}_{}'.format(context.session.id.split('_')[0], client_id)
         context.session.logging.create_worker_symlink(self._get_worker_session_id(client_id), client_session_id)
-        hooks.worker_connected(session_id=client_session_id)  # pylint: disable=no-member
+        self._call_in_ingestion_thread(hooks.worker_connected, session_id=client_session_id)  # pylint: disable=no-member
         self.worker_session_ids.append(client_session_id)
         self.worker_to_pid[client_id] = client_pid
-        self.executing_tests[client_id] = None
-        if len(self.connected_clients) >= config.root.parallel.num_workers:
+        self.executing_tests[client_id] = []
+        if self.state == ServerStates.WAIT_FOR_CLIENTS and len(self.connected_clients) >= config.root.parallel.num_workers:
             _logger.notice("All workers connected to server")
-            self.state = ServerStates.WAIT_FOR_COLLECTION_VALIDATION
+            # workers started by agents run in a copy of the project, and always collect tests lazily
+            if config.root.parallel.lazy_worker_collection or self.agents is not None:
+                _logger.notice("Workers collect tests lazily, start serving tests")
+                self._start_serving_tests()
+            else:
+                self.state = ServerStates.WAIT_FOR_COLLECTION_VALIDATION
 
+    @_synchronized
     def validate_collection(self, client_id, sorted_client_collection):
+        sorted_client_collection = [list(entry) for entry in sorted_client_collection]
         if not self._sorted_collection == sorted_client_collection:
             _logger.error("Client_id {} sent wrong collection", client_id, extra={'capture': False})
             return False
@@ -141,74 +294,160 @@ class Server(object):
         _logger.debug("Worker {} validated tests successfully", client_id)
         if self.num_collections_validated >= config.root.parallel.num_workers and self.state == ServerStates.WAIT_FOR_COLLECTION_VALIDATION:
             _logger.notice("All workers collected tests successfully, start serving tests")
-            self.state = ServerStates.SERVE_TESTS
+            self._start_serving_tests()
         return True
 
+    def _start_serving_tests(self):
+        self._serve_start_time = time.time()
+        self.state = ServerStates.SERVE_TESTS
+
+    def _report_makespan(self):
+        if self._schedule is None or self._serve_start_time is None or self._last_result_time is None:
+            return
+        _logger.notice("Predicted makespan: {:.1f}s, actual makespan: {:.1f}s ({} of {} tests had known durations)",
+                       self._schedule.predicted_makespan, self._last_result_time - self._serve_start_time,
+                       self._schedule.num_known_durations, len(self.tests))
+
+    @_synchronized
     def disconnect(self, client_id, has_failure=False):
         _logger.notice("Client {} sent disconnect", client_id)
         self.connected_clients.remove(client_id)
         if has_failure:
             self.state = ServerStates.STOP_TESTS_SERVING
+        self._wake_up()
 
     def get_test(self, client_id):
-        if not self.executing_tests[client_id] is None:
+        returned = self.get_tests(client_id, max_count=1)
+        if isinstance(returned, list):
+            [returned] = returned
+        return returned
+
+    @_synchronized
+    def get_tests(self, client_id, max_count=None):
+        """Assigns a batch of tests to the client, sized according to :ref:`conf.parallel.max_batch_size`, returning
+        a list of ``(collection entry, test index)`` pairs
+        """
+        self._mark_client_active(client_id)
+        if self.executing_tests[client_id]:
             _logger.error("Client_id {} requested new test without sending former result", client_id,
                           extra={'capture': False})
             return PROTOCOL_ERROR
-        if self.state == ServerStates.STOP_TESTS_SERVING:
+        if self.state == ServerStates.STOP_TESTS_SERVING or client_id in self._retired_clients:
             return NO_MORE_TESTS
         elif self.state in [ServerStates.WAIT_FOR_CLIENTS, ServerStates.WAIT_FOR_COLLECTION_VALIDATION]:
             return WAITING_FOR_CLIENTS
         elif self.state == ServerStates.SERVE_TESTS and self._tests_distrubuter.has_unstarted_tests():
-            test_index = self._tests_distrubuter.get_next_test_for_client(client_id)
-            if test_index is None: #we have omre tests but current worker cannot execute them
+            batch_size = self._get_batch_size()
+            if max_count is not None:
+                batch_size = min(batch_size, max_count)
+            returned = []
+            while len(returned) < batch_size and self._tests_distrubuter.has_unstarted_tests():
+                test_index = self._tests_distrubuter.get_next_test_for_client(client_id)
+                if test_index is None:
+                    break
+                test = self.tests[test_index]
+                self.executing_tests[client_id].append(test_index)
+                self._call_in_ingestion_thread(hooks.test_distributed, test_logical_id=test.__slash__.id,  # pylint: disable=no-member
+                                               worker_session_id=self._get_worker_session_id(client_id))
+                _logger.notice("#{}: {}, Client_id: {}", test_index + 1, test.__slash__.address, client_id,
+                               extra={'highlight': True, 'filter_bypass': True})
+                returned.append((self.collection[test_index], test_index))
+            if not returned: #we have omre tests but current worker cannot execute them
                 return NO_MORE_TESTS
-            test = self.tests[test_index]
-            self.executing_tests[client_id] = test_index
-            hooks.test_distributed(test_logical_id=test.__slash__.id, worker_session_id=self._get_worker_session_id(client_id)) # pylint: disable=no-member
-            _logger.notice("#{}: {}, Client_id: {}", test_index + 1, test.__slash__.address, client_id,
-                           extra={'highlight': True, 'filter_bypass': True})
-            return (self.collection[test_index], test_index)
+            return returned
         else:
             _logger.debug("No unstarted tests, sending end to client_id {}", client_id)
             self.state = ServerStates.STOP_TESTS_SERVING
             return NO_MORE_TESTS
 
-    def finished_test(self, client_id, result_dict):
-        _logger.debug("Client_id {} finished_test", client_id)
-        test_index = self.executing_tests.get(client_id, None)
-        if test_index is not None:
-            self.finished_tests.append(test_index)
-            self.executing_tests[client_id] = None
-            with _get_test_context(self.tests[test_index], logging=False) as (result, _):
-                result.deserialize(result_dict)
-                context.session.reporter.report_test_end(self.tests[test_index], result)
-                if result.has_fatal_exception() or (not result.is_success(allow_skips=True) and config.root.run.stop_on_error):
-                    _logger.debug("Server stops serving tests, run.stop_on_error: {}, result.has_fatal_exception: {}",
-                                  config.root.run.stop_on_error, result.has_fatal_exception())
-                    self.state = ServerStates.STOP_TESTS_SERVING
-                    self._mark_unrun_tests()
+    def _get_batch_size(self):
+        max_batch_size = config.root.parallel.max_batch_size
+        if max_batch_size <= 1 or not self._num_timed_tests:
+            return 1
+        average_duration = self._total_tests_duration / self._num_timed_tests
+        if average_duration > 0:
+            returned = int(config.root.parallel.batch_target_duration / average_duration)
         else:
-            _logger.error("finished_test request from client_id {} with index {}, but no test is mapped to this worker",
-                          client_id, test_index, extra={'capture': False})
+            returned = max_batch_size
+        # towards the end of the session, smaller batches keep all workers busy until the last test
+        num_clients = max(len(self.connected_clients), 1)
+        returned = min(returned, self._tests_distrubuter.get_num_unstarted_tests() // (2 * num_clients))
+        return max(1, min(max_batch_size, returned))
+
+    def finished_test(self, client_id, result_dict):
+        return self.finished_tests_batch(client_id, [result_dict])
+
+    @_synchronized
+    def finished_tests_batch(self, client_id, result_dicts):
+        """Receives the results of the first ``len(result_dicts)`` tests assigned to the client. Returns
+        ``NO_MORE_TESTS`` if the client should stop executing the rest of its batch. Results are recorded in the
+        session by a separate thread, so that other workers are not kept waiting meanwhile
+        """
+        self._mark_client_active(client_id)
+        _logger.debug("Client_id {} finished {} tests", client_id, len(result_dicts))
+        executing = self.executing_tests.get(client_id) or []
+        if not result_dicts or len(result_dicts) > len(executing):
+            _logger.error("finished_test request from client_id {} with {} results, but {} tests are mapped to this worker",
+                          client_id, len(result_dicts), len(executing), extra={'capture': False})
             return PROTOCOL_ERROR
+        self._last_result_time = time.time()
+        for result_dict in result_dicts:
+            test_index = executing.pop(0)
+            self._results_queue.put((_FINISHED, test_index, result_dict))
+            is_success, has_fatal_errors = get_serialized_outcome(result_dict)
+            if has_fatal_errors or (not is_success and config.root.run.stop_on_error):
+                _logger.debug("Server stops serving tests, run.stop_on_error: {}, result.has_fatal_exception: {}",
+                              config.root.run.stop_on_error, has_fatal_errors)
+                self.state = ServerStates.STOP_TESTS_SERVING
+                self._mark_unrun_tests()
+        if executing and self.state == ServerStates.STOP_TESTS_SERVING:
+            self._mark_unrun_batch(client_id)
+            return NO_MORE_TESTS
+        return None
+
+    def _mark_unrun_batch(self, client_id):
+        for test_index in self.executing_tests[client_id]:
+            self._results_queue.put((_NOT_RUN, test_index, None))
+        self.executing_tests[client_id] = []
 
     def stop_serve(self):
         self.state = ServerStates.STOP_SERVE
 
+    @_synchronized
     def session_interrupted(self):
         context.session.results.global_result.mark_interrupted()
         self.interrupted = True
         if self.state != ServerStates.STOP_SERVE:
             self.state = ServerStates.STOP_TESTS_SERVING
 
+    def get_agent_configuration(self, hostname, num_workers):
+        """Assigns up to ``num_workers`` of the workers started by agents to the agent running on ``hostname``,
+        returning what the agent needs to start them, or None if the session does not accept agents yet
+        """
+        if self.agents is None:
+            return None
+        return self.agents.register(hostname, num_workers)
+
+    def agent_finished(self, worker_ids):
+        self.agents.mark_finished(worker_ids)
+        self._wake_up()
+
+    def get_project_file(self, relative_path):
+        return self.agents.get_project_file(relative_path)
+
+    def write_worker_file(self, worker_session_id, kind, relative_path, offset, data):
+        """Stores a part of a log or error file of a worker started by an agent
+        """
+        self.agents.write_worker_file(worker_session_id, kind, relative_path, offset, data)
+
     def report_warning(self, client_id, pickled_warning):
         _logger.notice("Client_id {} sent warning", client_id)
         try:
             warning = unpickle(pickled_warning)
-            context.session.warnings.add(warning)
         except TypeError:
             _logger.error('Error when deserializing warning, not adding it', extra={'capture': False})
+        else:
+            self._call_in_ingestion_thread(context.session.warnings.add, warning)
 
     def report_session_error(self, message):
         self.worker_error_reported = True
@@ -218,17 +457,22 @@ class Server(object):
         return self.has_connected_clients() or self.has_more_tests()
 
     def serve(self):
-        server = xmlrpc_server.SimpleXMLRPCServer((config.root.parallel.server_addr, config.root.parallel.server_port),\
-                                                  allow_none=True, logRequests=False)
+        server, self.address = get_transport().create_server(SERVER, self)
         try:
-            self.port = server.server_address[1]
+            self.port = self.address
             self.state = ServerStates.WAIT_FOR_CLIENTS
-            server.register_instance(self)
             _logger.debug("Starting server loop")
-            while self.state != ServerStates.STOP_SERVE:
-                server.handle_request()
+            ingestion_thread = threading.Thread(target=self._ingest_results, name='ResultsIngestion')
+            ingestion_thread.start()
+            try:
+                while self.state != ServerStates.STOP_SERVE:
+                    server.handle_request()
+            finally:
+                self._results_queue.put(None)
+                ingestion_thread.join()
             if not self.interrupted:
                 context.session.mark_complete()
+            self._report_makespan()
             _logger.trace('Session finished. is_success={0} has_skips={1}',
                           context.session.results.is_success(allow_skips=True), bool(context.session.results.get_num_skipped()))
             _logger.debug("Exiting server loop")
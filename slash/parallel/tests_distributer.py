@@ -1,3 +1,6 @@
+import collections
+import heapq
+
 from slash import ctx
 from logbook import Logger
 
@@ -5,42 +8,176 @@ from logbook import Logger
 _logger = Logger(__name__)
 
 class TestsDistributer(object):
-    def __init__(self, num_tests):
-        self._unstarted_tests_indices = [i for i in range(num_tests)]
-        self._current_tests_index = 0
-        workers_config = ctx.session.parallel_manager.workers.values()
-        self._workers_excluded_tests = {config.get_worker_id(): config.get_excluded_tests() \
-                                        for config in workers_config}
+    """Hands out test indices to workers. Each worker advances its own cursor over the shared order of tests, lazily
+    skipping tests which were already started, forced on other workers or excluded for it. Since cursors never move
+    backwards, handing out all tests takes O(num_tests * num_workers) steps overall, regardless of exclusions
+    """
+
+    def __init__(self, num_tests, order=None, affinity_keys=None, workers_config=None):
+        """:param order: optional order in which test indices are handed out, defaulting to index order
+        :param affinity_keys: optional list mapping each test index to a key (e.g. its file). Workers keep receiving
+          tests with the same key as their previous test, and prefer keys no other worker is currently working on.
+          Once all keys are taken, idle workers take tests from the end of the largest remaining group
+        :param workers_config: worker configurations, defaulting to those of the current parallel manager
+        """
+        self._order = list(order) if order is not None else list(range(num_tests))
+        self._started = bytearray(num_tests)
+        self._num_unstarted = len(self._order)
+        self._cursors = {}
+        if workers_config is None:
+            workers_config = ctx.session.parallel_manager.workers.values()
+        self._workers_excluded_tests = {}
         self._forced_tests_dict = {}
         for config in workers_config:
-            for test_index in config.get_forced_tests():
-                self._forced_tests_dict[test_index] = config.get_worker_id()
+            self.add_worker(config)
         _logger.debug("forced_tests_dict: {}", self._forced_tests_dict)
 
+        self._affinity_keys = affinity_keys
+        if affinity_keys is not None:
+            self._tests_by_key = collections.OrderedDict()
+            for test_index in self._order:
+                self._tests_by_key.setdefault(affinity_keys[test_index], []).append(test_index)
+            self._keys = list(self._tests_by_key)
+            self._key_cursors = {}
+            self._free_key_cursors = {}
+            self._client_affinity_keys = {}
+            self._num_key_holders = collections.Counter()
+            self._num_unstarted_by_key = collections.Counter(affinity_keys[test_index] for test_index in self._order)
+            # a heap of remaining groups by size, for idle workers to steal from. An entry is pushed whenever a group
+            # shrinks, and entries whose size is out of date are dropped when they reach the top
+            self._key_positions = {key: position for position, key in enumerate(self._keys)}
+            self._remaining_keys_heap = [(-self._num_unstarted_by_key[key], position, key)
+                                         for position, key in enumerate(self._keys)]
+            heapq.heapify(self._remaining_keys_heap)
+            self._tail_cursors = {}
+            self._stealing_clients = set()
+
+    def add_worker(self, worker_config):
+        """Lets tests be handed out to a worker started after the distributer was created
+        """
+        self._workers_excluded_tests[worker_config.get_worker_id()] = worker_config.get_excluded_tests()
+        for test_index in worker_config.get_forced_tests():
+            self._forced_tests_dict[test_index] = worker_config.get_worker_id()
+
     def _can_execute_test(self, test_index, client_id):
-        _logger.debug("_can_execute_test - client_id: {}, test_index: {}", client_id, test_index)
         forced_worker = self._forced_tests_dict.get(test_index)
         if forced_worker is not None:
             return forced_worker == client_id
         return test_index not in self._workers_excluded_tests[client_id]
 
     def get_next_test_for_client(self, client_id):
-        ret = None
-        for test_index in self._unstarted_tests_indices:
-            if self._can_execute_test(test_index, client_id):
-                ret = test_index
+        if not self._num_unstarted:
+            return None
+        if self._affinity_keys is not None:
+            ret = self._get_next_test_by_affinity(client_id)
+        else:
+            ret = self._advance(self._order, self._cursors, client_id, client_id)
+        if ret is None:
+            _logger.debug('worker id {} cannot execute any of the {} unstarted tests', client_id, self._num_unstarted)
+        else:
+            self._started[ret] = 1
+            self._num_unstarted -= 1
+            if self._affinity_keys is not None:
+                key = self._affinity_keys[ret]
+                self._num_unstarted_by_key[key] -= 1
+                if self._num_unstarted_by_key[key]:
+                    heapq.heappush(self._remaining_keys_heap,
+                                   (-self._num_unstarted_by_key[key], self._key_positions[key], key))
+        return ret
+
+    def _advance(self, test_indices, cursors, cursor_key, client_id):
+        """Moves the cursor stored under ``cursor_key`` to the next test in ``test_indices`` the client can execute
+        """
+        position = cursors.get(cursor_key, 0)
+        while position < len(test_indices):
+            test_index = test_indices[position]
+            if not self._started[test_index] and self._can_execute_test(test_index, client_id):
+                break
+            position += 1
+        cursors[cursor_key] = position
+        return test_indices[position] if position < len(test_indices) else None
+
+    def _advance_backwards(self, test_indices, cursors, cursor_key, client_id):
+        """Like ``_advance``, only moving the cursor from the end of ``test_indices`` towards its start
+        """
+        position = cursors.get(cursor_key, len(test_indices) - 1)
+        while position >= 0:
+            test_index = test_indices[position]
+            if not self._started[test_index] and self._can_execute_test(test_index, client_id):
                 break
+            position -= 1
+        cursors[cursor_key] = position
+        return test_indices[position] if position >= 0 else None
+
+    def _get_next_test_by_affinity(self, client_id):
+        current_key = self._client_affinity_keys.get(client_id)
+        if current_key is not None:
+            if client_id in self._stealing_clients:
+                returned = self._advance_backwards(self._tests_by_key[current_key], self._tail_cursors,
+                                                   (client_id, current_key), client_id)
             else:
-                _logger.debug('worker id {} cannot execute test number {}, searching another', client_id, test_index)
-        if ret is not None:
-            self._unstarted_tests_indices.remove(ret)
-        return ret
+                returned = self._advance(self._tests_by_key[current_key], self._key_cursors,
+                                         (client_id, current_key), client_id)
+            if returned is not None:
+                return returned
+            self._set_client_affinity_key(client_id, None)
+
+        position = self._free_key_cursors.get(client_id, 0)
+        while position < len(self._keys):
+            key = self._keys[position]
+            # keys skipped here while held by other workers are still reachable below, once all keys are started
+            if not self._num_key_holders[key]:
+                returned = self._advance(self._tests_by_key[key], self._key_cursors, (client_id, key), client_id)
+                if returned is not None:
+                    self._free_key_cursors[client_id] = position
+                    self._set_client_affinity_key(client_id, key)
+                    return returned
+            position += 1
+        self._free_key_cursors[client_id] = position
+
+        # when all remaining keys are being worked on by other workers, help with the largest remaining group. Tests
+        # are taken from its end, so that the worker holding it keeps running its tests in order
+        returned = None
+        popped = []
+        while self._remaining_keys_heap:
+            entry = heapq.heappop(self._remaining_keys_heap)
+            negative_size, _, key = entry
+            if -negative_size != self._num_unstarted_by_key[key]:
+                continue
+            popped.append(entry)
+            returned = self._advance_backwards(self._tests_by_key[key], self._tail_cursors, (client_id, key), client_id)
+            if returned is not None:
+                self._set_client_affinity_key(client_id, key)
+                self._stealing_clients.add(client_id)
+                break
+        for entry in popped:
+            heapq.heappush(self._remaining_keys_heap, entry)
+        return returned
+
+    def _set_client_affinity_key(self, client_id, key):
+        self._stealing_clients.discard(client_id)
+        previous_key = self._client_affinity_keys.pop(client_id, None)
+        if previous_key is not None:
+            self._num_key_holders[previous_key] -= 1
+        if key is not None:
+            self._client_affinity_keys[client_id] = key
+            self._num_key_holders[key] += 1
 
     def clear_unstarted_tests(self):
-        self._unstarted_tests_indices = []
+        for test_index in self._order:
+            self._started[test_index] = 1
+        self._num_unstarted = 0
+        if self._affinity_keys is not None:
+            self._num_unstarted_by_key.clear()
+            del self._remaining_keys_heap[:]
 
     def get_unstarted_tests(self):
-        return list(self._unstarted_tests_indices)
+        if not self._num_unstarted:
+            return []
+        return [test_index for test_index in self._order if not self._started[test_index]]
+
+    def get_num_unstarted_tests(self):
+        return self._num_unstarted
 
     def has_unstarted_tests(self):
-        return len(self._unstarted_tests_indices) > 0
+        return self._num_unstarted > 0
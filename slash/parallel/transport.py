@@ -0,0 +1,257 @@
+"""Transports carrying requests between the parallel parent process and its workers.
+
+Each transport creates servers dispatching requests to the methods of an instance (:class:`.server.Server` or
+:class:`.server.KeepaliveServer`), and proxies calling those methods by name from other processes or threads.
+"""
+import functools
+import os
+import pickle
+import selectors
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import traceback
+
+import logbook
+from six.moves import socketserver, xmlrpc_client, xmlrpc_server
+
+from ..conf import config
+from ..exceptions import ParallelRemoteCallError
+
+_logger = logbook.Logger(__name__)
+
+SERVER = 'server'
+KEEPALIVE = 'keepalive'
+
+_LENGTH = struct.Struct('!I')
+# servers handle requests in separate threads, so the serving loop wakes up periodically to check whether to stop
+_HANDLE_REQUEST_TIMEOUT = 0.5
+
+
+def get_transport(name=None):
+    """Returns the transport named ``name``, defaulting to :ref:`conf.parallel.transport`
+    """
+    if name is None:
+        name = config.root.parallel.transport
+    transport_cls = _TRANSPORTS.get(name)
+    if transport_cls is None:
+        raise ValueError('Unknown parallel transport {!r} (available transports: {})'.format(
+            name, ', '.join(sorted(_TRANSPORTS))))
+    return transport_cls()
+
+
+class XMLRPCTransport(object):
+    """XML-RPC over HTTP, opening a new TCP connection for every request
+    """
+
+    def create_server(self, role, instance):
+        port = config.root.parallel.server_port if role == SERVER else 0
+        server = ThreadingXMLRPCServer((config.root.parallel.server_addr, port), allow_none=True, logRequests=False)
+        server.register_instance(instance)
+        return server, server.server_address[1]
+
+    def connect(self, address):
+        return xmlrpc_client.ServerProxy('http://{}:{}'.format(config.root.parallel.server_addr, address), allow_none=True)
+
+    def get_configured_address(self, role):
+        return config.root.parallel.server_port if role == SERVER else config.root.parallel.keepalive_port
+
+    def get_worker_argv(self, server_address, keepalive_address):
+        returned = ['--parallel-port', str(server_address)]
+        if keepalive_address is not None:
+            returned += ['--keepalive-port', str(keepalive_address)]
+        return returned
+
+
+class UnixSocketTransport(object):
+    """Length-prefixed pickled messages over persistent unix domain socket connections. Since requests are
+    unpickled by the server, the sockets are created in a directory accessible only to the current user
+    """
+
+    def create_server(self, role, instance):
+        path = self.get_configured_address(role)
+        owned_directory = None
+        if path is None:
+            owned_directory = tempfile.mkdtemp(prefix='slash-parallel-')
+            path = os.path.join(owned_directory, '{}.sock'.format(role))
+        return SocketRPCServer(path, instance, owned_directory=owned_directory), path
+
+    def connect(self, address):
+        return SocketRPCProxy(address)
+
+    def get_configured_address(self, role):
+        return config.root.parallel.server_path if role == SERVER else config.root.parallel.keepalive_path
+
+    def get_worker_argv(self, server_address, keepalive_address):
+        returned = ['--parallel-server-path', server_address]
+        if keepalive_address is not None:
+            returned += ['--keepalive-path', keepalive_address]
+        return returned
+
+
+_TRANSPORTS = {
+    'xmlrpc': XMLRPCTransport,
+    'unix': UnixSocketTransport,
+}
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, xmlrpc_server.SimpleXMLRPCServer):
+    """Handles every request in a separate thread, with :meth:`handle_request` returning once a request was accepted
+    or after a timeout
+    """
+    daemon_threads = True
+    block_on_close = False
+    timeout = _HANDLE_REQUEST_TIMEOUT
+    # every request opens a new connection, so many workers easily overflow the default backlog of 5
+    request_queue_size = socket.SOMAXCONN
+
+
+class SocketRPCServer(object):
+    """Serves requests from any number of persistent connections, each in its own thread. Mirrors the interface of
+    ``SimpleXMLRPCServer``: :meth:`handle_request` accepts at most one new connection, returning after a timeout
+    """
+
+    def __init__(self, path, instance, owned_directory=None):
+        super(SocketRPCServer, self).__init__()
+        self._path = path
+        self._owned_directory = owned_directory
+        self._instance = instance
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(socket.SOMAXCONN)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def handle_request(self):
+        if not self._selector.select(_HANDLE_REQUEST_TIMEOUT):
+            return
+        connection, _ = self._listener.accept()
+        with self._connections_lock:
+            self._connections.add(connection)
+        threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def _serve_connection(self, connection):
+        try:
+            while True:
+                request = receive_message(connection)
+                if request is None:
+                    break
+                send_message(connection, self._dispatch(*request))
+        except OSError as e:
+            # a worker going away should never bring the server down
+            _logger.debug('Error communicating with client: {}', e)
+        finally:
+            self._close_connection(connection)
+
+    def _dispatch(self, method_name, args):
+        if method_name.startswith('_'):
+            return (False, 'Method {!r} is not supported'.format(method_name))
+        try:
+            return (True, getattr(self._instance, method_name)(*args))
+        except Exception:  # pylint: disable=broad-except
+            _logger.debug('Error while handling {!r} request', method_name, exc_info=True)
+            return (False, traceback.format_exc())
+
+    def _close_connection(self, connection):
+        with self._connections_lock:
+            if connection not in self._connections:
+                return
+            self._connections.discard(connection)
+        connection.close()
+
+    def server_close(self):
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            # wakes up the thread waiting for requests on this connection, which then closes it
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._selector.close()
+        self._listener.close()
+        if self._owned_directory is not None:
+            shutil.rmtree(self._owned_directory, ignore_errors=True)
+        else:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+
+class SocketRPCProxy(object):
+    """Calls methods of a :class:`SocketRPCServer` instance by name, over a single connection established on first use
+    """
+
+    def __init__(self, path):
+        super(SocketRPCProxy, self).__init__()
+        self._path = path
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method_name):
+        if method_name.startswith('_'):
+            raise AttributeError(method_name)
+        return functools.partial(self._call, method_name)
+
+    def _call(self, method_name, *args):
+        with self._lock:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self._path)
+            try:
+                send_message(self._socket, (method_name, args))
+                response = receive_message(self._socket)
+            except OSError:
+                self._close()
+                raise
+            if response is None:
+                self._close()
+                raise ConnectionResetError('Connection to {} was closed'.format(self._path))
+        success, returned = response
+        if not success:
+            raise ParallelRemoteCallError('{!r} failed on server:\n{}'.format(method_name, returned))
+        return returned
+
+    def _close(self):
+        self._socket.close()
+        self._socket = None
+
+    def __del__(self):
+        # proxies are often used for a single call, so their connection is closed once they are no longer referenced
+        if getattr(self, '_socket', None) is not None:
+            self._close()
+
+
+def send_message(sock, message):
+    """Sends a length-prefixed pickled message over a stream socket
+    """
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def receive_message(sock):
+    """Receives a message sent by :func:`send_message`, returning None if the connection was closed
+    """
+    header = _receive_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    payload = _receive_exactly(sock, _LENGTH.unpack(header)[0])
+    if payload is None:
+        return None
+    return pickle.loads(payload)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
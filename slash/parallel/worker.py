@@ -5,9 +5,10 @@ import pickle
 import time
 import collections
 import platform
-from six.moves import xmlrpc_client
+from .agent import get_local_test_path
 from .server import NO_MORE_TESTS, PROTOCOL_ERROR, WAITING_FOR_CLIENTS
-from ..exceptions import INTERRUPTION_EXCEPTIONS
+from .transport import get_transport, KEEPALIVE, SERVER
+from ..exceptions import CannotLoadTests, INTERRUPTION_EXCEPTIONS
 from ..hooks import register
 from ..ctx import context
 from ..runner import run_tests
@@ -22,16 +23,17 @@ class Worker(object):
         super(Worker, self).__init__()
         self.client_id = client_id
         self.session_id = session_id
-        self.server_addr = 'http://{}:{}'.format(config.root.parallel.server_addr, config.root.parallel.server_port)
-        self.keepalive_server_addr = 'http://{}:{}'.format(config.root.parallel.server_addr, config.root.parallel.keepalive_port)
+        self._transport = get_transport()
+        self.server_addr = self._transport.get_configured_address(SERVER)
+        self.keepalive_server_addr = self._transport.get_configured_address(KEEPALIVE)
         self._stop_event = None
         self._watchdog_thread = None
 
-    def keep_alive(self, stop_event):
-        proxy = xmlrpc_client.ServerProxy(self.keepalive_server_addr)
+    def keep_alive(self, stop_event, address, interval):
+        proxy = self._transport.connect(address)
         while not stop_event.is_set():
             proxy.keep_alive(self.client_id)
-            stop_event.wait(1)
+            stop_event.wait(interval)
 
     def warning_added(self, warning):
         try:
@@ -56,10 +58,17 @@ class Worker(object):
 
     def connect_to_server(self):
         try:
-            self.client = xmlrpc_client.ServerProxy(self.server_addr, allow_none=True)
+            self.client = self._transport.connect(self.server_addr)
             self.client.connect(self.client_id, os.getpid())
+            # the parent only asks for heartbeats when it cannot watch worker processes exiting. Otherwise, the server
+            # is only told less often that the worker is still responsive
+            if self.keepalive_server_addr:
+                address, interval = self.keepalive_server_addr, 1
+            else:
+                address, interval = self.server_addr, self.client.get_activity_report_interval()
             self._stop_event = threading.Event()
-            self._watchdog_thread = threading.Thread(target=self.keep_alive, args=(self._stop_event,), daemon=True)
+            self._watchdog_thread = threading.Thread(target=self.keep_alive, args=(self._stop_event, address, interval),
+                                                     daemon=True)
             self._watchdog_thread.start()
         except OSError as err:
             self.write_to_error_file("Failed to connect to server, error: {}".format(str(err)))
@@ -69,6 +78,49 @@ class Worker(object):
             self._stop_event.set()
             self._watchdog_thread.join()
 
+    def _run_tests_batch(self, test_entries, get_test):
+        """Runs a batch of tests assigned by the server, sending their results whenever the batch ends or
+        parallel.batch_target_duration elapses. Returns a tuple of (should_stop, load_failed)
+        """
+        pending_results = []
+        last_report_time = time.time()
+        for index, (signature, test_index) in enumerate(test_entries):
+            try:
+                test = get_test(tuple(signature))
+            except CannotLoadTests as err:
+                _logger.error("Worker_id {} could not load assigned test: {}", self.client_id, err,
+                              extra={'capture': False})
+                self.write_to_error_file(str(err))
+                if pending_results:
+                    self.client.finished_tests_batch(self.client_id, pending_results)
+                self.client.report_client_failure(self.client_id)
+                return True, True
+            context.session.current_parallel_test_index = test_index
+            run_tests([test])
+            result = context.session.results[test]
+            pending_results.append(result.serialize())
+            # run_tests only checks run.stop_on_error between the tests it was given. Only the results which may have
+            # changed are checked for fatal errors, rather than rescanning all of the worker's results
+            if result.has_fatal_errors() or context.session.results.global_result.has_fatal_errors() or \
+               (config.root.run.stop_on_error and not context.session.results.is_success(allow_skips=True)):
+                _logger.debug("Client {} stops executing its batch (run.stop_on_error: {})", self.client_id,
+                              config.root.run.stop_on_error)
+                self.client.finished_tests_batch(self.client_id, pending_results)
+                return True, False
+            if index == len(test_entries) - 1 or time.time() - last_report_time >= config.root.parallel.batch_target_duration:
+                _logger.debug("Client {} finished {} tests, sending results", self.client_id, len(pending_results))
+                ret = self.client.finished_tests_batch(self.client_id, pending_results)
+                pending_results = []
+                last_report_time = time.time()
+                if ret == PROTOCOL_ERROR:
+                    _logger.error("Worker_id {} recieved protocol error message, terminating", self.client_id,
+                                  extra={'capture': False})
+                    return True, False
+                if ret == NO_MORE_TESTS:
+                    _logger.debug("Got NO_MORE_TESTS, Client {} stops executing its batch", self.client_id)
+                    return True, False
+        return False, False
+
     def start_execution(self, app, collected_tests):
         if _HAS_PID_PGID:
             if os.getpid() != os.getpgid(0):
@@ -79,46 +131,41 @@ class Worker(object):
             )
         register(self.warning_added)
         register(self.error_added)
-        collection = [(test.__slash__.file_path,
-                      test.__slash__.function_name,
-                      test.__slash__.variation.dump_variation_dict()) for test in collected_tests]
-        if not self.client.validate_collection(self.client_id, sorted(collection)):
-            _logger.error("Collections of worker id {} and master don't match, worker terminates", self.client_id,
-                          extra={'capture': False})
-            self._stop_keepalive_thread()
-            self.client.disconnect(self.client_id, has_failure=True)
-            return
+        if config.root.parallel.lazy_worker_collection:
+            get_test = _LazyTestsCollection(app.test_loader).get_test
+        else:
+            collection = [_get_test_signature(test) for test in collected_tests]
+            if not self.client.validate_collection(self.client_id, sorted(collection)):
+                _logger.error("Collections of worker id {} and master don't match, worker terminates", self.client_id,
+                              extra={'capture': False})
+                self._stop_keepalive_thread()
+                self.client.disconnect(self.client_id, has_failure=True)
+                return
+            signatures_dict = collections.defaultdict(set)
+            for index, test in enumerate(collection):
+                signatures_dict[test].add(index)
+
+            def get_test(signature):
+                return collected_tests[signatures_dict[signature].pop()]
 
         should_stop = False
-        signatures_dict = collections.defaultdict(set)
-        for index, test in enumerate(collection):
-            signatures_dict[test].add(index)
+        load_failed = False
         with app.session.get_started_context():
             try:
                 while not should_stop:
-                    test_entry = self.client.get_test(self.client_id)
-                    if test_entry == WAITING_FOR_CLIENTS:
+                    test_entries = self.client.get_tests(self.client_id)
+                    if test_entries == WAITING_FOR_CLIENTS:
                         _logger.debug("Worker_id {} recieved waiting_for_clients, sleeping", self.client_id)
                         time.sleep(0.05)
-                    elif test_entry == PROTOCOL_ERROR:
+                    elif test_entries == PROTOCOL_ERROR:
                         _logger.error("Worker_id {} recieved protocol error message, terminating", self.client_id,
                                       extra={'capture': False})
                         break
-                    elif test_entry == NO_MORE_TESTS:
+                    elif test_entries == NO_MORE_TESTS:
                         _logger.debug("Got NO_MORE_TESTS, Client {} disconnecting", self.client_id)
                         break
                     else:
-                        index = signatures_dict[tuple(test_entry[0])].pop()
-                        test = collected_tests[index]
-                        context.session.current_parallel_test_index = test_entry[1]
-                        run_tests([test])
-                        result = context.session.results[test]
-                        _logger.debug("Client {} finished test, sending results", self.client_id)
-                        ret = self.client.finished_test(self.client_id, result.serialize())
-                        if ret == PROTOCOL_ERROR:
-                            _logger.error("Worker_id {} recieved protocol error message, terminating", self.client_id,
-                                          extra={'capture': False})
-                            should_stop = True
+                        should_stop, load_failed = self._run_tests_batch(test_entries, get_test)
             except INTERRUPTION_EXCEPTIONS:
                 self.write_to_error_file("Worker interrupted while executing test")
                 _logger.error("Worker interrupted while executing test", extra={'capture': False})
@@ -127,10 +174,45 @@ class Worker(object):
                 self.write_to_error_file(str(err))
                 raise
             else:
-                context.session.mark_complete()
+                if not load_failed:
+                    context.session.mark_complete()
                 context.session.initiate_cleanup()
                 self._stop_keepalive_thread()
-                self.client.disconnect(self.client_id)
+                if not load_failed:
+                    self.client.disconnect(self.client_id)
             finally:
                 context.session.initiate_cleanup()
                 self._stop_keepalive_thread()
+
+
+class _LazyTestsCollection(object):
+    """Loads the tests assigned to a worker on demand, importing only the files they are defined in
+    """
+
+    def __init__(self, loader):
+        super(_LazyTestsCollection, self).__init__()
+        self._loader = loader
+        self._loaded_file_paths = set()
+        self._tests_by_signature = {}
+
+    def get_test(self, signature):
+        file_path = get_local_test_path(signature[0])
+        signature = (file_path,) + tuple(signature[1:])
+        if file_path not in self._loaded_file_paths:
+            self._loaded_file_paths.add(file_path)
+            for test in self._loader.get_tests_in_file(file_path):
+                self._tests_by_signature.setdefault(_get_test_signature(test), test)
+        test = self._tests_by_signature.get(signature)
+        if test is None:
+            raise CannotLoadTests('Cannot find test {} (function {}, variation {})'.format(*signature))
+        # repeated tests share the same signature, so each assignment gets its own copy
+        returned = test.clone()
+        returned.__slash__.allocate_id()
+        context.session.increment_total_num_tests(1)
+        return returned
+
+
+def _get_test_signature(test):
+    return (test.__slash__.file_path,
+            test.__slash__.function_name,
+            test.__slash__.variation.dump_variation_dict())
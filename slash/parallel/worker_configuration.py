@@ -3,7 +3,9 @@ from .. import hooks
 import os
 import logbook
 from ..utils.tmux_utils import create_new_window, create_new_pane
+from .transport import get_transport
 from slash import ctx
+import multiprocessing
 import subprocess
 import time
 import signal
@@ -12,6 +14,8 @@ import sys
 
 _logger = logbook.Logger(__name__)
 
+_FORK_SERVER_PRELOAD_MODULES = ['slash.frontend.main', 'slash.frontend.slash_run', 'slash.parallel.worker']
+
 def is_process_running(pid):
     try:
         os.kill(pid, 0)
@@ -25,7 +29,7 @@ def is_process_running(pid):
 class WorkerConfiguration(object):
     def __init__(self, args, worker_id):
         self._worker_id = worker_id
-        self.argv = [sys.executable, '-m', 'slash.frontend.main', args.cmd, '--parallel-parent-session-id', ctx.session.id] + \
+        self.argv = _get_interpreter_argv() + [args.cmd, '--parallel-parent-session-id', ctx.session.id] + \
                      args.argv + ["--parallel-worker-id", str(worker_id)]
         self._excluded_tests = set()
         self._forced_tests = set()
@@ -46,9 +50,10 @@ class WorkerConfiguration(object):
     def start(self):
         hooks.before_worker_start(worker_config=self) # pylint: disable=no-member
         _logger.notice("Starting worker number {}", self._worker_id)
-        self.argv += ['--parallel-port', str(ctx.session.parallel_manager.server.port),\
-                      '--keepalive-port', str(ctx.session.parallel_manager.keepalive_server.port), \
-                      '--workers-error-dir', ctx.session.parallel_manager.workers_error_dircetory]
+        keepalive_server = ctx.session.parallel_manager.keepalive_server
+        self.argv += get_transport().get_worker_argv(ctx.session.parallel_manager.server.address,
+                                                     keepalive_server.address if keepalive_server is not None else None)
+        self.argv += ['--workers-error-dir', ctx.session.parallel_manager.workers_error_dircetory]
         self._start()
 
     def kill(self):
@@ -89,6 +94,17 @@ class WorkerConfiguration(object):
     def get_pid(self):
         return self._pid
 
+    @classmethod
+    def can_watch_exit(cls):
+        """Returns whether started workers provide a file descriptor becoming readable when they exit
+        """
+        return False
+
+    def get_exit_fd(self):
+        """Returns a file descriptor which becomes readable when the worker exits, or None if unavailable
+        """
+        return None
+
     def is_active(self):
         raise NotImplementedError()
 
@@ -96,9 +112,25 @@ class WorkerConfiguration(object):
         raise NotImplementedError()
 
 class ProcessWorkerConfiguration(WorkerConfiguration):
+    def __init__(self, args, worker_id):
+        super(ProcessWorkerConfiguration, self).__init__(args, worker_id)
+        self._exit_fd = None
+
     def _start(self):
         with open(os.devnull, 'w') as devnull:
             self._pid = subprocess.Popen(self.argv, stdin=devnull, stdout=devnull, stderr=devnull)
+        if self.can_watch_exit():
+            try:
+                self._exit_fd = os.pidfd_open(self._pid.pid)  # pylint: disable=no-member
+            except OSError as e:  # e.g. kernels older than 5.3
+                _logger.debug('Cannot watch exit of worker {}: {}', self._worker_id, e)
+
+    @classmethod
+    def can_watch_exit(cls):
+        return hasattr(os, 'pidfd_open')
+
+    def get_exit_fd(self):
+        return self._exit_fd
 
     def kill(self):
         if self._pid is not None:
@@ -113,6 +145,71 @@ class ProcessWorkerConfiguration(WorkerConfiguration):
 
     def wait_to_finish(self):
         self._pid.wait()
+        if self._exit_fd is not None:
+            os.close(self._exit_fd)
+            self._exit_fd = None
+
+class ForkServerWorkerConfiguration(WorkerConfiguration):
+    """Forks workers from a template process which has already imported slash and the modules listed in
+    :ref:`conf.parallel.fork_server_preload`, instead of starting a new interpreter for each worker
+    """
+
+    def __init__(self, args, worker_id):
+        super(ForkServerWorkerConfiguration, self).__init__(args, worker_id)
+        self._process = None
+
+    def _start(self):
+        context = _get_fork_server_context()
+        self._process = context.Process(target=_run_forked_worker,
+                                        args=(self.argv[len(_get_interpreter_argv()):], os.getcwd(), dict(os.environ)))
+        self._process.start()
+        self._pid = self._process.pid
+
+    @classmethod
+    def can_watch_exit(cls):
+        return True
+
+    def get_exit_fd(self):
+        return self._process.sentinel if self._process is not None else None
+
+    def kill(self):
+        if self._process is not None:
+            self._process.terminate()
+
+    def handle_timeout(self):
+        if self.is_active():
+            self._process.kill()
+
+    def is_active(self):
+        return self._process.is_alive()
+
+    def wait_to_finish(self):
+        self._process.join()
+
+class RemoteWorkerConfiguration(WorkerConfiguration):
+    """A worker started by a ``slash agent`` process, possibly on another host. Since its process cannot be watched or
+    signaled, it is monitored through heartbeats, and stops once the server has no more tests for it
+    """
+
+    def _start(self):
+        _logger.notice("Waiting for an agent to start worker {}", self._worker_id)
+
+    def get_pid(self):
+        if self._pid is None:
+            self._pid = ctx.session.parallel_manager.server.worker_to_pid.get(self._worker_id)
+        return self._pid
+
+    def kill(self):
+        pass
+
+    def handle_timeout(self):
+        pass
+
+    def is_active(self):
+        return True
+
+    def wait_to_finish(self):
+        pass
 
 class TmuxWorkerConfiguration(WorkerConfiguration):
     def __init__(self, basic_args, worker_id):
@@ -152,3 +249,25 @@ class TmuxWorkerConfiguration(WorkerConfiguration):
                 break
             else:
                 time.sleep(0.5)
+
+
+def _get_interpreter_argv():
+    return [sys.executable, '-m', 'slash.frontend.main']
+
+def _get_fork_server_context():
+    returned = multiprocessing.get_context('forkserver')
+    # the preload list only takes effect when the fork server is first started
+    returned.set_forkserver_preload(_FORK_SERVER_PRELOAD_MODULES + list(config.root.parallel.fork_server_preload))
+    return returned
+
+def _run_forked_worker(argv, working_directory, environ):
+    # the fork server is shared between sessions, so the worker should not rely on its state
+    os.chdir(working_directory)
+    os.environ.clear()
+    os.environ.update(environ)
+    with open(os.devnull, 'r+') as devnull:
+        for fd in (0, 1, 2):
+            os.dup2(devnull.fileno(), fd)
+    sys.argv = ['slash'] + argv
+    from ..frontend.main import main_entry_point
+    main_entry_point()
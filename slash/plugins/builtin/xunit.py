@@ -1,7 +1,12 @@
+import collections
 import datetime
 import itertools
+import os
 import socket
 import sys
+
+import logbook
+
 from ..interface import PluginInterface
 from ...ctx import context
 from ...conf import config
@@ -10,10 +15,20 @@ from ...utils.conf_utils import Cmdline, Doc
 from slash import config as slash_config
 from slash import context
 from xml.etree.ElementTree import (
+    fromstring as xml_from_string,
+    iterparse as xml_iterparse,
     tostring as xml_to_string,
     Element as E,
     SubElement as SE
 )
+from xml.sax.saxutils import quoteattr
+
+_HEADER_SPARE_SIZE = 128
+_MAX_HEADER_SIZE = 64 * 1024
+_COPY_CHUNK_SIZE = 1024 * 1024
+_COUNT_ATTRIBUTES = ('tests', 'errors', 'failures', 'skipped')
+
+_logger = logbook.Logger(__name__)
 
 class Plugin(PluginInterface):
     """
@@ -21,6 +36,8 @@ class Plugin(PluginInterface):
     """
 
     _start_time = datetime.datetime.now()
+    _writer = _pending_result = None
+    _test_workers = {}
 
     def get_name(self):
         return "xunit"
@@ -28,10 +45,44 @@ class Plugin(PluginInterface):
     def get_default_config(self):
         return {
             "filename": "testsuite.xml" // Cmdline(arg="--xunit-filename") // Doc('Name of XML xUnit file to create'),
+            "streaming": False // Cmdline(on="--xunit-streaming") // Doc(
+                'Write test cases to the xUnit file as tests end, instead of when the session ends'),
+            "worker_shards": False // Cmdline(on="--xunit-worker-shards") // Doc(
+                'In parallel runs, make every worker write its own xUnit file, merged by the parent when the session ends'),
         }
 
     def session_start(self):
         self._start_time = datetime.datetime.now()
+        self._pending_result = None
+        self._test_workers = {}
+        plugin_config = slash_config.root.plugin_config.xunit
+        if config.root.parallel.worker_id is not None:
+            if plugin_config.worker_shards:
+                self._writer = _StreamingWriter(
+                    _get_shard_filename('worker_{}'.format(config.root.parallel.worker_id)),
+                    self._get_testsuite_attributes())
+        elif plugin_config.streaming:
+            self._writer = _StreamingWriter(plugin_config.filename, self._get_testsuite_attributes())
+
+    def test_distributed(self, test_logical_id, worker_session_id):
+        if slash_config.root.plugin_config.xunit.worker_shards:
+            self._test_workers[test_logical_id] = worker_session_id
+
+    def test_start(self):
+        self._write_pending_result()
+
+    def test_end(self):
+        if self._writer is None:
+            return
+        self._write_pending_result()
+        # results are written once the next test starts, to include errors added by later test_end hooks and the
+        # duration of the test
+        self._pending_result = context.result
+
+    def _write_pending_result(self):
+        if self._pending_result is not None:
+            self._writer.add_test_case(self._get_test_case_result_element(self._pending_result), self._pending_result)
+            self._pending_result = None
 
     def _add_error(self, parent, errortype, error):
         exc_type, exc_value, _ = exc_info = sys.exc_info()
@@ -72,60 +123,300 @@ class Plugin(PluginInterface):
             r.text = str(d)
         return r
 
+    def _get_testsuite_attributes(self, results=None):
+        returned = {
+            "name": "slash-suite",
+            "hostname": socket.getfqdn(),
+            "timestamp": self._start_time.isoformat().rsplit(".", 1)[0],
+            "time": "0.0",
+            "tests": "0",
+            "errors": "0",
+            "failures": "0",
+            "skipped": "0",
+        }
+        if results is not None:
+            suite_time = sum([result.get_duration() for result in results.iter_test_results()],
+                             datetime.timedelta()).total_seconds()
+            returned.update({
+                "time": str(suite_time),
+                "tests": str(results.get_num_results()),
+                "errors": str(results.get_num_errors()),
+                "failures": str(results.get_num_failures()),
+                "skipped": str(results.get_num_skipped(include_not_run=False)),
+            })
+        return returned
+
+    def _get_test_case_result_element(self, result):
+        test = E("testcase", {
+            "name": result.test_metadata.address,
+            "time": str(result.get_duration().total_seconds())
+        })
+
+        if result.test_metadata.class_name:
+            test.attrib["classname"] = result.test_metadata.class_name
+
+        self._add_errors(test, result)
+
+        for skip in result.get_skips():
+            self._add_element(test, 'skipped', {'type': skip or ''})
+
+        for detail_name, detail_value in result.details.all().items():
+            if not isinstance(detail_value, list):
+                detail_value = [detail_value]
+
+            for value in detail_value:
+                value = self._detail2xml('detail', detail_name, value)
+                test.append(value)
+        return test
+
     def session_end(self):
 
         if config.root.parallel.worker_id is not None:
+            if self._writer is not None:
+                self._end_streaming(())
             return
 
-        suite_time = sum([result.get_duration() for result in context.session.results.iter_test_results()],
-                         datetime.timedelta()).total_seconds()
-
-        e = E('testsuite', {
-            "name": "slash-suite",
-            "hostname": socket.getfqdn(),
-            "timestamp": self._start_time.isoformat().rsplit(".", 1)[0],
-            "time": str(suite_time),
-            "tests": str(context.session.results.get_num_results()),
-            "errors": str(context.session.results.get_num_errors()),
-            "failures": str(context.session.results.get_num_failures()),
-            "skipped": str(
-                context.session.results.get_num_skipped(include_not_run=False)
-            ),
-        })
-        self._add_errors(e, context.session.results.global_result)
         run_test_results = filter(
             lambda result: result.is_started(),
             context.session.results.iter_test_results()
         )
 
-        for result in run_test_results:
-
-            test = E("testcase", {
-                "name": result.test_metadata.address,
-                "time": str(result.get_duration().total_seconds())
-            })
+        if self._writer is None and self._is_merging_worker_shards():
+            self._writer = _StreamingWriter(slash_config.root.plugin_config.xunit.filename,
+                                            self._get_testsuite_attributes())
 
-            if result.test_metadata.class_name:
-                test.attrib["classname"] = result.test_metadata.class_name
+        if self._writer is not None:
+            self._end_streaming(run_test_results)
+            return
 
-            self._add_errors(test, result)
+        e = E('testsuite', self._get_testsuite_attributes(context.session.results))
+        self._add_errors(e, context.session.results.global_result)
 
-            for skip in result.get_skips():
-                self._add_element(test, 'skipped', {'type': skip or ''})
+        for result in run_test_results:
+            e.append(self._get_test_case_result_element(result))
 
-            for detail_name, detail_value in result.details.all().items():
-                if not isinstance(detail_value, list):
-                    detail_value = [detail_value]
+        with open(slash_config.root.plugin_config.xunit.filename, "wb") as outfile:
+            outfile.write(xml_to_string(e))
 
-                for value in detail_value:
-                    value = self._detail2xml('detail', detail_name, value)
-                    test.append(value)
+    def _end_streaming(self, run_test_results):
+        is_worker = config.root.parallel.worker_id is not None
+        try:
+            self._write_pending_result()
+            if self._is_merging_worker_shards():
+                self._write_worker_shards(run_test_results)
+            elif context.session.has_children():
+                # in parallel mode the parent does not run tests itself, and only gets their results from workers
+                for result in run_test_results:
+                    self._writer.add_test_case(self._get_test_case_result_element(result), result)
+            if not is_worker:
+                global_errors = E('testsuite')
+                self._add_errors(global_errors, context.session.results.global_result)
+                self._writer.add_elements(global_errors)
+        finally:
+            writer, self._writer = self._writer, None
+            self._pending_result = None
+            # worker shards keep the counts of their own test cases, the parent's file gets the totals of the session
+            writer.close({} if is_worker else self._get_testsuite_attributes(context.session.results))
 
-            e.append(test)
+    def _is_merging_worker_shards(self):
+        return slash_config.root.plugin_config.xunit.worker_shards and context.session.has_children()
 
-        with open(slash_config.root.plugin_config.xunit.filename, "wb") as outfile:
-            outfile.write(xml_to_string(e))
+    def _write_worker_shards(self, run_test_results):
+        """Copies the shards written by workers into the parent's file. The test cases of workers whose shard is missing
+        or does not match their results (for instance, workers running on other hosts or crashing mid-test, or results
+        to which the parent added errors) are written from the results received by the parent
+        """
+        worker_results = collections.defaultdict(list)
+        for result in run_test_results:
+            worker_results[self._test_workers.get(result.test_metadata.id)].append(result)
+        try:
+            for worker_session_id, results in worker_results.items():
+                shard = None
+                if worker_session_id is not None:
+                    shard = _get_complete_shard(_get_shard_filename(worker_session_id), results)
+                if shard is not None:
+                    self._writer.add_shard(*shard)
+                    continue
+                for result in results:
+                    self._writer.add_test_case(self._get_test_case_result_element(result), result)
+        finally:
+            for worker_session_id in set(self._test_workers.values()):
+                shard_filename = _get_shard_filename(worker_session_id)
+                if os.path.exists(shard_filename):
+                    os.unlink(shard_filename)
 
     def _add_errors(self, parent, result):
         for error in itertools.chain(result.get_errors(), result.get_failures()):
             self._add_error(parent, 'failure' if error.is_failure() else 'error', error)
+
+
+class _StreamingWriter(object):
+    """Appends test cases to an xUnit file one by one. After each test case the file is a complete document, whose
+    header holds the counts of the test cases written so far, so a report is usable even if the session crashes
+    """
+
+    FOOTER = b'</testsuite>\n'
+
+    def __init__(self, filename, attributes):
+        super(_StreamingWriter, self).__init__()
+        self._quoted_attributes = {}
+        self._set_attributes(attributes)
+        self._time = 0.0
+        self._counts = dict.fromkeys(_COUNT_ATTRIBUTES, 0)
+        self._file = open(filename, 'wb')
+        # the header is padded with whitespace before its closing bracket, leaving room for the counts to grow
+        self._header_size = len(self._get_header()) + _HEADER_SPARE_SIZE
+        self._end_offset = self._header_size + 1
+        self._write_header()
+        self._file.write(self.FOOTER)
+        self._file.flush()
+
+    def _set_attributes(self, attributes):
+        self._quoted_attributes.update((name, quoteattr(value)) for name, value in attributes.items())
+
+    def _get_header(self):
+        return '<testsuite{}'.format(''.join(' {}={}'.format(name, value)
+                                             for name, value in self._quoted_attributes.items())).encode('utf-8')
+
+    def _write_header(self):
+        header = self._get_header()
+        if len(header) > self._header_size:
+            raise ValueError('xUnit header exceeds its reserved size')
+        self._file.seek(0)
+        self._file.write(header.ljust(self._header_size) + b'>')
+
+    def _add_counts(self, counts, time):
+        for name in _COUNT_ATTRIBUTES:
+            self._counts[name] += counts[name]
+        self._time += time
+        # numbers need no escaping
+        self._quoted_attributes.update((name, '"{}"'.format(count)) for name, count in self._counts.items())
+        self._quoted_attributes['time'] = '"{}"'.format(self._time)
+
+    def add_test_case(self, element, result):
+        self._add_counts({'tests': 1, 'errors': int(result.is_error()), 'failures': int(result.is_just_failure()),
+                          'skipped': int(result.is_run_and_skip())},
+                         result.get_duration().total_seconds())
+        self._file.seek(self._end_offset)
+        self._file.write(xml_to_string(element))
+        self._end_append()
+
+    def add_elements(self, elements):
+        data = b''.join(xml_to_string(element) for element in elements)
+        if data:
+            self._file.seek(self._end_offset)
+            self._file.write(data)
+            self._end_append()
+
+    def add_shard(self, filename, attributes, start, end):
+        """Appends the children of the testsuite element of another xUnit file, found between the offsets ``start``
+        and ``end``, adding its counts to the header
+        """
+        self._add_counts({name: int(attributes.get(name, 0)) for name in _COUNT_ATTRIBUTES},
+                         float(attributes.get('time', 0)))
+        self._file.seek(self._end_offset)
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(remaining, _COPY_CHUNK_SIZE))
+                if not data:
+                    break
+                self._file.write(data)
+                remaining -= len(data)
+        self._end_append()
+
+    def _end_append(self):
+        self._end_offset = self._file.tell()
+        self._file.write(self.FOOTER)
+        self._write_header()
+        self._file.flush()
+
+    def close(self, attributes):
+        """Fixes up the header with the final counts of the session, and closes the file
+        """
+        try:
+            self._set_attributes(attributes)
+            self._write_header()
+        finally:
+            self._file.close()
+
+
+def merge_xunit_files(filenames, output_filename):
+    """Merges xUnit files written by the xunit plugin (for instance, shards written by parallel workers) into a single
+    file, whose counts are the sums of their counts
+    """
+    shards = [(filename,) + _get_shard_range(filename) for filename in filenames]
+    attributes = dict(shards[0][1]) if shards else {'name': 'slash-suite'}
+    attributes.update(dict.fromkeys(_COUNT_ATTRIBUTES, '0'), time='0.0')
+    writer = _StreamingWriter(output_filename, attributes)
+    try:
+        for shard in shards:
+            writer.add_shard(*shard)
+    finally:
+        writer.close({})
+
+
+def _get_shard_filename(worker_session_id):
+    root, ext = os.path.splitext(slash_config.root.plugin_config.xunit.filename)
+    return '{}.{}{}'.format(root, worker_session_id, ext or '.xml')
+
+
+def _get_complete_shard(filename, results):
+    """Returns the arguments for :meth:`_StreamingWriter.add_shard` for a shard holding the test cases of ``results``,
+    or None if the shard is missing, or if its test cases differ from the results (in number, or in the errors,
+    failures and skips of each test)
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        attributes, start, end = _get_shard_range(filename)
+        if int(attributes.get('tests', 0)) != len(results):
+            _logger.debug('xUnit shard {} holds {} tests instead of {}', filename, attributes.get('tests'), len(results))
+            return None
+        if _get_shard_outcomes(filename) != collections.Counter(_get_result_outcome(result) for result in results):
+            _logger.debug('xUnit shard {} does not match the results received by the parent', filename)
+            return None
+    except (ValueError, SyntaxError) as e:
+        _logger.warning('Ignoring xUnit shard {}: {}', filename, e)
+        return None
+    return filename, attributes, start, end
+
+
+def _get_result_outcome(result):
+    kinds = collections.Counter('failure' if error.is_failure() else 'error'
+                                for error in itertools.chain(result.get_errors(), result.get_failures()))
+    return result.test_metadata.address, kinds['error'], kinds['failure'], len(result.get_skips())
+
+
+def _get_shard_outcomes(filename):
+    returned = collections.Counter()
+    for _, element in xml_iterparse(filename):
+        if element.tag == 'testcase':
+            kinds = collections.Counter(child.tag for child in element)
+            returned[element.get('name'), kinds['error'], kinds['failure'], kinds['skipped']] += 1
+            element.clear()
+    return returned
+
+
+def _get_shard_range(filename):
+    """Returns the attributes of the testsuite element of an xUnit file, and the offsets between which its children
+    are found
+    """
+    footer = _StreamingWriter.FOOTER.strip()
+    with open(filename, 'rb') as f:
+        head = f.read(_MAX_HEADER_SIZE)
+        header_start = head.find(b'<testsuite')
+        header_end = head.find(b'>', header_start)
+        if header_start == -1 or header_end == -1:
+            raise ValueError('{} is not an xUnit file'.format(filename))
+        header = head[header_start:header_end]
+        if header.endswith(b'/'):
+            return xml_from_string(header + b'>').attrib, header_end + 1, header_end + 1
+        f.seek(0, os.SEEK_END)
+        tail_start = max(f.tell() - len(footer) - _HEADER_SPARE_SIZE, header_end + 1)
+        f.seek(tail_start)
+        tail = f.read().rstrip()
+        if not tail.endswith(footer):
+            raise ValueError('{} is not a complete xUnit file'.format(filename))
+        return xml_from_string(header + b'/>').attrib, header_end + 1, tail_start + len(tail) - len(footer)
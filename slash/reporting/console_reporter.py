@@ -218,11 +218,11 @@ class ConsoleReporter(ReporterInterface):
         return theme('session-summary-failure')
 
     def _iter_reported_results(self, session):
-        for test_index, test_result in enumerate(session.results.iter_test_results()):
+        for test_result in session.results.iter_test_results('error', 'failure', 'skip'):
             infos = self._get_result_info_generators(test_result)
             if not infos:
                 continue
-            yield test_index, test_result, infos
+            yield session.results.index(test_result), test_result, infos
 
     def _report_test_summary_header(self, index, test_result):
         self._terminal.lsep(
@@ -1,12 +1,19 @@
+import collections
+import math
 import os
+import queue
+import threading
+import time
+import gossip
 import logbook
-from sqlalchemy import Column, DateTime, String, Integer
+from sqlalchemy import Column, DateTime, Float, Index, String, Integer, UniqueConstraint, event
 try:
     from sqlalchemy.orm import declarative_base
 except ImportError:
     # Backwards compatibility with SQLAlchemy < 2.0
     from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
 from contextlib import contextmanager, closing
@@ -15,18 +22,22 @@ from slash.plugins import manager
 from ast import literal_eval
 from .utils.path import ensure_directory
 from .conf import config
+from .ctx import context
 from .__version__ import __backslash_version__
 
-_DB_NAME = 'resume_state_v2.db'
+_DB_NAME = 'resume_state_v3.db'
+_CLEANUP_MARK_NAME = 'last_cleanup'
 _logger = logbook.Logger(__name__)
 Base = declarative_base()
 _session = sessionmaker()
-_db_initialized = False
+_engine = None
 
 class ResumeState(Base):
     __tablename__ = 'resume_state'
+    __table_args__ = (UniqueConstraint('session_id', 'test_id'),)
     id = Column(Integer, primary_key=True)
     session_id = Column(String, nullable=False, index=True)
+    test_id = Column(String, nullable=False)
     file_name = Column(String, nullable=False, index=True)
     address_in_file = Column(String, nullable=False, index=True)
     variation = Column(String, index=True)
@@ -40,6 +51,19 @@ class SessionMetadata(Base):
     created_at = Column(DateTime, nullable=False, index=True)
 
 
+class TestHistoryEntry(Base):
+    __tablename__ = 'test_history'
+    __table_args__ = (Index('ix_test_history_test', 'file_name', 'address_in_file'),)
+    id = Column(Integer, primary_key=True)
+    file_name = Column(String, nullable=False)
+    address_in_file = Column(String, nullable=False)
+    session_id = Column(String, nullable=False)
+    worker_session_id = Column(String)
+    status = Column(String, nullable=False)
+    duration = Column(Float)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
 class ResumeTestStatus(object):
     PLANNED = 'planned'
     SUCCESS = 'success'
@@ -63,19 +87,35 @@ class ResumedTestData(object):
                self.variation == other.variation and self.status == other.status
 
 def _init_db():
+    global _engine  # pylint: disable=global-statement
     resume_dir = os.path.expanduser(config.root.run.resume_state_path)
     ensure_directory(resume_dir)
     engine = create_engine('sqlite:///{}/{}'.format(resume_dir, _DB_NAME))
+    event.listen(engine, 'connect', _configure_connection)
     _session.configure(bind=engine)
     Base.metadata.create_all(engine)
+    _engine = engine
+
+
+def _configure_connection(dbapi_connection, _):
+    # WAL lets sessions read the DB while another one writes to it, and makes each commit a single append
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+    finally:
+        cursor.close()
+
+
+def _get_engine():
+    if _engine is None:
+        _init_db()
+    return _engine
 
 
 @contextmanager
 def connecting_to_db():
-    global _db_initialized  # pylint: disable=global-statement
-    if not _db_initialized:
-        _init_db()
-        _db_initialized = True
+    _get_engine()
     with closing(_session()) as new_session:
         yield new_session
         max_retries = 3
@@ -88,49 +128,249 @@ def connecting_to_db():
 
 
 def clean_old_entries():
-    # pylint: disable=no-member
-    with connecting_to_db() as conn:
-        old_sessions_query = conn.query(SessionMetadata).filter \
-            (SessionMetadata.created_at < datetime.now() - timedelta(days=config.root.resume.state_retention_days))
-        old_sessions_ids = [session.session_id for session in old_sessions_query.all()]
-        if old_sessions_ids:
-            conn.query(ResumeState).filter(ResumeState.session_id.in_(old_sessions_ids)).delete(synchronize_session=False)
-        old_sessions_query.delete(synchronize_session=False)
-
-
-def save_resume_state(session_result, collected_tests):
-    session_metadata = SessionMetadata(
-        session_id=session_result.session.id,
-        src_folder=os.path.abspath(os.getcwd()),
-        created_at=datetime.now())
-
-    tests_to_resume = []
-    for result in session_result.iter_test_results():
-        metadata = result.test_metadata
-        test_to_resume = ResumeState(session_id=session_result.session.id, file_name=metadata.file_path, address_in_file=metadata.address_in_file)
-        test_to_resume.variation = str(metadata.variation.id) if metadata.variation else None
-        if result.is_success_finished():
-            test_to_resume.status = ResumeTestStatus.SUCCESS
-        elif not result.is_started():
-            test_to_resume.status = ResumeTestStatus.PLANNED
+    """Deletes sessions older than the retention period from the DB. Cleanups are throttled to once every
+    ``resume.state_cleanup_interval_hours``, since scanning the DB on every session gets expensive as it grows
+    """
+    mark_path = os.path.join(os.path.expanduser(config.root.run.resume_state_path), _CLEANUP_MARK_NAME)
+    try:
+        last_cleanup = os.path.getmtime(mark_path)
+    except OSError:
+        last_cleanup = None
+    if last_cleanup is not None and time.time() - last_cleanup < config.root.resume.state_cleanup_interval_hours * 60 * 60:
+        _logger.trace('Skipping cleanup of old resume state entries (last cleanup at {})', last_cleanup)
+        return
+    min_created_at = datetime.now() - timedelta(days=config.root.resume.state_retention_days)
+    old_session_ids = select(SessionMetadata.session_id).where(SessionMetadata.created_at < min_created_at)
+    with _get_engine().begin() as conn:
+        conn.execute(delete(ResumeState).where(ResumeState.session_id.in_(old_session_ids)))
+        conn.execute(delete(SessionMetadata).where(SessionMetadata.created_at < min_created_at))
+        conn.execute(delete(TestHistoryEntry).where(
+            TestHistoryEntry.created_at < datetime.now() - timedelta(days=config.root.resume.history_retention_days)))
+    with open(mark_path, 'w'):
+        pass
+    _logger.debug('Cleaned old resume state entries')
+
+
+_MAX_QUERY_PARAMETERS = 500
+
+
+TestStatistics = collections.namedtuple('TestStatistics', ['num_runs', 'p50_duration', 'p95_duration',
+                                                           'failure_rate', 'flip_rate', 'last_status', 'last_run_at'])
+
+
+def get_test_statistics(file_names, max_runs=50):
+    """Returns a dictionary mapping (file_name, address_in_file) pairs of previously run tests in the given files to
+    :class:`TestStatistics` computed from their last ``max_runs`` runs: the median and 95th percentile of their
+    durations (in seconds), the fraction of runs in which they failed, and the fraction of consecutive runs in which
+    they switched between passing and failing. Skipped runs are ignored by the failure and flip rates, which are None
+    if the test was never run without being skipped. The status and time of the last run are also returned
+    """
+    runs = collections.defaultdict(list)
+    file_names = sorted(set(file_names))
+    with _get_engine().connect() as conn:
+        for start in range(0, len(file_names), _MAX_QUERY_PARAMETERS):
+            chunk = file_names[start:start + _MAX_QUERY_PARAMETERS]
+            # the runs of each test are numbered from the most recent one, so only the last max_runs are read
+            numbered = select(TestHistoryEntry.file_name, TestHistoryEntry.address_in_file, TestHistoryEntry.status,
+                              TestHistoryEntry.duration, TestHistoryEntry.created_at, TestHistoryEntry.id,
+                              func.row_number().over(
+                                  partition_by=(TestHistoryEntry.file_name, TestHistoryEntry.address_in_file),
+                                  order_by=TestHistoryEntry.id.desc()).label('run_index')) \
+                .where(TestHistoryEntry.file_name.in_(chunk)).subquery()
+            query = select(numbered.c.file_name, numbered.c.address_in_file, numbered.c.status, numbered.c.duration,
+                           numbered.c.created_at) \
+                .where(numbered.c.run_index <= max_runs).order_by(numbered.c.id.desc())
+            for file_name, address_in_file, status, duration, created_at in conn.execute(query):
+                runs[file_name, address_in_file].append((status, duration, created_at))
+    return {key: _get_test_statistics(test_runs) for key, test_runs in runs.items()}
+
+
+def _get_test_statistics(runs):
+    """Summarizes (status, duration, created_at) tuples of the runs of a test, from the most recent one
+    """
+    durations = sorted(duration for _, duration, _ in runs if duration is not None)
+    outcomes = [status == ResumeTestStatus.FAILED for status, _, _ in runs if status != ResumeTestStatus.SKIPPED]
+    num_flips = sum(1 for prev, outcome in zip(outcomes, outcomes[1:]) if prev != outcome)
+    return TestStatistics(
+        num_runs=len(runs),
+        p50_duration=_get_percentile(durations, 50),
+        p95_duration=_get_percentile(durations, 95),
+        failure_rate=sum(outcomes) / len(outcomes) if outcomes else None,
+        flip_rate=num_flips / (len(outcomes) - 1) if len(outcomes) > 1 else None,
+        last_status=runs[0][0],
+        last_run_at=runs[0][2])
+
+
+def _get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, int(math.ceil(percentile / 100 * len(sorted_values))) - 1)]
+
+
+_WRITE_BATCH_SIZE = 1000
+_WRITE_INTERVAL_SECONDS = 1
+
+
+def _get_resume_status(result):
+    if result.is_skip():
+        return ResumeTestStatus.SKIPPED
+    if result.is_success_finished():
+        return ResumeTestStatus.SUCCESS
+    if not result.is_started():
+        return ResumeTestStatus.PLANNED
+    return ResumeTestStatus.FAILED
+
+
+class ResumeStateWriter(object):
+    """Writes the resume state of a session to the DB while it runs, so that even sessions which are killed can be
+    resumed. Tests are recorded as planned when the session starts, and their statuses are updated as they finish,
+    in batches written by a background thread. In parallel sessions, the parent's server records the results of
+    workers through :meth:`add_result` as it receives them
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self._queue = queue.Queue()
+        self._thread = None
+        self._written_statuses = {}
+        self._pending_result = None
+        self._hooks_token = object()
+        self._metadata_written = False
+        self._test_workers = {}
+
+    def start(self, collected_tests):
+        self._write_session_metadata()
+        for test in collected_tests:
+            self._add_row(test.__slash__, ResumeTestStatus.PLANNED)
+        self._thread = threading.Thread(target=self._write_rows, name='ResumeStateWriter')
+        self._thread.daemon = True
+        self._thread.start()
+        # results are only final after test_end, so each one is recorded when the next test starts
+        gossip.register(self._record_pending_result, 'slash.test_start', token=self._hooks_token)
+        gossip.register(self._on_test_end, 'slash.test_end', token=self._hooks_token)
+        gossip.register(self._on_test_distributed, 'slash.test_distributed', token=self._hooks_token)
+
+    def _on_test_distributed(self, test_logical_id, worker_session_id):
+        self._test_workers[test_logical_id] = worker_session_id
+
+    def _on_test_end(self):
+        self._record_pending_result()
+        self._pending_result = context.result
+
+    def _record_pending_result(self):
+        if self._pending_result is not None:
+            self.add_result(self._pending_result)
+            self._pending_result = None
+
+    def add_result(self, result):
+        self._add_row(result.test_metadata, _get_resume_status(result))
+
+    def _add_row(self, test_metadata, status):
+        if self._written_statuses.get(test_metadata.id) == status:
+            return
+        self._written_statuses[test_metadata.id] = status
+        self._queue.put({
+            'session_id': self.session_id,
+            'test_id': test_metadata.id,
+            'file_name': test_metadata.file_path,
+            'address_in_file': test_metadata.address_in_file,
+            'variation': str(test_metadata.variation.id) if test_metadata.variation else None,
+            'status': status,
+        })
+
+    def flush(self):
+        """Waits for the rows recorded so far to be written
+        """
+        self._queue.join()
+
+    def close(self, session_result, collected_tests):
+        """Records the final statuses of all tests in the session, and waits for them to be written
+        """
+        gossip.unregister_token(self._hooks_token)
+        self._pending_result = None
+        if not self._metadata_written:
+            self._write_session_metadata()
+        for result in session_result.iter_test_results():
+            self.add_result(result)
+        for test in collected_tests:
+            if session_result.safe_get_result(test) is None:
+                self._add_row(test.__slash__, ResumeTestStatus.PLANNED)
+        self._queue.put(None)
+        if self._thread is None:
+            self._write_rows()
         else:
-            test_to_resume.status = ResumeTestStatus.FAILED
+            self._thread.join()
+        _logger.debug('Saved resume state to DB')
+        self._write_history(session_result)
 
-        if result.is_skip():
-            test_to_resume.status = ResumeTestStatus.SKIPPED
-        tests_to_resume.append(test_to_resume)
-    tests_with_no_results = {test.__slash__ for test in collected_tests if session_result.safe_get_result(test) is None}
+    def _write_history(self, session_result):
+        now = datetime.now()
+        rows = []
+        for result in session_result.iter_test_results():
+            if not result.is_started() or result.is_interrupted():
+                continue
+            metadata = result.test_metadata
+            duration = result.get_duration()
+            rows.append({
+                'file_name': metadata.file_path,
+                'address_in_file': metadata.address_in_file,
+                'session_id': self.session_id,
+                'worker_session_id': self._test_workers.get(metadata.id),
+                'status': _get_resume_status(result),
+                'duration': duration.total_seconds() if duration is not None else None,
+                'created_at': now,
+            })
+        if rows:
+            with _get_engine().begin() as conn:
+                conn.execute(TestHistoryEntry.__table__.insert(), rows)
+        _logger.debug('Saved history of {} tests to DB', len(rows))
 
-    for test_metadata in tests_with_no_results:
-        test_to_resume = ResumeState(session_id=session_result.session.id, file_name=test_metadata.file_path,\
-                                     address_in_file=test_metadata.address_in_file, status=ResumeTestStatus.PLANNED)
-        test_to_resume.variation = str(test_metadata.variation.id) if test_metadata.variation else None
-        tests_to_resume.append(test_to_resume)
+    def _write_session_metadata(self):
+        with _get_engine().begin() as conn:
+            conn.execute(SessionMetadata.__table__.insert(), [{
+                'session_id': self.session_id,
+                'src_folder': os.path.abspath(os.getcwd()),
+                'created_at': datetime.now()}])
+        self._metadata_written = True
 
-    with connecting_to_db() as conn:
-        conn.add(session_metadata) # pylint: disable=no-member
-        conn.add_all(tests_to_resume) # pylint: disable=no-member
-    _logger.debug('Saved resume state to DB')
+    def _write_rows(self):
+        insert = sqlite.insert(ResumeState.__table__)
+        # updating rows in place keeps them in the order in which the tests were collected
+        insert = insert.on_conflict_do_update(index_elements=['session_id', 'test_id'],
+                                              set_={'status': insert.excluded.status})
+        done = False
+        while not done:
+            rows = []
+            deadline = time.time() + _WRITE_INTERVAL_SECONDS
+            num_items = 0
+            while len(rows) < _WRITE_BATCH_SIZE:
+                try:
+                    row = self._queue.get(timeout=max(0, deadline - time.time()) if rows else None)
+                except queue.Empty:
+                    break
+                num_items += 1
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+            try:
+                if rows:
+                    with _get_engine().begin() as conn:
+                        conn.execute(insert, rows)
+            except Exception:  # pylint: disable=broad-except
+                _logger.error('Failed writing resume state of {} tests', len(rows), exc_info=True)
+            finally:
+                for _ in range(num_items):
+                    self._queue.task_done()
+
+
+def save_resume_state(session_result, collected_tests, writer=None):
+    """Saves the resume state of a session once it ends. ``writer`` is the :class:`ResumeStateWriter` which recorded
+    the session while it ran, if any
+    """
+    if writer is None:
+        writer = ResumeStateWriter(session_result.session.id)
+    writer.close(session_result, collected_tests)
 
 
 def get_last_resumeable_session_id():
@@ -175,7 +415,8 @@ def get_tests_locally(session_id):
     with connecting_to_db() as conn:
         # pylint: disable=no-member
         if conn.query(SessionMetadata).filter(SessionMetadata.session_id == session_id).first():
-            local_tests = conn.query(ResumeState).filter(ResumeState.session_id == session_id).all()
+            local_tests = conn.query(ResumeState).filter(ResumeState.session_id == session_id) \
+                                                .order_by(ResumeState.id).all()
             resumed_tests = [ResumedTestData(test.file_name,
                                              test.address_in_file,
                                              variation=literal_eval(test.variation) if test.variation else None,
@@ -0,0 +1,111 @@
+import collections
+import heapq
+import json
+import os
+
+import logbook
+
+from .conf import config
+from .exceptions import InvalidConfiguraion
+from .resuming import get_test_statistics
+
+_logger = logbook.Logger(__name__)
+
+
+class ShardPlan(object):
+    """Splits tests into shards of similar sizes, for running a suite on several machines.
+    Tests of the same file are kept in the same shard, so that module-scoped fixtures are only set up once.
+    Files are assigned largest-first to the shard with the least load, according to the number of tests in them, or
+    to the expected durations of their tests if ``durations`` (as returned by :func:`load_durations_file`) are given.
+    The plan only depends on the tests and on the given durations, so every machine has to be given the same ones
+    """
+
+    def __init__(self, tests, num_shards, durations=None):
+        super(ShardPlan, self).__init__()
+        self.tests = tests
+        self.num_shards = num_shards
+        file_paths = [test.__slash__.file_path for test in tests]
+        weights = None
+        if durations is not None:
+            durations = [durations.get(_get_duration_key(test)) for test in tests]
+            known = sorted(duration for duration in durations if duration is not None)
+            if known:
+                # tests without history are assumed to take as long as a typical test
+                default_duration = known[len(known) // 2]
+                weights = [default_duration if duration is None else duration for duration in durations]
+        self.by_durations = weights is not None
+        if weights is None:
+            weights = [1] * len(tests)
+
+        groups = collections.OrderedDict()
+        for index, file_path in enumerate(file_paths):
+            groups.setdefault(file_path, []).append(index)
+        group_weights = {file_path: sum(weights[index] for index in indices) for file_path, indices in groups.items()}
+
+        self.shard_indices = [None] * len(tests)
+        self.loads = [0] * num_shards
+        self.num_files = [0] * num_shards
+        shards = [(0, shard_index) for shard_index in range(num_shards)]
+        for file_path in sorted(groups, key=lambda file_path: (-group_weights[file_path], file_path)):
+            load, shard_index = heapq.heappop(shards)
+            for index in groups[file_path]:
+                self.shard_indices[index] = shard_index
+            self.num_files[shard_index] += 1
+            self.loads[shard_index] = load + group_weights[file_path]
+            heapq.heappush(shards, (self.loads[shard_index], shard_index))
+
+    def get_shard(self, shard_index):
+        """Returns the tests assigned to the given shard, in their original order
+        """
+        return [test for test, test_shard_index in zip(self.tests, self.shard_indices) if test_shard_index == shard_index]
+
+
+def _get_duration_key(test):
+    # durations files are shared between machines, so tests are identified by paths relative to the working directory
+    return (os.path.relpath(test.__slash__.file_path), test.__slash__.address_in_file)
+
+
+def save_durations_file(path, tests):
+    """Writes the median durations of the given tests in previous sessions, according to the resume state database,
+    to a JSON file which can be passed to every machine running shards of the suite (``--shard-durations-file``)
+    """
+    statistics = get_test_statistics({test.__slash__.file_path for test in tests})
+    durations = {}
+    for test in tests:
+        test_statistics = statistics.get((test.__slash__.file_path, test.__slash__.address_in_file))
+        if test_statistics is not None and test_statistics.p50_duration is not None:
+            file_path, address_in_file = _get_duration_key(test)
+            durations.setdefault(file_path, {})[address_in_file] = test_statistics.p50_duration
+    with open(path, 'w') as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+    _logger.debug('Saved durations of {} tests to {}', sum(len(file_durations) for file_durations in durations.values()),
+                  path)
+
+
+def load_durations_file(path):
+    """Returns a dictionary mapping (file_path, address_in_file) pairs to expected durations, read from a file written
+    by :func:`save_durations_file`
+    """
+    try:
+        with open(path) as f:
+            durations = json.load(f)
+        return {(file_path, address_in_file): duration
+                for file_path, file_durations in durations.items()
+                for address_in_file, duration in file_durations.items()}
+    except (IOError, ValueError, AttributeError) as e:
+        raise InvalidConfiguraion('Cannot read shard durations file {} ({})'.format(path, e))
+
+
+def get_configured_shard(tests):
+    """Returns the tests of the shard selected by ``run.sharding.index``, out of ``run.sharding.count`` shards
+    """
+    num_shards, shard_index = config.root.run.sharding.count, config.root.run.sharding.index
+    if not 0 <= shard_index < num_shards:
+        raise InvalidConfiguraion('Invalid shard index {} (shard count is {})'.format(shard_index, num_shards))
+    durations_file = config.root.run.sharding.durations_file
+    plan = ShardPlan(tests, num_shards, durations=load_durations_file(durations_file) if durations_file else None)
+    returned = plan.get_shard(shard_index)
+    _logger.debug('Running shard {}/{}: {} out of {} tests in {} files (balanced by {})', shard_index, num_shards,
+                  len(returned), len(tests), plan.num_files[shard_index],
+                  'durations' if plan.by_durations else 'test counts')
+    return returned
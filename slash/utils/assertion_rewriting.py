@@ -0,0 +1,97 @@
+import ast
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+import tempfile
+import types
+from contextlib import contextmanager
+
+import dessert
+import logbook
+from dessert.__version__ import __version__ as dessert_version
+from dessert.rewrite import AssertionRewritingHook, rewrite_asserts
+
+from ..conf import config
+from .path import ensure_directory
+
+_logger = logbook.Logger(__name__)
+
+
+@contextmanager
+def rewrite_assertions_context():
+    """Like ``dessert.rewrite_assertions_context``, only storing rewritten bytecode in the assertion rewrite cache
+    when :ref:`conf.run.assertion_rewrite_cache.enabled` is set
+    """
+    if not config.root.run.assertion_rewrite_cache.enabled:
+        with dessert.rewrite_assertions_context():
+            yield
+        return
+    hook = CachingAssertionRewritingHook(os.path.expanduser(config.root.run.assertion_rewrite_cache.path))
+    sys.meta_path.insert(0, hook)
+    try:
+        yield
+    finally:
+        sys.meta_path.remove(hook)
+
+
+class CachingAssertionRewritingHook(AssertionRewritingHook):
+    """Assertion rewriting import hook keeping rewritten code objects in a central directory, keyed by the
+    source content, the module path, the interpreter version and the assertion introspection setting.
+    Unlike the default ``__pycache__`` behavior, this works for read-only trees and is not fooled by mtime changes
+    """
+
+    def __init__(self, cache_dir):
+        super(CachingAssertionRewritingHook, self).__init__()
+        self._cache_dir = cache_dir
+
+    def exec_module(self, module):
+        filename = module.__spec__.origin
+        self._rewritten_names.add(module.__name__)
+        with open(filename, 'rb') as f:
+            source = f.read()
+        cache_path = os.path.join(self._cache_dir, _get_cache_key(filename, source) + '.pyc')
+        code = _read_cached_code(cache_path)
+        if code is None:
+            _logger.trace('Rewriting assertions in {}', filename)
+            tree = ast.parse(source, filename=filename)
+            rewrite_asserts(tree, source, filename, self.config)
+            code = compile(tree, filename, 'exec', dont_inherit=True)
+            _write_cached_code(cache_path, code)
+        exec(code, module.__dict__)  # pylint: disable=exec-used
+
+
+def _get_cache_key(filename, source):
+    returned = hashlib.sha1(source)
+    for part in (filename, sys.version, dessert_version, str(bool(config.root.run.message_assertion_introspection))):
+        returned.update(b'\0')
+        returned.update(part.encode('utf-8'))
+    return returned.hexdigest()
+
+
+def _read_cached_code(path):
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(importlib.util.MAGIC_NUMBER)) != importlib.util.MAGIC_NUMBER:
+                return None
+            returned = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(returned, types.CodeType):
+        return None
+    return returned
+
+
+def _write_cached_code(path, code):
+    cache_dir = os.path.dirname(path)
+    try:
+        ensure_directory(cache_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.rewrite')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(importlib.util.MAGIC_NUMBER)
+            marshal.dump(code, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # failing to write the cache only means the next import will rewrite again
+        _logger.debug('Could not write rewritten bytecode to {}: {}', path, e)
@@ -47,7 +47,8 @@ def wraps(func, preserve=()):
 def unpickle(thing):
     if not thing:
         return thing
-    return pickle.loads(thing.data)
+    # XML-RPC wraps binary data in Binary objects, while other transports pass bytes as they are
+    return pickle.loads(getattr(thing, 'data', thing))
 
 def get_underlying_func(func):
     while True:
@@ -174,6 +174,20 @@ class DistilledFrame(object):
     def is_in_test_code(self):
         return self._is_in_test_code
 
+    @classmethod
+    def from_dict(cls, serialized):
+        """Creates a frame from a dictionary returned by :meth:`to_dict`, without the underlying Python frame
+        """
+        returned = cls.__new__(cls)
+        returned.python_frame = None
+        for attr in ['filename', 'lineno', 'func_name', 'code_line', 'code_string']:
+            setattr(returned, attr, serialized[attr])
+        returned._globals = serialized['globals']  # pylint: disable=protected-access
+        returned._locals = serialized['locals']  # pylint: disable=protected-access
+        returned._is_in_test_code = serialized['is_in_test_code']  # pylint: disable=protected-access
+        returned._repr_blacklisted_types = ()  # pylint: disable=protected-access
+        return returned
+
     def to_dict(self):
         serialized = {}
         for attr in ['filename', 'lineno', 'func_name', 'code_line', 'code_string']:
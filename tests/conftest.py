@@ -10,7 +10,10 @@ from forge import Forge
 import gossip
 import pytest
 import slash
+import slash.ordering
 import slash.plugins
+import slash.resuming
+import slash.sharding
 import logbook
 from slash.loader import Loader
 from slash.core.result import GlobalResult, Result
@@ -212,6 +215,24 @@ def active_slash_session(request):
     return returned
 
 
+
+@pytest.fixture
+def history(monkeypatch):
+    """Maps (file_path, address_in_file) pairs to dictionaries of :class:`slash.resuming.TestStatistics` fields, which are
+    returned by ``get_test_statistics`` instead of the statistics recorded in the resume database
+    """
+    returned = {}
+    defaults = dict(num_runs=1, p50_duration=1, p95_duration=1, failure_rate=0, flip_rate=None,
+                    last_status=slash.resuming.ResumeTestStatus.SUCCESS, last_run_at=None)
+
+    def get_test_statistics(file_names, max_runs=50):  # pylint: disable=unused-argument
+        return {key: slash.resuming.TestStatistics(**dict(defaults, **fields))
+                for key, fields in returned.items() if key[0] in file_names}
+
+    for module in (slash.ordering, slash.sharding):
+        monkeypatch.setattr(module, 'get_test_statistics', get_test_statistics)
+    return returned
+
 @pytest.fixture(params=["slashconf", "module"])
 def defined_fixture(request, suite, suite_test):
     if request.param == 'slashconf':
@@ -0,0 +1,122 @@
+# pylint: disable=redefined-outer-name
+import os
+import socket
+import subprocess
+import sys
+
+import munch
+import pytest
+
+from slash.parallel.agent import Agent, AgentsRegistry, LOG_FILE
+
+if sys.platform.startswith("win"):
+    pytest.skip("does not run on windows", allow_module_level=True)
+
+
+@pytest.fixture
+def project_dir(tmpdir):
+    returned = tmpdir.join('project')
+    returned.join('helper.py').write('VALUE = 1\n', ensure=True)
+    returned.join('tests', 'test_remote.py').write("""
+import os
+import helper
+
+def test_runs_in_copy():
+    assert os.getcwd() != {!r}
+
+def test_imports_project_modules():
+    assert helper.VALUE == 1
+
+def test_another():
+    pass
+""".format(str(returned)), ensure=True)
+    return returned
+
+
+@pytest.fixture
+def server_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _start_agent(workdir, server_port, num_workers=1):
+    return subprocess.Popen([sys.executable, '-m', 'slash.frontend.main', 'agent', '--server',
+                             'localhost:{}'.format(server_port), '--workers', str(num_workers),
+                             '--workdir', str(workdir)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _run_parent(project_dir, server_port, num_workers, num_agent_workers):
+    return subprocess.run([sys.executable, '-m', 'slash.frontend.main', 'run', 'tests',
+                           '--parallel', str(num_workers), '--parallel-agent-workers', str(num_agent_workers),
+                           '--parallel-port', str(server_port), '-l', 'logs'],
+                          cwd=str(project_dir), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120,
+                          check=False)
+
+
+def test_agents_run_all_workers(tmpdir, project_dir, server_port):
+    agents = [_start_agent(tmpdir.join('agent{}'.format(index)), server_port) for index in range(2)]
+    try:
+        completed = _run_parent(project_dir, server_port, num_workers=2, num_agent_workers=2)
+    finally:
+        for agent in agents:
+            agent.wait(timeout=60)
+    assert completed.returncode == 0, completed.stdout.decode()
+    assert b'3 successful' in completed.stdout
+    assert [agent.returncode for agent in agents] == [0, 0]
+    for index in range(2):
+        assert tmpdir.join('agent{}'.format(index), 'tests', 'test_remote.py').check()
+    worker_logs = [path for path in project_dir.join('logs').visit('session.log')
+                   if not os.path.islink(str(path.dirpath()))]
+    # the parent's session log, and those of the two workers uploaded by the agents
+    assert len(worker_logs) == 3
+
+
+def test_agent_and_local_workers(tmpdir, project_dir, server_port):
+    project_dir.join('tests', 'test_remote.py').write(''.join('def test_{}():\n    pass\n'.format(index)
+                                                              for index in range(3)))
+    agent = _start_agent(tmpdir.join('agent'), server_port, num_workers=2)
+    try:
+        completed = _run_parent(project_dir, server_port, num_workers=2, num_agent_workers=1)
+    finally:
+        agent.wait(timeout=60)
+    assert completed.returncode == 0, completed.stdout.decode()
+    assert b'3 successful' in completed.stdout
+    assert agent.returncode == 0
+
+
+def test_agent_only_deletes_files_it_fetched(tmpdir):
+    workdir = tmpdir.join('workdir')
+    workdir.join('user_module.py').write('VALUE = 2\n', ensure=True)
+    agent = Agent('localhost', 0, working_directory=str(workdir))
+    proxy = munch.Munch(get_project_file=lambda relative_path: b'VALUE = 1\n')
+    agent._sync_project_tree(proxy, {'helper.py': 'digest', os.path.join('tests', 'test_a.py'): 'digest'})  # pylint: disable=protected-access
+    assert workdir.join('helper.py').read() == 'VALUE = 1\n'
+    assert workdir.join('tests', 'test_a.py').check()
+    # a new agent, e.g. started in the same --workdir for a later session
+    agent = Agent('localhost', 0, working_directory=str(workdir))
+    agent._sync_project_tree(proxy, {'helper.py': 'digest'})  # pylint: disable=protected-access
+    assert workdir.join('helper.py').check()
+    assert not workdir.join('tests', 'test_a.py').check()
+    assert workdir.join('user_module.py').read() == 'VALUE = 2\n'
+
+
+@pytest.mark.parametrize('get_session_id', [
+    lambda tmpdir, session_id: str(tmpdir.join('elsewhere')),
+    lambda tmpdir, session_id: os.path.join('..', 'elsewhere'),
+    lambda tmpdir, session_id: os.path.join(session_id, '..', '..', 'elsewhere'),
+])
+def test_agents_registry_rejects_foreign_session_ids(tmpdir, active_slash_session, config_override, get_session_id):
+    logs_dir = tmpdir.join('logs')
+    config_override('log.root', str(logs_dir))
+    with tmpdir.join('project').ensure(dir=True).as_cwd():
+        registry = AgentsRegistry(['1'], ['slash', 'run'], str(tmpdir.join('errors')))
+    registry.set_keepalive_address(0)
+    registry.register('host', 1)
+    worker_session_id = '{}_1'.format(active_slash_session.id.split('_')[0])
+    with pytest.raises(ValueError):
+        registry.write_worker_file(get_session_id(tmpdir, worker_session_id), LOG_FILE, 'owned.txt', 0, b'data')
+    assert not tmpdir.join('elsewhere').check()
+    registry.write_worker_file(worker_session_id, LOG_FILE, 'session.log', 0, b'data')
+    assert logs_dir.join(worker_session_id, 'session.log').read() == 'data'
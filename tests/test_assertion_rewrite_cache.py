@@ -0,0 +1,80 @@
+import sys
+
+import emport
+import pytest
+
+import slash.utils.assertion_rewriting
+from slash.core.error import Error
+from slash.utils.assertion_rewriting import rewrite_assertions_context
+
+
+@pytest.fixture(name='cache_dir')
+def cache_dir_fixture(config_override, tmpdir):
+    returned = tmpdir.join('assertion_rewrite_cache')
+    config_override('run.assertion_rewrite_cache.enabled', True)
+    config_override('run.assertion_rewrite_cache.path', str(returned))
+    return returned
+
+
+@pytest.fixture(name='module_path')
+def module_path_fixture(tmpdir):
+    returned = tmpdir.join('module_with_assertion.py')
+    returned.write("""
+def f(x):
+    return x
+
+def func():
+    assert f(1) == f(2)
+""")
+    return str(returned)
+
+
+def _import_and_fail(path):
+    with rewrite_assertions_context():
+        module = emport.import_file(path)
+    sys.modules.pop(module.__name__)
+    try:
+        module.func()
+    except AssertionError:
+        return Error.capture_exception()
+    assert False, 'Did not fail'
+
+
+def test_rewritten_code_is_cached(cache_dir, module_path):
+    error = _import_and_fail(module_path)
+    assert '1 == 2' in error.message
+    assert len(cache_dir.listdir()) == 1
+
+
+def test_cached_code_is_reused(cache_dir, module_path, monkeypatch):
+    _import_and_fail(module_path)
+
+    def rewrite_asserts(*_, **__):
+        raise AssertionError('Should not rewrite again')
+
+    monkeypatch.setattr(slash.utils.assertion_rewriting, 'rewrite_asserts', rewrite_asserts)
+    error = _import_and_fail(module_path)
+    assert '1 == 2' in error.message
+    assert len(cache_dir.listdir()) == 1
+
+
+def test_changed_source_is_rewritten(cache_dir, module_path):
+    _import_and_fail(module_path)
+    with open(module_path, 'a') as f:
+        f.write('\n# changed\n')
+    _import_and_fail(module_path)
+    assert len(cache_dir.listdir()) == 2
+
+
+def test_introspection_setting_is_part_of_cache_key(cache_dir, module_path, config_override):
+    _import_and_fail(module_path)
+    config_override('run.message_assertion_introspection', False)
+    _import_and_fail(module_path)
+    assert len(cache_dir.listdir()) == 2
+
+
+def test_cache_disabled(cache_dir, module_path, config_override):
+    config_override('run.assertion_rewrite_cache.enabled', False)
+    error = _import_and_fail(module_path)
+    assert '1 == 2' in error.message
+    assert not cache_dir.check()
@@ -0,0 +1,185 @@
+import json
+import os
+
+import munch
+import pytest
+
+import slash
+import slash.loader
+from slash import Session
+from slash.frontend.slash_list import slash_list
+from slash.loader import Loader
+from io import StringIO
+
+
+@pytest.fixture
+def cache_enabled(config_override, tmpdir):
+    config_override('run.collection_cache.enabled', True)
+    config_override('run.collection_cache.path', str(tmpdir.join('collection_cache')))
+
+
+@pytest.fixture(name='tests_dir')
+def tests_dir_fixture(tmpdir, monkeypatch):
+    returned = tmpdir.join('tests')
+    for name in ('test_a', 'test_b'):
+        with returned.join('{}.py'.format(name)).open('w', ensure=True) as f:
+            f.write('import slash\n')
+            f.write('@slash.tag("tag_{}")\n'.format(name))
+            f.write('@slash.parametrize("param", [1, 2])\n')
+            f.write('def {}_something(param):\n'.format(name))
+            f.write('    pass\n')
+    returned.imported = []
+    orig_import_file = slash.loader.import_file
+
+    def import_file(path):
+        returned.imported.append(os.path.basename(path)[:-3])
+        return orig_import_file(path)
+
+    monkeypatch.setattr(slash.loader, 'import_file', import_file)
+    return returned
+
+
+def _get_imported(tests_dir):
+    return tests_dir.imported
+
+
+def _load(path):
+    with Session():
+        return [test.__slash__.address for test in Loader().get_runnables(str(path))]
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_filtered_out_files_are_not_imported(tests_dir, config_override):
+    all_addresses = _load(tests_dir)
+    assert len(all_addresses) == 4
+    assert _get_imported(tests_dir) == ['test_a', 'test_b']
+
+    config_override('run.filter_strings', ['tag:tag_test_b'])
+    addresses = _load(tests_dir)
+    assert addresses == [address for address in all_addresses if 'test_b' in address]
+    assert _get_imported(tests_dir) == ['test_a', 'test_b', 'test_b']
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_changed_files_are_reimported(tests_dir, config_override):
+    _load(tests_dir)
+    with tests_dir.join('test_a.py').open('a') as f:
+        f.write('@slash.tag("tag_test_b")\n')
+        f.write('def test_new():\n')
+        f.write('    pass\n')
+    config_override('run.filter_strings', ['tag:tag_test_b'])
+    _load(tests_dir)
+    assert _get_imported(tests_dir) == ['test_a', 'test_b', 'test_a', 'test_b']
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_slashconf_changes_invalidate_cache(tests_dir, config_override):
+    _load(tests_dir)
+    tests_dir.join('slashconf.py').write('import slash\n')
+    config_override('run.filter_strings', ['tag:tag_test_b'])
+    _load(tests_dir)
+    assert _get_imported(tests_dir) == ['test_a', 'test_b', 'slashconf', 'test_a', 'test_b']
+
+
+def test_filtering_without_cache_imports_all_files(tests_dir, config_override):
+    config_override('run.filter_strings', ['tag:tag_test_b'])
+    _load(tests_dir)
+    _load(tests_dir)
+    assert _get_imported(tests_dir) == ['test_a', 'test_b', 'test_a', 'test_b']
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_unchanged_cache_is_not_rewritten(tmpdir, tests_dir, config_override):
+    cache_path = tmpdir.join('collection_cache', 'collection_cache_v1.json')
+    relative_tests_dir = tests_dir.relto(tmpdir)
+    with tmpdir.as_cwd():
+        _load(relative_tests_dir)
+        # reformatting the cache file tells whether it gets rewritten
+        cache_path.write(json.dumps(json.loads(cache_path.read()), indent=2))
+        cached = cache_path.read()
+        _load(relative_tests_dir)
+        config_override('run.filter_strings', ['tag:tag_test_b'])
+        _load(relative_tests_dir)
+    assert cache_path.read() == cached
+    assert _get_imported(tests_dir) == ['test_a', 'test_b', 'test_a', 'test_b', 'test_b']
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_slash_list_from_cache(tests_dir):
+    outputs = []
+    for _ in range(2):
+        report_stream = StringIO()
+        assert slash_list(munch.Munch(argv=[str(tests_dir), '--only-tests', '--show-tags']), report_stream) == 0
+        outputs.append(report_stream.getvalue())
+    assert outputs[0] == outputs[1]
+    assert 'tag_test_a' in outputs[0]
+    assert _get_imported(tests_dir) == ['test_a', 'test_b']
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_iter_test_infos_with_address(tests_dir):
+    address = '{}:test_a_something'.format(tests_dir.join('test_a.py'))
+    with Session():
+        infos = list(Loader().iter_test_infos([address]))
+    assert [info.address_in_file for info in infos] == ['test_a_something', 'test_a_something']
+    assert [info.variation_id for info in infos] == [{'param': 0}, {'param': 1}]
+    assert all(info.tags.has_tag('tag_test_a') for info in infos)
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_iter_test_infos_nonexistent_address(tests_dir):
+    address = '{}:test_nonexistent'.format(tests_dir.join('test_a.py'))
+    with Session():
+        with slash.assert_raises(slash.exceptions.CannotLoadTests):
+            list(Loader().iter_test_infos([address]))
+
+
+def _get_test_info_dicts(tests_dir):
+    with Session():
+        return [info.to_dict() for info in Loader().iter_test_infos([str(tests_dir)])]
+
+
+def test_prefetch_workers_metadata(tests_dir, config_override):
+    expected = _get_test_info_dicts(tests_dir)
+    config_override('run.prefetch_workers', 2)
+    assert _get_test_info_dicts(tests_dir) == expected
+
+
+def test_prefetch_workers_skip_filtered_out_files(tests_dir, config_override):
+    config_override('run.prefetch_workers', 2)
+    config_override('run.filter_strings', ['tag:tag_test_b'])
+    addresses = _load(tests_dir)
+    assert len(addresses) == 2
+    assert all('test_b' in address for address in addresses)
+    # test_a was only imported by the worker processes
+    assert _get_imported(tests_dir) == ['test_b']
+
+
+@pytest.mark.usefixtures('cache_enabled')
+def test_prefetch_workers_populate_cache(tests_dir, config_override):
+    config_override('run.prefetch_workers', 2)
+    _get_test_info_dicts(tests_dir)
+    config_override('run.prefetch_workers', 1)
+    _get_test_info_dicts(tests_dir)
+    assert _get_imported(tests_dir) == []
+
+
+def test_prefetch_workers_import_error(tests_dir, config_override):
+    tests_dir.join('test_c.py').write('import nonexistent_module\n')
+    config_override('run.prefetch_workers', 2)
+    with slash.assert_raises(slash.exceptions.CannotLoadTests):
+        _get_test_info_dicts(tests_dir)
+
+
+def test_prefetch_workers_stop_prefetching_when_most_files_match(tests_dir, config_override):
+    for index in range(10):
+        tests_dir.join('test_slow_{}.py'.format(index)).write(
+            'import time\nimport slash\ntime.sleep(0.1)\ndef test_slow_something():\n    pass\n')
+    config_override('run.prefetch_workers', 2)
+    config_override('run.filter_strings', ['something'])
+    with Session():
+        loader = Loader()
+        addresses = [test.__slash__.address for test in loader.get_runnables([str(tests_dir)])]
+    assert len(addresses) == 14
+    # every file contains matching tests, so only the first files were collected by the worker processes
+    assert len(loader._prefetched_test_infos) < 12  # pylint: disable=protected-access
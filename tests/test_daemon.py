@@ -0,0 +1,91 @@
+# pylint: disable=redefined-outer-name
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+if sys.platform.startswith("win"):
+    pytest.skip("does not run on windows", allow_module_level=True)
+
+
+@pytest.fixture
+def project_dir(tmpdir):
+    tmpdir.join('helper.py').write('VALUE = 1\n')
+    tmpdir.join('test_helper.py').write("""
+import helper
+
+def test_value():
+    assert helper.VALUE == 1
+""")
+    return tmpdir
+
+
+@pytest.fixture
+def daemon_argv(project_dir):
+    return ['--learn-imports-from', str(project_dir)]
+
+
+@pytest.fixture
+def socket_path(project_dir, daemon_argv, request):
+    returned = str(project_dir.join('daemon.sock'))
+    daemon = subprocess.Popen([sys.executable, '-m', 'slash.frontend.main', 'daemon', '--socket-path', returned] +
+                              daemon_argv,
+                              cwd=str(project_dir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    request.addfinalizer(daemon.kill)
+    for _ in range(300):
+        if os.path.exists(returned):
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail('Daemon did not start listening')
+    return returned
+
+
+def _run_in_daemon(project_dir, socket_path):
+    return subprocess.run([sys.executable, '-m', 'slash.frontend.main', '--daemon', '--daemon-socket', socket_path,
+                           'run', 'test_helper.py'],
+                          cwd=str(project_dir), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+
+
+def test_daemon_runs_sessions(project_dir, socket_path):
+    for _ in range(2):
+        completed = _run_in_daemon(project_dir, socket_path)
+        assert completed.returncode == 0
+        assert b'1 successful' in completed.stdout
+
+
+def _write_import_check(project_dir):
+    project_dir.join('test_helper.py').write("""
+import sys
+WAS_IMPORTED = 'helper' in sys.modules
+import helper
+
+def test_was_imported():
+    assert WAS_IMPORTED
+""")
+
+
+def test_daemon_keeps_imported_modules(project_dir, socket_path):
+    _write_import_check(project_dir)
+    assert _run_in_daemon(project_dir, socket_path).returncode != 0
+    assert _run_in_daemon(project_dir, socket_path).returncode == 0
+
+
+@pytest.mark.parametrize('daemon_argv', [[]])
+def test_daemon_does_not_learn_project_modules_by_default(project_dir, socket_path):
+    _write_import_check(project_dir)
+    for _ in range(2):
+        assert _run_in_daemon(project_dir, socket_path).returncode != 0
+
+
+def test_daemon_imports_changed_modules_again(project_dir, socket_path):
+    assert _run_in_daemon(project_dir, socket_path).returncode == 0
+    helper_path = project_dir.join('helper.py')
+    helper_path.write('VALUE = 2\n')
+    mtime = time.time() + 10
+    os.utime(str(helper_path), (mtime, mtime))
+    completed = _run_in_daemon(project_dir, socket_path)
+    assert completed.returncode != 0
+    assert b'1 failed' in completed.stdout
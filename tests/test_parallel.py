@@ -6,10 +6,11 @@ import sys
 
 from vintage import get_no_deprecations_context
 from .utils.suite_writer import Suite
-from slash.resuming import get_tests_from_previous_session
-from slash.exceptions import InteractiveParallelNotAllowed, ParallelTimeout
-from slash.parallel.server import ServerStates
-from slash.parallel.parallel_manager import ParallelManager
+from slash.resuming import ResumeStateWriter, ResumeTestStatus, get_tests_from_previous_session, get_tests_locally
+from slash.exceptions import InteractiveParallelNotAllowed, InvalidConfiguraion, ParallelTimeout
+from slash.core.result import Result
+from slash.parallel.server import NO_MORE_TESTS, PROTOCOL_ERROR, ServerStates
+from slash.parallel.parallel_manager import ParallelManager, get_proxy
 from slash import Session
 from slash.loader import Loader
 import time
@@ -65,8 +66,22 @@ def test_test_causes_worker_exit(parallel_suite, config_override):
         [result] = test_results
         assert result.is_interrupted()
 
-def test_keepalive_works(parallel_suite, config_override):
+def test_worker_exit_detected_without_timeouts(parallel_suite, config_override):
+    config_override("parallel.no_request_timeout", 30)
+    parallel_suite[0].append_line("import os")
+    parallel_suite[0].append_line("os._exit(0)")
+    parallel_suite[0].expect_interruption()
+    start_time = time.time()
+    summary = parallel_suite.run(num_workers=1, verify=False)
+    assert summary.session.results.is_interrupted()
+    assert not summary.session.parallel_manager.heartbeats_enabled
+    # communication and no-request timeouts are much longer
+    assert time.time() - start_time < 15
+
+@pytest.mark.parametrize('watch_worker_exits', [True, False])
+def test_keepalive_works(parallel_suite, config_override, watch_worker_exits):
     config_override("parallel.communication_timeout_secs", 2)
+    config_override("parallel.watch_worker_exits", watch_worker_exits)
     parallel_suite[0].append_line("import time")
     parallel_suite[0].append_line("time.sleep(6)")
     workers_num = 1
@@ -160,6 +175,7 @@ def test_test_interruption_causes_communication_timeout(parallel_suite, config_o
 
 def test_test_interruption_causes_no_requests(parallel_suite, config_override):
     config_override("parallel.no_request_timeout", 2)
+    config_override("parallel.watch_worker_exits", False)
     parallel_suite[0].when_run.interrupt()
     summary = parallel_suite.run(num_workers=1, verify=False)
     assert summary.get_all_results_for_test(parallel_suite[0]) == []
@@ -294,6 +310,99 @@ def test_is_test_code(parallel_suite):
     error_json = err.traceback.to_list()
     assert error_json[-1]['is_in_test_code']
 
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_lazy_worker_collection(parallel_suite, num_workers):
+    parallel_suite[0].add_parameter(num_values=2)
+    parallel_suite[1].when_run.fail()
+    summary = parallel_suite.run(num_workers=num_workers, additional_args=['--parallel-lazy-collection'])
+    assert summary.session.results.get_num_failures() == 1
+    assert summary.session.results.get_num_successful() == len(parallel_suite) + 1 - 1
+
+def test_lazy_worker_collection_repeat_each(parallel_suite):
+    summary = parallel_suite.run(additional_args=['--parallel-lazy-collection', '--repeat-each', '2'], verify=False)
+    assert summary.session.results.get_num_successful() == 2 * len(parallel_suite)
+    assert summary.session.results.is_success()
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_unix_transport(parallel_suite, num_workers):
+    parallel_suite[0].when_run.fail()
+    parallel_suite[1].when_run.error()
+    summary = parallel_suite.run(num_workers=num_workers, additional_args=['--parallel-transport', 'unix'])
+    assert summary.session.results.get_num_failures() == 1
+    assert summary.session.results.get_num_errors() == 1
+    assert summary.session.results.get_num_successful() == len(parallel_suite) - 2
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_batches(num_workers):
+    suite = Suite(debug_info=False, is_parallel=True)
+    suite.populate(num_tests=40)
+    suite[5].when_run.fail()
+    summary = suite.run(num_workers=num_workers, additional_args=['--parallel-batch-size', '10'])
+    assert summary.session.results.get_num_failures() == 1
+    assert summary.session.results.get_num_successful() == 39
+
+def test_batches_stop_on_error():
+    suite = Suite(debug_info=False, is_parallel=True)
+    suite.populate(num_tests=40)
+    suite[15].when_run.fail()
+    summary = suite.run(additional_args=['-x', '--parallel-batch-size', '10'], verify=False)
+    results = list(summary.session.results.iter_test_results())
+    assert len(results) == 40
+    assert summary.session.results.get_num_failures() == 1
+    # the failing test is in the middle of a batch, and no test runs after it
+    assert summary.session.results.get_num_successful() == 15
+    assert all(result.is_not_run() for result in results[16:])
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_fork_server(parallel_suite, num_workers):
+    summary = parallel_suite.run(num_workers=num_workers, additional_args=['--parallel-fork-server'])
+    assert len(summary.session.parallel_manager.server.worker_session_ids) == num_workers
+    assert summary.session.results.is_success()
+
+def test_elastic_workers(config_override):
+    config_override('parallel.elastic.max_workers', 2)
+    config_override('parallel.elastic.min_unstarted_tests_per_worker', 1)
+    config_override('parallel.elastic.max_load_per_cpu', 1000)
+    config_override('parallel.elastic.retire_load_per_cpu', 1000)
+    config_override('parallel.elastic.scaling_interval', 0)
+    suite = Suite(debug_info=False, is_parallel=True)
+    suite.populate(num_tests=10)
+    for test in suite:
+        test.append_line("import time")
+        test.append_line("time.sleep(1)")
+    summary = suite.run(num_workers=1, additional_args=['--parallel-elastic'])
+    assert len(summary.session.parallel_manager.server.worker_session_ids) == 2
+    assert summary.session.results.get_num_successful() == 10
+
+@pytest.mark.parametrize('load_per_cpu, expected_action', [(0.5, 'start'), (1, None), (2, 'retire')])
+def test_elastic_scaling_hysteresis(config_override, monkeypatch, load_per_cpu, expected_action):
+    config_override('parallel.elastic.enabled', True)
+    config_override('parallel.elastic.max_load_per_cpu', 0.8)
+    config_override('parallel.elastic.retire_load_per_cpu', 1.5)
+    config_override('parallel.elastic.scaling_interval', 0)
+    config_override('parallel.elastic.max_workers', 10)
+    monkeypatch.setattr(slash.parallel.parallel_manager, '_get_load_per_cpu', lambda: load_per_cpu)
+    parallel_manager = ParallelManager(munch.Munch(argv=[], cmd="run"))
+    executing = {'2': 3, '3': 0, '4': 3}
+    retired = []
+    parallel_manager.server = munch.Munch(
+        state=ServerStates.SERVE_TESTS, worker_to_pid=executing, get_connected_clients=lambda: list(executing),
+        get_num_unstarted_tests=lambda: 100, is_client_retired=lambda client_id: False,
+        get_num_executing_tests=executing.get, retire_client=retired.append)
+    parallel_manager._elastic_worker_ids = ['2', '3', '4']  # pylint: disable=protected-access
+    started = []
+    monkeypatch.setattr(parallel_manager, '_start_elastic_worker', lambda: started.append(True))
+    parallel_manager.check_elastic_scaling()
+    assert bool(started) == (expected_action == 'start')
+    # the idle worker is retired rather than the most recently started one
+    assert retired == (['3'] if expected_action == 'retire' else [])
+
+def test_elastic_scaling_invalid_thresholds(config_override):
+    config_override('parallel.elastic.enabled', True)
+    config_override('parallel.elastic.retire_load_per_cpu', 0.5)
+    with slash.assert_raises(InvalidConfiguraion):
+        ParallelManager(munch.Munch(argv=[], cmd="run"))
+
 def test_parallel_resume(parallel_suite):
     parallel_suite[0].when_run.fail()
     result = parallel_suite.run()
@@ -349,6 +458,137 @@ def test_timeout_no_request_to_server(config_override, runnable_test_dir):
             parallel_manager.start()
         assert 'No request sent to server' in caught.exception.args[0]
 
+def test_slow_result_ingestion_does_not_block_workers(config_override, tmpdir):
+    config_override("parallel.num_workers", 2)
+    tmpdir.join('test_file.py').write('def test_1():\n    pass\n\ndef test_2():\n    pass\n')
+    with Session() as session:
+        runnables = Loader().get_runnables(str(tmpdir))
+        parallel_manager = ParallelManager(munch.Munch(argv=[], cmd="run"))
+        session.parallel_manager = parallel_manager
+        reported = []
+
+        def report_test_end(test, result):  # pylint: disable=unused-argument
+            time.sleep(3)
+            reported.append(result)
+        session.reporter.report_test_end = report_test_end
+        parallel_manager.start_server_in_thread(runnables)
+        parallel_manager.try_connect()
+        proxies = [get_proxy(parallel_manager.server.address) for _ in range(2)]
+        for client_id, proxy in zip(['1', '2'], proxies):
+            proxy.connect(client_id, os.getpid())
+        parallel_manager.server.state = ServerStates.SERVE_TESTS
+        [(_, test_index)] = proxies[0].get_tests('1', 1)
+        result = Result()
+        result.mark_started()
+        start_time = time.time()
+        proxies[0].finished_tests_batch('1', [result.serialize()])
+        assert proxies[1].get_tests('2', 1) not in (NO_MORE_TESTS, PROTOCOL_ERROR)
+        assert time.time() - start_time < 2
+        assert not reported
+        get_proxy(parallel_manager.server.address).stop_serve()
+        parallel_manager.server_thread.join()
+        assert len(reported) == 1
+        assert test_index in parallel_manager.server.finished_tests
+
+def _start_server_with_clients(session, path, client_ids):
+    runnables = Loader().get_runnables(str(path))
+    parallel_manager = ParallelManager(munch.Munch(argv=[], cmd="run"))
+    session.parallel_manager = parallel_manager
+    parallel_manager.start_server_in_thread(runnables)
+    parallel_manager.try_connect()
+    proxies = [get_proxy(parallel_manager.server.address) for _ in client_ids]
+    for client_id, proxy in zip(client_ids, proxies):
+        proxy.connect(client_id, os.getpid())
+    parallel_manager.server.state = ServerStates.SERVE_TESTS
+    return parallel_manager, proxies
+
+def _send_result(proxy, client_id):
+    [(_, test_index)] = proxy.get_tests(client_id, 1)
+    result = Result()
+    result.mark_started()
+    result.mark_finished()
+    proxy.finished_tests_batch(client_id, [result.serialize()])
+    return test_index
+
+def test_worker_hooks_do_not_see_ingested_test_context(config_override, tmpdir):
+    config_override("parallel.num_workers", 2)
+    tmpdir.join('test_file.py').write('def test_1():\n    pass\n\ndef test_2():\n    pass\n')
+    distributed_in_contexts = []
+
+    @slash.hooks.test_distributed.register  # pylint: disable=no-member
+    def test_distributed(test_logical_id, worker_session_id):  # pylint: disable=unused-variable, unused-argument
+        distributed_in_contexts.append(slash.context.test)
+
+    with Session() as session:
+        session.reporter.report_test_end = lambda test, result: time.sleep(1)
+        parallel_manager, proxies = _start_server_with_clients(session, tmpdir, ['1', '2'])
+        _send_result(proxies[0], '1')
+        _send_result(proxies[1], '2')
+        get_proxy(parallel_manager.server.address).stop_serve()
+        parallel_manager.server_thread.join()
+    assert distributed_in_contexts == [None, None]
+
+def test_result_ingestion_survives_errors(config_override, tmpdir, monkeypatch):
+    config_override("parallel.num_workers", 1)
+    tmpdir.join('test_file.py').write('def test_1():\n    pass\n\ndef test_2():\n    pass\n')
+    orig_get_test_context = slash.parallel.server._get_test_context  # pylint: disable=protected-access
+    failing = []
+
+    def get_test_context(test, **kwargs):
+        if not failing:
+            failing.append(test)
+            raise RuntimeError('Cannot create result')
+        return orig_get_test_context(test, **kwargs)
+    monkeypatch.setattr(slash.parallel.server, '_get_test_context', get_test_context)
+    with Session() as session:
+        parallel_manager, [proxy] = _start_server_with_clients(session, tmpdir, ['1'])
+        test_indices = [_send_result(proxy, '1') for _ in range(2)]
+        get_proxy(parallel_manager.server.address).stop_serve()
+        parallel_manager.server_thread.join()
+    assert sorted(parallel_manager.server.finished_tests) == sorted(test_indices)
+    # only the recorded result is counted in the average test duration
+    assert parallel_manager.server._num_timed_tests == 1  # pylint: disable=protected-access
+
+def test_resume_state_written_as_worker_results_arrive(config_override, tmpdir):
+    config_override("parallel.num_workers", 1)
+    tmpdir.join('test_file.py').write('def test_1():\n    pass\n\ndef test_2():\n    pass\n')
+    with Session() as session:
+        parallel_manager, [proxy] = _start_server_with_clients(session, tmpdir, ['1'])
+        writer = session.resume_state_writer = ResumeStateWriter(session.id)
+        writer.start(parallel_manager.server.tests)
+        test_index = _send_result(proxy, '1')
+        get_proxy(parallel_manager.server.address).stop_serve()
+        parallel_manager.server_thread.join()
+        writer.flush()
+        statuses = {test.address_in_file: test.status for test in get_tests_locally(session.id)}
+        writer.close(session.results, parallel_manager.server.tests)
+    finished_test = parallel_manager.server.tests[test_index]
+    assert statuses == {test.__slash__.address_in_file: ResumeTestStatus.SUCCESS if test is finished_test
+                        else ResumeTestStatus.PLANNED for test in parallel_manager.server.tests}
+
+def test_hung_worker_timeout(runnable_test_dir, config_override, monkeypatch):
+    config_override("parallel.communication_timeout_secs", 1)
+    config_override("parallel.num_workers", 1)
+    with Session() as session:
+        runnables = Loader().get_runnables(str(runnable_test_dir))
+        parallel_manager = ParallelManager(munch.Munch(argv=[], cmd="run"))
+        session.parallel_manager = parallel_manager
+        timed_out = []
+        monkeypatch.setattr(parallel_manager.workers['1'], 'handle_timeout', lambda: timed_out.append(True))
+        parallel_manager.start_server_in_thread(runnables)
+        parallel_manager.try_connect()
+        # the worker process is alive (and its exit is watched), but it does not send any request
+        get_proxy(parallel_manager.server.address).connect('1', os.getpid())
+        parallel_manager.check_worker_timed_out()
+        assert parallel_manager.server.get_connected_clients() == {'1'}
+        time.sleep(1.5)
+        parallel_manager.check_worker_timed_out()
+        assert not parallel_manager.server.get_connected_clients()
+        assert timed_out
+        assert parallel_manager.server.worker_error_reported
+        get_proxy(parallel_manager.server.address).stop_serve()
+        parallel_manager.server_thread.join()
+
 def test_children_not_connected_timeout(runnable_test_dir, config_override):
     config_override("parallel.worker_connect_timeout", 0)
     config_override("parallel.num_workers", 1)
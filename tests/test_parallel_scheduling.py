@@ -0,0 +1,173 @@
+# pylint: disable=redefined-outer-name
+import munch
+import pytest
+
+import slash
+import slash.parallel.scheduling
+import slash.resuming
+from slash.loader import Loader
+from slash.parallel.scheduling import DurationAwareSchedule, get_fixture_group_keys
+from slash.parallel.tests_distributer import TestsDistributer
+from slash.parallel.worker_configuration import ProcessWorkerConfiguration
+from slash.resuming import get_test_statistics
+
+from .utils.suite_writer import Suite
+
+
+def test_durations_saved(suite):
+    summary = suite.run()
+    file_names = {result.test_metadata.file_path for result in summary.session.results.iter_test_results()}
+    statistics = get_test_statistics(file_names)
+    for result in summary.session.results.iter_test_results():
+        assert statistics[result.test_metadata.file_path, result.test_metadata.address_in_file].p50_duration is not None
+
+
+def _make_test(file_path, address_in_file):
+    return munch.Munch(__slash__=munch.Munch(file_path=file_path, address_in_file=address_in_file))
+
+
+@pytest.fixture
+def durations(monkeypatch):
+    returned = {}
+    monkeypatch.setattr(slash.parallel.scheduling, 'get_test_statistics', lambda file_names: {
+        key: slash.resuming.TestStatistics(num_runs=1, p50_duration=duration, p95_duration=duration, failure_rate=0,
+                                           flip_rate=None, last_status='success', last_run_at=None)
+        for key, duration in returned.items()})
+    return returned
+
+
+def test_schedule_longest_files_first(durations):
+    tests = [_make_test(file_path, name) for file_path in ('a.py', 'b.py', 'c.py') for name in ('x', 'y')]
+    durations.update({('a.py', 'x'): 1, ('a.py', 'y'): 1, ('b.py', 'x'): 10, ('c.py', 'x'): 3, ('c.py', 'y'): 3})
+    schedule = DurationAwareSchedule(tests, num_workers=2)
+    # b.py:y has no history, so it is assumed to take the median known duration
+    assert schedule.order == [2, 3, 4, 5, 0, 1]
+    assert schedule.num_known_durations == 5
+    assert schedule.predicted_makespan == 13
+
+
+def test_schedule_without_history(durations):  # pylint: disable=unused-argument
+    tests = [_make_test('{}.py'.format(index), 'x') for index in range(5)]
+    schedule = DurationAwareSchedule(tests, num_workers=2)
+    assert schedule.order == list(range(5))
+    assert schedule.predicted_makespan == 0
+
+
+@pytest.fixture
+def distributer_factory():
+    with slash.Session() as session:
+        session.parallel_manager = munch.Munch(workers={})
+        for worker_id in ('1', '2'):
+            session.parallel_manager.workers[worker_id] = ProcessWorkerConfiguration(munch.Munch(argv=[], cmd='run'), worker_id)
+        yield TestsDistributer
+
+
+def test_distributer_file_affinity(distributer_factory):
+    affinity_keys = ['a', 'a', 'a', 'b', 'b', 'c']
+    distributer = distributer_factory(len(affinity_keys), affinity_keys=affinity_keys)
+    assert distributer.get_next_test_for_client('1') == 0
+    assert distributer.get_next_test_for_client('2') == 3
+    assert distributer.get_next_test_for_client('2') == 4
+    assert distributer.get_next_test_for_client('2') == 5
+    assert distributer.get_next_test_for_client('1') == 1
+    # once no free files remain, workers help others finish theirs
+    assert distributer.get_next_test_for_client('2') == 2
+    assert distributer.get_next_test_for_client('1') is None
+
+
+def test_distributer_steals_from_end_of_largest_group(distributer_factory):
+    affinity_keys = ['a'] * 4 + ['b'] * 2
+    distributer = distributer_factory(len(affinity_keys), affinity_keys=affinity_keys)
+    assert distributer.get_next_test_for_client('1') == 0
+    assert distributer.get_next_test_for_client('2') == 4
+    assert distributer.get_next_test_for_client('2') == 5
+    assert distributer.get_next_test_for_client('2') == 3
+    assert distributer.get_next_test_for_client('1') == 1
+    assert distributer.get_next_test_for_client('2') == 2
+    assert distributer.get_next_test_for_client('1') is None
+
+
+def test_distributer_steals_from_largest_remaining_group(distributer_factory):
+    affinity_keys = ['a'] * 2 + ['b'] * 4 + ['c'] * 3
+    workers_config = [ProcessWorkerConfiguration(munch.Munch(argv=[], cmd='run'), worker_id)
+                      for worker_id in ('1', '2', '3')]
+    distributer = distributer_factory(len(affinity_keys), affinity_keys=affinity_keys, workers_config=workers_config)
+    assert [distributer.get_next_test_for_client(client_id) for client_id in ('1', '2', '3', '1')] == [0, 2, 6, 1]
+    # b has 3 remaining tests and c has 2
+    assert distributer.get_next_test_for_client('1') == 5
+    assert distributer.get_next_test_for_client('2') == 3
+    assert distributer.get_next_test_for_client('1') == 4
+    # b is exhausted, so c is now the largest remaining group
+    assert distributer.get_next_test_for_client('1') == 8
+    assert distributer.get_next_test_for_client('3') == 7
+    assert distributer.get_next_test_for_client('2') is None
+
+
+def test_fixture_group_keys(tmpdir):
+    path = tmpdir.join('test_fixture_groups.py')
+    path.write("""
+import slash
+
+@slash.fixture(scope='module')
+@slash.parametrize('value', [1, 2])
+def module_fixture(value):
+    return value
+
+@slash.fixture
+def per_test_fixture(module_fixture):
+    return module_fixture
+
+@slash.parametrize('x', [1, 2])
+def test_indirect(per_test_fixture, x):
+    pass
+
+@slash.parametrize('x', [1, 2])
+def test_direct(module_fixture, x):
+    pass
+
+@slash.parametrize('x', [1, 2])
+def test_without_module_fixture(x):
+    pass
+""")
+    with slash.Session() as session:
+        tests = Loader().get_runnables(str(path))
+        keys = get_fixture_group_keys(tests, session.fixture_store)
+    keys_by_function = {}
+    for test, key in zip(tests, keys):
+        keys_by_function.setdefault(test.__slash__.function_name, []).append(key)
+    assert len(keys_by_function['test_indirect']) == 4
+    assert len(set(keys_by_function['test_indirect'])) == 2
+    assert set(keys_by_function['test_direct']) == set(keys_by_function['test_indirect'])
+    assert len(set(keys_by_function['test_without_module_fixture'])) == 1
+    assert len(set(keys)) == 3
+    assert {module_name for module_name, _ in keys} == {tests[0].__slash__.module_name}
+
+
+def test_distributer_order(distributer_factory):
+    distributer = distributer_factory(3, order=[2, 0, 1])
+    assert [distributer.get_next_test_for_client('1') for _ in range(3)] == [2, 0, 1]
+    assert not distributer.has_unstarted_tests()
+
+
+def test_parallel_schedule_by_duration():
+    suite = Suite(debug_info=False, is_parallel=True)
+    suite.populate(num_tests=10)
+    for _ in range(2):
+        summary = suite.run(num_workers=2, additional_args=['--parallel-schedule-by-duration'])
+        assert summary.session.results.get_num_successful() == 10
+
+
+def test_parallel_fixture_affinity():
+    suite = Suite(debug_info=False, is_parallel=True)
+    suite.populate(num_tests=10)
+    summary = suite.run(num_workers=2, additional_args=['--parallel-fixture-affinity'])
+    assert summary.session.results.get_num_successful() == 10
+
+
+def test_parallel_fixture_affinity_with_schedule_by_duration():
+    suite = Suite(debug_info=False, is_parallel=True)
+    suite.populate(num_tests=10)
+    for _ in range(2):
+        summary = suite.run(num_workers=2, additional_args=['--parallel-fixture-affinity',
+                                                            '--parallel-schedule-by-duration'])
+        assert summary.session.results.get_num_successful() == 10
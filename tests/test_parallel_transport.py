@@ -0,0 +1,102 @@
+import sys
+import threading
+
+import pytest
+
+from slash.exceptions import ParallelRemoteCallError
+from slash.parallel.transport import SERVER, UnixSocketTransport, get_transport
+
+if sys.platform.startswith("win"):
+    pytest.skip("does not run on windows", allow_module_level=True)
+
+
+class Instance(object):
+
+    def __init__(self):
+        super(Instance, self).__init__()
+        self.stopped = False
+        self.calls = []
+
+    def echo(self, value):
+        self.calls.append(value)
+        return value
+
+    def fail(self):
+        raise RuntimeError('failed on purpose')
+
+    def stop(self):
+        self.stopped = True
+
+    def _private(self):
+        pass
+
+
+@pytest.fixture(params=['xmlrpc', 'unix'], name='transport')
+def transport_fixture(request, config_override):
+    config_override('parallel.transport', request.param)
+    return get_transport()
+
+
+@pytest.fixture(name='served')
+def served_fixture(request, transport):
+    instance = Instance()
+    server, address = transport.create_server(SERVER, instance)
+
+    def serve():
+        try:
+            while not instance.stopped:
+                server.handle_request()
+        finally:
+            server.server_close()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    @request.addfinalizer
+    def cleanup():  # pylint: disable=unused-variable
+        transport.connect(address).stop()
+        thread.join()
+
+    return instance, address
+
+
+def test_calls(served, transport):
+    instance, address = served
+    proxy = transport.connect(address)
+    assert proxy.echo('a') == 'a'
+    assert proxy.echo([1, 2, None]) == [1, 2, None]
+    assert instance.calls == ['a', [1, 2, None]]
+
+
+def test_multiple_clients(served, transport):
+    instance, address = served
+    proxies = [transport.connect(address) for _ in range(3)]
+    for index, proxy in enumerate(proxies * 2):
+        assert proxy.echo(index) == index
+    assert instance.calls == list(range(6))
+
+
+def test_unix_transport_errors(served, transport):
+    if not isinstance(transport, UnixSocketTransport):
+        pytest.skip('Only relevant for the unix transport')
+    _, address = served
+    proxy = transport.connect(address)
+    with pytest.raises(ParallelRemoteCallError) as caught:
+        proxy.fail()
+    assert 'failed on purpose' in str(caught.value)
+    with pytest.raises(AttributeError):
+        proxy._private  # pylint: disable=protected-access, pointless-statement
+    assert proxy.echo(1) == 1
+
+
+def test_bytes(served, transport):
+    _, address = served
+    returned = transport.connect(address).echo(b'\x00\x01')
+    if isinstance(transport, UnixSocketTransport):
+        assert returned == b'\x00\x01'
+    else:
+        assert returned.data == b'\x00\x01'
+
+
+def test_unknown_transport():
+    with pytest.raises(ValueError):
+        get_transport('nonexistent')
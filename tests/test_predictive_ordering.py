@@ -0,0 +1,69 @@
+# pylint: disable=redefined-outer-name
+import os
+from datetime import datetime, timedelta
+
+import munch
+import pytest
+
+import slash
+from slash.loader import Loader
+from slash.ordering import get_predictive_order
+from slash.resuming import ResumeTestStatus
+
+
+def _make_test(file_path, address_in_file, repeat_all_index=0):
+    return munch.Munch(__slash__=munch.Munch(file_path=file_path, address_in_file=address_in_file,
+                                             repeat_all_index=repeat_all_index, is_interactive=lambda: False))
+
+
+@pytest.fixture
+def test_files(tmpdir):
+    returned = []
+    for name in ('a', 'b', 'c', 'd'):
+        path = tmpdir.join('test_{}.py'.format(name))
+        path.write('')
+        os.utime(str(path), (0, 0))
+        returned.append(str(path))
+    return returned
+
+
+def test_predictive_order(history, test_files):
+    file_a, file_b, file_c, file_d = test_files
+    tests = [_make_test(file_path, name) for file_path in test_files for name in ('x', 'y')]
+    now = datetime.now()
+    history.update({
+        (file_a, 'x'): dict(failure_rate=0, last_status=ResumeTestStatus.SUCCESS, last_run_at=now),
+        (file_b, 'x'): dict(failure_rate=0.5, last_status=ResumeTestStatus.SUCCESS, last_run_at=now),
+        (file_b, 'y'): dict(failure_rate=0.5, last_status=ResumeTestStatus.FAILED, last_run_at=now),
+        (file_c, 'x'): dict(failure_rate=0, last_status=ResumeTestStatus.SUCCESS, last_run_at=now - timedelta(days=1)),
+    })
+    # c changed since its tests last ran, and d never ran
+    os.utime(file_c, None)
+    assert [test.__slash__.file_path for test in get_predictive_order(tests)[::2]] == [file_b, file_c, file_d, file_a]
+    assert get_predictive_order(tests)[:2] == tests[2:4]
+
+
+def test_predictive_order_keeps_repetitions_apart(history, test_files):
+    file_a, file_b = test_files[:2]
+    history[file_a, 'x'] = dict(failure_rate=0, last_status=ResumeTestStatus.SUCCESS, last_run_at=datetime.now())
+    history[file_b, 'x'] = dict(failure_rate=1, last_status=ResumeTestStatus.FAILED, last_run_at=datetime.now())
+    tests = [_make_test(file_path, 'x', repeat_all_index) for repeat_all_index in range(2)
+             for file_path in (file_a, file_b)]
+    assert get_predictive_order(tests) == [tests[1], tests[0], tests[3], tests[2]]
+
+
+def test_loader_predictive_order(suite, history, config_override):
+    suite.debug_info = False
+    path = suite.commit()
+    with slash.Session():
+        tests = Loader().get_runnables(path)
+    last_file = tests[-1].__slash__.file_path
+    for test in tests:
+        history[test.__slash__.file_path, test.__slash__.address_in_file] = dict(
+            last_status=ResumeTestStatus.FAILED if test.__slash__.file_path == last_file else ResumeTestStatus.SUCCESS,
+            last_run_at=datetime.now())
+    config_override('run.predictive_order', True)
+    with slash.Session():
+        ordered = Loader().get_runnables(path)
+    assert ordered[0].__slash__.file_path == last_file
+    assert sorted(test.__slash__.address for test in ordered) == sorted(test.__slash__.address for test in tests)
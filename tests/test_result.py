@@ -6,7 +6,7 @@ from slash import Session
 from slash.core.result import Result, SessionResults
 from slash.exception_handling import handling_exceptions
 
-from .utils import TestCase, run_tests_assert_success
+from .utils import TestCase, run_tests_assert_success, run_tests_in_session
 
 
 
@@ -100,6 +100,88 @@ def test_has_skips(suite):
     assert results[1].has_skips()
 
 
+def test_session_results_counts(tmpdir):
+    tests_file = tmpdir.join('test_counts.py')
+    tests_file.write("""
+import slash
+
+def test_success():
+    pass
+
+def test_failure():
+    slash.add_failure('failure')
+
+def test_error_and_failure():
+    slash.add_failure('failure')
+    slash.add_error('error')
+
+def test_skip():
+    slash.skip_test('skipped')
+
+@slash.requires(False)
+def test_not_run():
+    pass
+""")
+    with Session() as session:
+        with session.get_started_context():
+            slash.runner.run_tests(slash.loader.Loader().get_runnables(str(tests_file)))
+        session.results.global_result.add_error('session error')
+        assert not session.results.is_interrupted()
+        [success_result] = [result for result in session.results.iter_test_results() if result.is_success()]
+        success_result.mark_interrupted()
+
+    results = session.results
+    test_results = list(results.iter_test_results())
+    all_results = list(results.iter_all_results())
+    assert results.get_num_started() == sum(result.is_started() for result in test_results) == 4
+    assert results.get_num_successful() == sum(result.is_success_finished() for result in test_results) == 0
+    assert results.get_num_errors() == sum(result.is_error() for result in all_results) == 2
+    assert results.get_num_failures() == sum(result.is_just_failure() for result in all_results) == 1
+    assert results.get_num_skipped() == sum(result.is_skip() for result in all_results) == 2
+    assert results.get_num_skipped(include_not_run=False) == 1
+    assert results.get_num_not_run() == sum(result.is_not_run() for result in test_results) == 1
+    assert results.is_interrupted()
+    assert not results.is_success(allow_skips=True)
+
+
+def test_session_results_lookups(tmpdir):
+    tests_dir = tmpdir.join('tests')
+    for file_name in ('test_a.py', 'test_b.py'):
+        tests_dir.join(file_name).write("""
+import slash
+
+@slash.parametrize('outcome', ['success', 'failure', 'skip'])
+def test_something(outcome):
+    if outcome == 'failure':
+        slash.add_failure('failure')
+    elif outcome == 'skip':
+        slash.skip_test('skipped')
+""", ensure=True)
+    session = run_tests_in_session(str(tests_dir))
+    results = session.results
+    all_results = list(results.iter_test_results())
+    assert len(all_results) == 6
+    assert [results[index] for index in range(len(results))] == all_results
+    assert results[-1] is all_results[-1]
+    assert results[2:4] == all_results[2:4]
+    assert [results.index(result) for result in all_results] == list(range(6))
+    for result in all_results:
+        assert results.get_results_by_address(result.test_metadata.address) == [result]
+    assert results.get_results_by_address('nonexistent') == []
+    file_path = all_results[0].test_metadata.file_path
+    assert results.get_results_by_file(file_path) == [result for result in all_results
+                                                      if result.test_metadata.file_path == file_path]
+    assert list(results.iter_test_results('failure')) == [result for result in all_results if result.is_just_failure()]
+    assert list(results.iter_test_results('failure', 'skip')) == \
+        [result for result in all_results if result.is_just_failure() or result.is_skip()]
+    assert list(results.iter_test_results('success')) == [result for result in all_results
+                                                          if result.is_success_finished()]
+    with pytest.raises(ValueError):
+        results.iter_test_results('nonexistent')
+    with pytest.raises(ValueError):
+        results.index(Result())
+
+
 def test_result_data_is_unique():
 
     class SampleTest(slash.Test):
@@ -0,0 +1,103 @@
+import pickle
+
+import pytest
+import slash
+from slash.core.result import Result
+from slash.core.result_serialization import FORMAT_VERSION_KEY, get_serialized_outcome
+
+from .utils import run_tests_in_session
+
+
+def _get_result(test_func):
+    session = run_tests_in_session(test_func)
+    [returned] = session.results.iter_test_results()
+    return returned
+
+
+def _deserialize(result_dict):
+    returned = Result()
+    with slash.Session():
+        returned.deserialize(result_dict)
+    return returned
+
+
+def test_failure_round_trip():
+
+    def test_failing():
+        value = 'some value'
+        slash.context.result.data['key'] = value
+        slash.context.result.details.set('detail', 1)
+        slash.add_error('manual error')
+        assert value == 'other value'
+
+    result = _get_result(test_failing)
+    deserialized = _deserialize(result.serialize())
+    assert deserialized.is_started() and deserialized.is_finished()
+    assert deserialized.get_duration() == result.get_duration()
+    assert deserialized.data == {'key': 'some value'}
+    assert deserialized.details.all() == {'detail': 1}
+    errors = deserialized.get_errors()
+    assert len(errors) == 1
+    error = errors[0]
+    assert error.message == 'manual error'
+    assert error.exception_type is None
+    failures = deserialized.get_failures()
+    assert len(failures) == 1
+    failure = failures[0]
+    original_failure = result.get_failures()[0]
+    assert failure.exception_type is AssertionError
+    assert failure.message == original_failure.message
+    assert failure.time == original_failure.time
+    assert failure.is_failure() and not failure.is_fatal()
+    assert [frame.to_dict() for frame in failure.traceback.frames] == \
+        [frame.to_dict() for frame in original_failure.traceback.frames]
+    assert failure.traceback.cause.func_name == 'test_failing'
+    assert get_serialized_outcome(result.serialize()) == (False, False)
+
+
+def test_fatal_error_and_skip():
+
+    def test_fatal():
+        slash.add_error('fatal error').mark_fatal()
+        slash.skip_test('skipped')
+
+    result = _get_result(test_fatal)
+    deserialized = _deserialize(result.serialize())
+    assert deserialized.has_fatal_errors()
+    assert deserialized.get_skips() == ['skipped']
+    assert get_serialized_outcome(result.serialize()) == (False, True)
+
+
+def test_traceback_variables_omitted(config_override):
+
+    def test_failing():
+        value = 'x' * 1000  # pylint: disable=unused-variable
+        assert False
+
+    result = _get_result(test_failing)
+    with_variables = result.serialize()
+    config_override('parallel.result_traceback_variables', False)
+    without_variables = result.serialize()
+    assert len(without_variables['payload']) < len(with_variables['payload'])
+    failures = _deserialize(without_variables).get_failures()
+    assert len(failures) == 1
+    failure = failures[0]
+    assert failure.traceback.cause.func_name == 'test_failing'
+    assert failure.traceback.cause.to_dict()['locals'] == {}
+
+
+def test_legacy_format():
+    result = Result()
+    result.mark_started()
+    result.add_skip('reason')
+    legacy_dict = {key: pickle.dumps(value) for key, value in vars(result).items()
+                   if key not in Result.pickle_key_blacklist}
+    assert get_serialized_outcome(legacy_dict) == (True, False)
+    assert _deserialize(legacy_dict).get_skips() == ['reason']
+
+
+def test_unsupported_format_version():
+    result_dict = Result().serialize()
+    result_dict[FORMAT_VERSION_KEY] += 1
+    with pytest.raises(ValueError):
+        get_serialized_outcome(result_dict)
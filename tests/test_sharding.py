@@ -0,0 +1,118 @@
+# pylint: disable=redefined-outer-name
+from io import StringIO
+
+import munch
+import pytest
+
+import slash
+import slash.resuming
+import slash.sharding
+from slash.exceptions import InvalidConfiguraion
+from slash.frontend.slash_list import slash_list
+from slash.loader import Loader
+from slash.sharding import ShardPlan, load_durations_file, save_durations_file
+
+
+def _make_test(file_path, address_in_file):
+    return munch.Munch(__slash__=munch.Munch(file_path=file_path, address_in_file=address_in_file))
+
+
+def test_shards_balanced_by_durations():
+    tests = [_make_test(file_path, name) for file_path in ('a.py', 'b.py', 'c.py', 'd.py') for name in ('x', 'y')]
+    durations = {('a.py', 'x'): 10, ('a.py', 'y'): 10, ('b.py', 'x'): 12, ('c.py', 'x'): 4, ('c.py', 'y'): 4,
+                 ('d.py', 'x'): 3, ('d.py', 'y'): 3}
+    plan = ShardPlan(tests, 2, durations=durations)
+    assert plan.by_durations
+    # b.py:y has no history, so it is assumed to take the median known duration
+    assert plan.loads == [26, 24]
+    assert plan.get_shard(0) == tests[:2] + tests[6:]
+    assert plan.get_shard(1) == tests[2:6]
+    assert plan.num_files == [2, 2]
+
+
+def test_shards_balanced_by_counts(monkeypatch):
+    tests = [_make_test('{}.py'.format(index), name) for index in range(4) for name in ['x'] * (index + 1)]
+
+    def get_test_statistics(file_names):  # pylint: disable=unused-argument
+        raise AssertionError('The local history should not be used, since it differs between machines')
+
+    monkeypatch.setattr(slash.sharding, 'get_test_statistics', get_test_statistics)
+    monkeypatch.setattr(slash.resuming, 'get_test_statistics', get_test_statistics)
+    plan = ShardPlan(tests, 2)
+    assert not plan.by_durations
+    assert plan.loads == [5, 5]
+    assert [test.__slash__.file_path for test in plan.get_shard(0)] == ['0.py'] + ['3.py'] * 4
+    assert ShardPlan(tests, 2).shard_indices == plan.shard_indices
+
+
+def test_loader_runs_configured_shard(suite, config_override):
+    suite.debug_info = False
+    path = suite.commit()
+    with slash.Session():
+        all_addresses = [test.__slash__.address for test in Loader().get_runnables(path)]
+    num_shards = 3
+    config_override('run.sharding.count', num_shards)
+    shards = []
+    for shard_index in range(num_shards):
+        config_override('run.sharding.index', shard_index)
+        with slash.Session():
+            shards.append([test.__slash__.address for test in Loader().get_runnables(path)])
+    assert sorted(address for shard in shards for address in shard) == sorted(all_addresses)
+    files_by_shard = [{address.split(':')[0] for address in shard} for shard in shards]
+    all_files = set.union(*files_by_shard)
+    assert sum(len(files) for files in files_by_shard) == len(all_files)
+    assert sum(1 for shard in shards if shard) == min(num_shards, len(all_files))
+
+
+def test_durations_file(tmpdir, history):
+    tests = [_make_test(file_path, name) for file_path in ('a.py', 'b.py') for name in ('x', 'y')]
+    history.update({('a.py', 'x'): dict(p50_duration=10), ('b.py', 'x'): dict(p50_duration=2),
+                    ('b.py', 'y'): dict(p50_duration=3)})
+    path = str(tmpdir.join('durations.json'))
+    save_durations_file(path, tests)
+    durations = load_durations_file(path)
+    assert durations == {('a.py', 'x'): 10, ('b.py', 'x'): 2, ('b.py', 'y'): 3}
+    assert ShardPlan(tests, 2, durations=durations).loads == [13, 5]
+
+
+def test_invalid_durations_file(tmpdir):
+    path = tmpdir.join('durations.json')
+    path.write('[1, 2]')
+    with pytest.raises(InvalidConfiguraion):
+        load_durations_file(str(path))
+    with pytest.raises(InvalidConfiguraion):
+        load_durations_file(str(tmpdir.join('nonexistent.json')))
+
+
+def test_invalid_shard_index(suite, config_override):
+    suite.debug_info = False
+    path = suite.commit()
+    config_override('run.sharding.count', 2)
+    config_override('run.sharding.index', 2)
+    with slash.Session():
+        with pytest.raises(InvalidConfiguraion):
+            Loader().get_runnables(path)
+
+
+def test_slash_list_shards_preview(suite):
+    suite.debug_info = False
+    path = suite.commit()
+    report_stream = StringIO()
+    assert slash_list(munch.Munch(argv=[path, '--only-tests', '--shard-count', '2']), report_stream) == 0
+    output = report_stream.getvalue()
+    assert 'Shards (balanced by test counts)' in output
+    assert 'Shard 0: ' in output and 'Shard 1: ' in output
+
+
+def test_slash_list_shards_preview_by_durations(suite, tmpdir):
+    suite.debug_info = False
+    path = suite.commit()
+    suite.run(commit=False)
+    durations_path = str(tmpdir.join('durations.json'))
+    assert slash_list(munch.Munch(argv=[path, '--only-tests', '--save-shard-durations', durations_path]),
+                      StringIO()) == 0
+    assert load_durations_file(durations_path)
+    report_stream = StringIO()
+    assert slash_list(munch.Munch(argv=[path, '--only-tests', '--shard-count', '2',
+                                        '--shard-durations-file', durations_path]), report_stream) == 0
+    assert 'Shards (balanced by durations)' in report_stream.getvalue()
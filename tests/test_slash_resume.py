@@ -1,7 +1,12 @@
 # pylint: disable=redefined-outer-name
+from datetime import datetime
+
 import pytest
 import slash
-from slash.resuming import (CannotResume, get_last_resumeable_session_id, get_tests_from_previous_session)
+from sqlalchemy import insert
+from slash.resuming import (CannotResume, ResumedTestData, ResumeStateWriter, ResumeTestStatus, get_tests_locally,
+                            get_test_statistics, _get_test_statistics, get_last_resumeable_session_id, get_tests_from_previous_session,
+                            TestHistoryEntry, _get_engine)
 
 
 def address_in_file(test):
@@ -76,6 +81,7 @@ def test_delete_old_sessions(suite, config_override):
     result = suite.run()
     assert result.session.id == get_last_resumeable_session_id()
     config_override('resume.state_retention_days', 0)
+    config_override('resume.state_cleanup_interval_hours', 0)
     result = suite.run()
     with pytest.raises(CannotResume):
         get_last_resumeable_session_id()
@@ -231,3 +237,121 @@ def test_no_skipped(suite, no_skipped, unstarted_only, config_override):
         assert num_planned == expected_planned
         assert num_failed == expected_failed
         assert num_skipped == expected_skipped
+
+
+def test_resume_loads_each_file_once(tmpdir, monkeypatch):
+    test_file = tmpdir.join('test_file.py')
+    test_file.write("""
+import slash
+
+def test_a():
+    pass
+
+@slash.parametrize('param', [1, 2, 3])
+def test_b(param):
+    pass
+""")
+    loaded_paths = []
+    orig_iter_path = slash.loader.Loader._iter_path  # pylint: disable=protected-access
+
+    def _iter_path(self, path):
+        loaded_paths.append(path)
+        return orig_iter_path(self, path)
+
+    monkeypatch.setattr(slash.loader.Loader, '_iter_path', _iter_path)
+    resumed = [ResumedTestData(str(test_file), 'test_b', variation=None),
+               ResumedTestData(str(test_file), 'test_a'),
+               ResumedTestData(str(test_file), 'test_b', variation=None),
+               ResumedTestData(str(test_file), 'test_a')]
+    with slash.Session():
+        [test_b_2] = [test for test in slash.loader.Loader().get_runnables(str(test_file))
+                      if test.get_variation().values.get('param') == 2]
+        resumed[0].variation = test_b_2.get_variation().id
+        del loaded_paths[:]
+        tests = slash.loader.Loader().get_runnables(resumed)
+    assert loaded_paths == [str(test_file)]
+    assert sorted((test.__slash__.address_in_file, test.get_variation().values.get('param', 0)) for test in tests) == \
+        [('test_a', 0), ('test_a', 0), ('test_b', 1), ('test_b', 2), ('test_b', 2), ('test_b', 3)]
+    assert len({test.__slash__.id for test in tests}) == len(tests)
+
+
+def test_resume_state_written_while_running(tmpdir):
+    test_file = tmpdir.join('test_file.py')
+    test_file.write("""
+import slash
+
+def test_success():
+    pass
+
+def test_failure():
+    assert False
+
+def test_skip():
+    slash.skip_test()
+""")
+    with slash.Session() as session:
+        tests = slash.loader.Loader().get_runnables(str(test_file))
+        writer = ResumeStateWriter(session.id)
+        writer.start(tests)
+        writer.flush()
+        assert [test.status for test in get_tests_locally(session.id)] == [ResumeTestStatus.PLANNED] * 3
+        with session.get_started_context():
+            slash.runner.run_tests(tests)
+        writer.flush()
+        expected_statuses = {'test_success': ResumeTestStatus.SUCCESS, 'test_failure': ResumeTestStatus.FAILED,
+                             'test_skip': ResumeTestStatus.SKIPPED}
+        # the last test is only recorded when the session ends
+        assert {test.address_in_file: test.status for test in get_tests_locally(session.id)} == \
+            dict(expected_statuses, **{tests[-1].__slash__.address_in_file: ResumeTestStatus.PLANNED})
+        writer.close(session.results, tests)
+    assert {test.address_in_file: test.status for test in get_tests_locally(session.id)} == expected_statuses
+
+
+def test_test_history_saved(suite):
+    fail_index = len(suite) // 2
+    suite[fail_index].when_run.fail()
+    summary = suite.run()
+    results = list(summary.session.results.iter_test_results())
+    statistics = get_test_statistics({result.test_metadata.file_path for result in results})
+    for result in results:
+        test_statistics = statistics[result.test_metadata.file_path, result.test_metadata.address_in_file]
+        assert test_statistics.num_runs == 1
+        assert test_statistics.p50_duration <= test_statistics.p95_duration
+        if result.is_skip():
+            continue
+        assert test_statistics.failure_rate == (0 if result.is_success() else 1)
+        assert test_statistics.flip_rate is None
+
+
+def test_test_statistics_max_runs(tmpdir):
+    file_name = str(tmpdir.join('test_history.py'))
+    now = datetime.now()
+    with _get_engine().begin() as conn:
+        conn.execute(insert(TestHistoryEntry), [
+            {'file_name': file_name, 'address_in_file': address_in_file, 'session_id': 'session_{}'.format(index),
+             'status': status, 'duration': index, 'created_at': now}
+            for index, status in enumerate([ResumeTestStatus.FAILED, ResumeTestStatus.SUCCESS, ResumeTestStatus.SUCCESS])
+            for address_in_file in ('test_a', 'test_b')])
+    for max_runs, expected_num_runs, expected_failure_rate in [(1, 1, 0), (2, 2, 0), (3, 3, 1 / 3), (4, 3, 1 / 3)]:
+        statistics = get_test_statistics([file_name], max_runs=max_runs)
+        assert set(statistics) == {(file_name, 'test_a'), (file_name, 'test_b')}
+        for test_statistics in statistics.values():
+            assert test_statistics.num_runs == expected_num_runs
+            assert test_statistics.failure_rate == expected_failure_rate
+            assert test_statistics.last_status == ResumeTestStatus.SUCCESS
+            assert test_statistics.p95_duration == 2
+
+def test_test_statistics():
+    now = datetime.now()
+    runs = [(ResumeTestStatus.FAILED, 4, now), (ResumeTestStatus.SUCCESS, 1, now), (ResumeTestStatus.SKIPPED, 0, now),
+            (ResumeTestStatus.SUCCESS, 2, now), (ResumeTestStatus.FAILED, 3, now), (ResumeTestStatus.SUCCESS, None, now)]
+    statistics = _get_test_statistics(runs)
+    assert statistics.num_runs == 6
+    assert statistics.p50_duration == 2
+    assert statistics.p95_duration == 4
+    assert statistics.failure_rate == 2 / 5
+    assert statistics.flip_rate == 3 / 4
+    assert statistics.last_status == ResumeTestStatus.FAILED
+    assert statistics.last_run_at == now
+    assert _get_test_statistics([(ResumeTestStatus.SKIPPED, None, now)]) == \
+        (1, None, None, None, None, ResumeTestStatus.SKIPPED, now)
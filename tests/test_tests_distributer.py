@@ -0,0 +1,66 @@
+import random
+
+from slash.parallel.tests_distributer import TestsDistributer
+
+
+class WorkerConfig(object):
+
+    def __init__(self, worker_id, excluded=(), forced=()):
+        super(WorkerConfig, self).__init__()
+        self._worker_id = worker_id
+        self._excluded = set(excluded)
+        self._forced = set(forced)
+
+    def get_worker_id(self):
+        return self._worker_id
+
+    def get_excluded_tests(self):
+        return self._excluded
+
+    def get_forced_tests(self):
+        return self._forced
+
+
+def _distribute(distributer, worker_ids):
+    returned = {worker_id: [] for worker_id in worker_ids}
+    active = list(worker_ids)
+    while active:
+        for worker_id in list(active):
+            test_index = distributer.get_next_test_for_client(worker_id)
+            if test_index is None:
+                active.remove(worker_id)
+            else:
+                returned[worker_id].append(test_index)
+    return returned
+
+
+def test_exclusions_and_forced_tests():
+    num_tests = 20000
+    rand = random.Random(0)
+    workers = [WorkerConfig('1', excluded=[i for i in range(num_tests) if i % 100]),
+               WorkerConfig('2', forced=range(0, num_tests, 7)),
+               WorkerConfig('3', excluded=range(num_tests // 2)),
+               WorkerConfig('4', excluded=[i for i in range(num_tests) if i % 7 and rand.random() < 0.5])]
+    distributer = TestsDistributer(num_tests, workers_config=workers)
+    distributed = _distribute(distributer, [worker.get_worker_id() for worker in workers])
+
+    assert sorted(i for indices in distributed.values() for i in indices) == list(range(num_tests))
+    assert not distributer.has_unstarted_tests()
+    assert distributer.get_unstarted_tests() == []
+    for worker in workers:
+        indices = distributed[worker.get_worker_id()]
+        assert indices == sorted(indices)
+        assert not set(indices) & worker.get_excluded_tests()
+    assert set(distributed['2']) >= set(range(0, num_tests, 7))
+
+
+def test_tests_excluded_on_all_workers_remain_unstarted():
+    workers = [WorkerConfig('1', excluded=[1, 3]), WorkerConfig('2', excluded=[1])]
+    distributer = TestsDistributer(5, workers_config=workers)
+    distributed = _distribute(distributer, ['1', '2'])
+    assert sorted(distributed['1'] + distributed['2']) == [0, 2, 3, 4]
+    assert distributer.has_unstarted_tests()
+    assert distributer.get_unstarted_tests() == [1]
+    distributer.clear_unstarted_tests()
+    assert not distributer.has_unstarted_tests()
+    assert distributer.get_next_test_for_client('1') is None
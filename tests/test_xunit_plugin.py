@@ -6,6 +6,11 @@ import pytest
 
 from xml.etree import ElementTree
 
+from slash.plugins.builtin import xunit
+from slash.plugins.builtin.xunit import merge_xunit_files
+
+from .utils import run_tests_in_session
+
 
 def test_xunit_plugin(results, xunit_filename): # pylint: disable=unused-argument
     assert os.path.exists(xunit_filename), 'xunit file not created'
@@ -13,6 +18,39 @@ def test_xunit_plugin(results, xunit_filename): # pylint: disable=unused-argumen
     validate_xml(xunit_filename, results=results)
 
 
+def test_xunit_plugin_streaming(suite, suite_test, test_event, xunit_filename, config_override):
+    config_override('plugin_config.xunit.streaming', True)
+    test_event(suite_test)
+    summary = suite.run()
+    validate_xml(xunit_filename, results=summary)
+
+
+def test_xunit_plugin_streaming_partial_report(tmpdir, xunit_filename, config_override):
+    config_override('plugin_config.xunit.streaming', True)
+    tests_file = tmpdir.join('test_partial.py')
+    tests_file.write("""
+import slash
+from xml.etree import ElementTree
+
+def test_1():
+    pass
+
+def test_2():
+    slash.add_failure('failure')
+
+def test_3():
+    root = ElementTree.parse({!r}).getroot()
+    assert [child.tag for child in root] == ['testcase', 'testcase']
+    assert root.get('tests') == '2'
+    assert root.get('failures') == '1'
+""".format(xunit_filename))
+    session = run_tests_in_session(str(tests_file))
+    assert session.results.get_num_successful() == 2
+    root = validate_xml(xunit_filename)
+    assert len(root) == 3
+    assert root.get('tests') == '3'
+
+
 def test_session_errors(suite, xunit_filename):
     # pylint: disable=unused-argument
 
@@ -164,6 +202,48 @@ def test_xunit_parallel_suite(parallel_suite, xunit_filename, action):
         assert element.tag == action
 
 
+@pytest.mark.skipif(sys.platform == 'win32', reason="does not run on windows")
+def test_xunit_parallel_worker_shards(parallel_suite, xunit_filename, config_override):
+    config_override('plugin_config.xunit.worker_shards', True)
+    parallel_suite[2].when_run.fail()
+    parallel_suite[5].when_run.skip()
+    parallel_suite.run(num_workers=2, additional_args=['--with-xunit', '--xunit-filename', xunit_filename,
+                                                       '--xunit-worker-shards'])
+    root = validate_xml(xunit_filename, suite=parallel_suite)
+    assert root.get('failures') == '1'
+    assert root.get('skipped') == '1'
+    assert os.listdir(os.path.dirname(xunit_filename)) == [os.path.basename(xunit_filename)]
+
+
+def test_xunit_shard_not_copied_when_results_differ(tmpdir, xunit_filename, config_override):  # pylint: disable=unused-argument
+    config_override('plugin_config.xunit.streaming', True)
+    shard_filename = str(tmpdir.join('shard.xml'))
+    config_override('plugin_config.xunit.filename', shard_filename)
+    tests_file = tmpdir.join('test_shard.py')
+    tests_file.write('import slash\ndef test_1():\n    pass\ndef test_2():\n    slash.add_failure("failure")\n')
+    results = list(run_tests_in_session(str(tests_file)).results.iter_test_results())
+    assert xunit._get_complete_shard(shard_filename, results) is not None  # pylint: disable=protected-access
+    # for instance, an error added by the parent when the worker timed out
+    results[0].add_error('added by the parent')
+    assert xunit._get_complete_shard(shard_filename, results) is None  # pylint: disable=protected-access
+
+
+def test_merge_xunit_files(tmpdir, xunit_filename, config_override):
+    config_override('plugin_config.xunit.streaming', True)
+    shard_filenames = []
+    for index, test_bodies in enumerate([['pass', 'slash.add_failure("failure")'], ['slash.skip_test()']]):
+        shard_filenames.append(str(tmpdir.join('shard{}.xml'.format(index))))
+        config_override('plugin_config.xunit.filename', shard_filenames[-1])
+        tests_file = tmpdir.join('test_shard{}.py'.format(index))
+        tests_file.write('import slash\n' + ''.join('def test_{}():\n    {}\n'.format(test_index, body)
+                                                    for test_index, body in enumerate(test_bodies)))
+        run_tests_in_session(str(tests_file))
+    merge_xunit_files(shard_filenames, xunit_filename)
+    root = validate_xml(xunit_filename)
+    assert len(root) == 3
+    assert [root.get(name) for name in ('tests', 'failures', 'skipped')] == ['3', '1', '1']
+
+
 def validate_xml(xml_filename, suite=None, results=None):
     with open(xml_filename) as f:
         etree = ElementTree.parse(f)